@@ -0,0 +1,125 @@
+from collections import deque
+
+import globals as g
+
+from logger import Logger
+from metrics import Counter
+
+logger = Logger(__name__)
+
+
+def condition_type(code: int) -> str:
+    """Classifies the condition code as in the backgrounds of the images: "fair" or "rain"."""
+    return "fair" if code in g.CONDITIONS_TYPES["fair"] else "rain"
+
+
+def observe(response: dict) -> dict:
+    """Extracts the observation, which is compared with the previous one, from the current
+    weather response of WeatherAPI."""
+    current = response["current"]
+    return {
+        "updated": current["last_updated_epoch"],
+        "code": current["condition"]["code"],
+        "condition": current["condition"]["text"],
+        "temp_c": current["temp_c"],
+    }
+
+
+def detect_alerts(
+    previous: dict, current: dict, highest: float
+) -> list[tuple[str, dict]]:
+    """Compares the observations of the location and returns the thresholds crossed between
+    them: the rain starting and the large drop of the temperature.
+
+    Args:
+        previous (dict): previous observation of the location.
+        current (dict): current observation of the location.
+        highest (float): highest temperature in the trailing window, the drop is measured
+            from it.
+
+    Returns:
+        list[tuple[str, dict]]: kinds of the alerts and their arguments for the messages.
+    """
+    alerts = []
+
+    if (
+        condition_type(previous["code"]) == "fair"
+        and condition_type(current["code"]) == "rain"
+    ):
+        alerts.append(("rain", {"condition": current["condition"]}))
+
+    drop = highest - current["temp_c"]
+    if drop >= g.ALERT_TEMPERATURE_DROP:
+        alerts.append(
+            ("temperature_drop", {"drop": round(drop, 1), "temp_c": current["temp_c"]})
+        )
+
+    return alerts
+
+
+class AlertWatcher:
+    """Keeps the last observation of each location subscribed to the alerts and compares it
+    with the new one on every poll, so the work of the poll depends on the number of the
+    distinct locations and the messages are sent only when the weather changes. The
+    temperatures of the trailing window are kept too, so the gradual drop over several polls
+    is detected. The window starts again after the alert about the drop, so it's not repeated
+    until the temperature drops further. The observations are kept in memory, after restart
+    the first poll only records them.
+    """
+
+    def __init__(self):
+        self.observations: dict[int, dict] = {}
+        # Observed times and temperatures of the trailing window by the locations.
+        self.temperatures: dict[int, deque[tuple[int, float]]] = {}
+
+    def update(self, location_id: int, response: dict) -> list[tuple[str, dict]]:
+        """Records the observation of the location and returns the alerts since the previous one.
+
+        Args:
+            location_id (int): ID of the location.
+            response (dict): current weather response of WeatherAPI.
+
+        Returns:
+            list[tuple[str, dict]]: kinds of the alerts and their arguments for the messages.
+        """
+        current = observe(response)
+        previous = self.observations.get(location_id)
+
+        # The cached response or the one, which WeatherAPI has not updated yet, has no changes.
+        if previous is not None and previous["updated"] == current["updated"]:
+            return []
+
+        self.observations[location_id] = current
+
+        temperatures = self.temperatures.setdefault(location_id, deque())
+        since = current["updated"] - g.ALERT_TEMPERATURE_WINDOW_HOURS * 3600
+        while temperatures and temperatures[0][0] < since:
+            temperatures.popleft()
+
+        highest = max((temp_c for _, temp_c in temperatures), default=current["temp_c"])
+
+        alerts = [] if previous is None else detect_alerts(previous, current, highest)
+        for kind, _ in alerts:
+            ALERTS.inc(kind=kind)
+
+        if any(kind == "temperature_drop" for kind, _ in alerts):
+            temperatures.clear()
+        temperatures.append((current["updated"], current["temp_c"]))
+
+        return alerts
+
+    def retain(self, location_ids: set[int]):
+        """Forgets the observations of the locations, which have no subscribers anymore."""
+        for location_id in set(self.observations) - location_ids:
+            del self.observations[location_id]
+            self.temperatures.pop(location_id, None)
+
+
+watcher = AlertWatcher()
+
+
+ALERTS = Counter(
+    "bot_weather_alerts_total",
+    "Number of the weather changes of the locations, which crossed the thresholds of the alerts.",
+    ("kind",),
+)
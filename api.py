@@ -7,6 +7,8 @@ from swagger_client.rest import ApiException
 from decouple import config
 
 from logger import Logger
+from metrics import STAGE_SECONDS
+from tracing import traced
 
 logger = Logger(__name__)
 
@@ -18,14 +20,20 @@ class Instance:
         configuration = swagger_client.Configuration()
         configuration.api_key["key"] = config("API_KEY")
 
+        # Alternative address of the API, e.g. the local stand-in for the load tests.
+        if config("WEATHER_API_URL", default=""):
+            configuration.host = config("WEATHER_API_URL")
+
         self.instance = swagger_client.APIsApi(swagger_client.ApiClient(configuration))
         logger.debug(
             f"Created API instance for user with telegram ID [{self.telegram_id}]."
         )
 
+    @traced("weather_api.search")
     def search(self, query):
         try:
-            search_results = self.instance.search_autocomplete_weather(query)
+            with STAGE_SECONDS.time(stage="weather_api"):
+                search_results = self.instance.search_autocomplete_weather(query)
             logger.debug(
                 f"Find [{len(search_results)}] results for search query: [{query}] "
                 f"for user with telegrad ID [{self.telegram_id}]."
@@ -39,9 +47,11 @@ class Instance:
 
         return search_results
 
+    @traced("weather_api.current")
     def get_current_weather(self, location):
         try:
-            current_weather = self.instance.realtime_weather(location)
+            with STAGE_SECONDS.time(stage="weather_api"):
+                current_weather = self.instance.realtime_weather(location)
             logger.debug(
                 f"Got current weather for for location: [{location}] for user with telegram ID [{self.telegram_id}]."
             )
@@ -52,11 +62,13 @@ class Instance:
                 f"telegram ID [{self.telegram_id}]. Location: [{location}]. Error: [{error}]."
             )
 
+    @traced("weather_api.forecast")
     def get_forecast(self, location: str, dt: str, days: int):
         try:
-            tomorrow_weather = self.instance.forecast_weather(
-                location, days=days, dt=dt
-            )
+            with STAGE_SECONDS.time(stage="weather_api"):
+                tomorrow_weather = self.instance.forecast_weather(
+                    location, days=days, dt=dt
+                )
 
             logger.debug(
                 f"Got [{days}] days weather on date [{dt}] for location: [{location}] "
@@ -0,0 +1,160 @@
+"""Manifest of the media assets with their sizes and hashes. On startup the assets are checked
+against the manifest by the counts and sizes of the files, which needs only the directory
+listings and stats, the hashes are verified in background. The manifest is written after the assets
+are changed:
+
+    python -m assets --write
+    python -m assets --verify
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import globals as g
+
+from logger import Logger
+
+logger = Logger(__name__)
+
+
+def asset_files() -> list[str]:
+    """Returns paths of the asset files relative to the media directory."""
+    files = []
+    for root, _, names in os.walk(g.MEDIA_DIR):
+        for name in names:
+            path = os.path.relpath(os.path.join(root, name), g.MEDIA_DIR)
+            if path != os.path.basename(g.ASSETS_MANIFEST):
+                files.append(path.replace(os.sep, "/"))
+    return sorted(files)
+
+
+def file_hash(path: str) -> str:
+    with open(os.path.join(g.MEDIA_DIR, path), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def counts(files: list[str]) -> dict[str, int]:
+    result = {}
+    for path in files:
+        directory = os.path.dirname(path) or "."
+        result[directory] = result.get(directory, 0) + 1
+    return result
+
+
+def check_icons():
+    """Checks that the day and night icons match [g.ICONS].
+
+    Raises:
+        FileNotFoundError: if some icons are missing.
+    """
+    icons_day = sorted(os.listdir(os.path.join(g.ICONS_DIR, "day")))
+    icons_night = sorted(os.listdir(os.path.join(g.ICONS_DIR, "night")))
+
+    logger.debug(
+        f"Readed [{len(icons_day)}] day icons and [{len(icons_night)}] night icons."
+    )
+
+    if icons_day == icons_night == g.ICONS:
+        logger.debug("All icons compared to the list are present.")
+        return
+
+    day_difference = set(g.ICONS) - set(icons_day) or "None"
+    night_difference = set(g.ICONS) - set(icons_night) or "None"
+
+    logger.error(
+        f"Missing icons: [{day_difference}] in day icons and [{night_difference}] in night icons. "
+        f"Will raise an error."
+    )
+
+    raise FileNotFoundError(
+        f"Missing icons: [{day_difference}] in day icons and [{night_difference}] in night icons."
+    )
+
+
+def build_manifest() -> dict:
+    """Builds the manifest from the assets, the icons are checked against [g.ICONS] first."""
+    check_icons()
+
+    files = asset_files()
+    return {
+        "counts": counts(files),
+        "files": {
+            path: {
+                "size": os.path.getsize(os.path.join(g.MEDIA_DIR, path)),
+                "sha256": file_hash(path),
+            }
+            for path in files
+        },
+    }
+
+
+def load_manifest() -> dict | None:
+    if not os.path.exists(g.ASSETS_MANIFEST):
+        return None
+
+    with open(g.ASSETS_MANIFEST, "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+def check_assets(manifest: dict):
+    """Checks that the assets match the manifest by the counts and sizes of the files.
+
+    Raises:
+        FileNotFoundError: if the asset is missing or differs from the manifest.
+    """
+    files = asset_files()
+
+    if counts(files) != manifest["counts"]:
+        missing = set(manifest["files"]) - set(files)
+        raise FileNotFoundError(
+            f"Assets don't match the manifest, missing files: [{missing or 'None'}]."
+        )
+
+    changed = [
+        path
+        for path, entry in manifest["files"].items()
+        if os.path.getsize(os.path.join(g.MEDIA_DIR, path)) != entry["size"]
+    ]
+    if changed:
+        raise FileNotFoundError(f"Assets differ from the manifest: [{changed}].")
+
+    logger.debug(f"Checked [{len(files)}] assets against the manifest.")
+
+
+def verify_hashes(manifest: dict) -> list[str]:
+    """Returns paths of the assets, which hashes differ from the manifest."""
+    mismatched = [
+        path
+        for path, entry in manifest["files"].items()
+        if file_hash(path) != entry["sha256"]
+    ]
+
+    if mismatched:
+        logger.error(f"Hashes of the assets differ from the manifest: [{mismatched}].")
+    else:
+        logger.debug(f"Verified hashes of [{len(manifest['files'])}] assets.")
+
+    return mismatched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--write", action="store_true")
+    parser.add_argument("--verify", action="store_true")
+    args = parser.parse_args()
+
+    if args.write:
+        manifest = build_manifest()
+        with open(g.ASSETS_MANIFEST, "w", encoding="utf8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        print(f"Wrote manifest with [{len(manifest['files'])}] assets.")
+
+    if args.verify:
+        manifest = load_manifest()
+        check_assets(manifest)
+        mismatched = verify_hashes(manifest)
+        print(f"Mismatched assets: [{mismatched or 'None'}].")
@@ -0,0 +1,30 @@
+"""Helpers shared by the benchmarks, so they exercise the same shapes of the updates."""
+
+import asyncio
+
+from aiogram import Dispatcher, types
+
+
+def message_payload(update_id: int, user_id: int, text: str) -> dict:
+    """Returns the payload of the update with the text message from the private chat."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1679400000,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        },
+    }
+
+
+def message_update(update_id: int, user_id: int, text: str) -> types.Update:
+    return types.Update(**message_payload(update_id, user_id, text))
+
+
+async def process_update(dp: Dispatcher, update: types.Update):
+    """Processes the update in its own task like in the polling and webhook modes, since
+    aiogram caches the state of the user in the task context. The update is passed to the
+    updates handler, so the update middlewares run as in the bot."""
+    await asyncio.create_task(dp.updates_handler.notify(update))
@@ -0,0 +1,114 @@
+"""Micro-benchmark of the per-update dispatch overhead for the menu buttons. Compares a chain
+of Text filters (one handler per button) with the dispatch table, and measures building the
+reply keyboards and formatting the messages on every call against the prebuilt ones.
+
+    python -m benchmarks.dispatch --updates 20000
+"""
+
+import argparse
+import asyncio
+import random
+
+from re import escape
+from time import perf_counter
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.filters import Text
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.utils.payload import prepare_arg
+
+import bot
+
+from benchmarks.common import message_update
+
+MENU = [b for b in bot.Buttons if isinstance(b.value, str)]
+
+
+async def noop(message: types.Message):
+    pass
+
+
+def text_filters_dispatcher() -> Dispatcher:
+    dp = Dispatcher(Bot(token="123456:benchmark"))
+    for b in MENU:
+        dp.register_message_handler(noop, Text(equals=b.value), state="*")
+    return dp
+
+
+def dispatch_table_dispatcher() -> Dispatcher:
+    dp = Dispatcher(Bot(token="123456:benchmark"))
+    handlers = {b.value: noop for b in MENU}
+
+    async def router(message: types.Message):
+        await handlers[message.text](message)
+
+    dp.register_message_handler(
+        router, lambda message: message.text in handlers, state="*"
+    )
+    return dp
+
+
+async def dispatch(dp: Dispatcher, updates: list[types.Update]) -> float:
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+
+    start = perf_counter()
+    for update in updates:
+        await dp.process_update(update)
+    elapsed = perf_counter() - start
+
+    await (await dp.bot.get_session()).close()
+    return elapsed / len(updates)
+
+
+def build_keyboard(reply_buttons: list) -> str:
+    keyboard = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    for b in reply_buttons:
+        keyboard.add(KeyboardButton(b))
+    return prepare_arg(keyboard)
+
+
+def measure(function, iterations: int) -> float:
+    start = perf_counter()
+    for _ in range(iterations):
+        function()
+    return (perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    updates = [
+        message_update(i, 1, random.choice(MENU).value) for i in range(args.updates)
+    ]
+
+    results = {
+        "dispatch, text filters": asyncio.run(
+            dispatch(text_filters_dispatcher(), updates)
+        ),
+        "dispatch, dispatch table": asyncio.run(
+            dispatch(dispatch_table_dispatcher(), updates)
+        ),
+        "keyboard, built per call": measure(
+            lambda: build_keyboard(bot.Buttons.FORECASTS.menu()), args.updates
+        ),
+        "keyboard, prebuilt": measure(
+            lambda: prepare_arg(bot.KEYBOARDS[bot.Buttons.FORECASTS]), args.updates
+        ),
+        "message, escaped per call": measure(
+            lambda: escape(bot.Messages.MENU_CHANGED.value.format(menu="Forecasts")),
+            args.updates,
+        ),
+        "message, cached template": measure(
+            lambda: bot.Messages.MENU_CHANGED.format(menu="Forecasts"), args.updates
+        ),
+    }
+
+    for name, seconds in results.items():
+        print(f"{name}: {seconds * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""End-to-end offline load test. Starts local stand-ins for the Bot API and WeatherAPI, points
+the bot to them and to the SQLite database, and drives the dispatcher of the bot with simulated
+users, each of them presses the weather buttons one after another. Then the notification run
+about today weather is sent to all users with cold caches.
+
+The stand-in of the Bot API accepts the methods used by the bot and counts them, the stand-in
+of WeatherAPI serves the fixture payloads with the configured latency and error rate. Telegram
+rate limits of the sender are lifted unless --telegram-limits is set, so the capacity of the
+bot itself is measured.
+
+    python -m benchmarks.load_test --users 200 --rounds 5 --weather-ms 150 --error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+
+from collections import Counter
+from statistics import quantiles
+from time import perf_counter, time
+
+from aiohttp import web
+
+from benchmarks.common import message_update, process_update
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+TOKEN = "123456:loadtest"
+BUTTONS = ("Current weather", "Today weather", "Tomorrow weather")
+
+
+def load_fixture(name: str) -> dict:
+    # The modules of the bot are not imported here, since they read the settings on import.
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeTelegram:
+    """Stand-in of the Bot API, which answers the methods with the minimal valid results."""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self.message_id = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        await asyncio.sleep(self.latency)
+
+        self.calls[method] += 1
+        self.message_id += 1
+
+        chat = {"id": int(data.get("chat_id", 1)), "type": "private"}
+        message = {"message_id": self.message_id, "date": int(time()), "chat": chat}
+
+        if method == "getMe":
+            result = {
+                "id": 123456,
+                "is_bot": True,
+                "first_name": "bot",
+                "username": "bot",
+            }
+        elif method == "sendPhoto":
+            photo = {"file_id": f"photo{self.message_id}", "file_unique_id": "u"}
+            result = {**message, "photo": [{**photo, "width": 512, "height": 512}]}
+        elif method == "sendDocument":
+            result = {**message, "document": {"file_id": "d", "file_unique_id": "u"}}
+        elif method == "sendMessage":
+            result = {**message, "text": data.get("text", "")}
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024**2)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+
+class FakeWeatherAPI:
+    """Stand-in of WeatherAPI, which serves the fixture payloads for any location with the
+    name of the location replaced, delayed by the latency and failed with the error rate.
+    """
+
+    def __init__(self, latency_ms: float, error_rate: float):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.fixtures = {
+            "current": load_fixture("current.json"),
+            "forecast": load_fixture("forecast.json"),
+        }
+        self.payloads = {}
+
+    def payload(self, kind: str, query: str) -> bytes:
+        if (kind, query) not in self.payloads:
+            fixture = dict(self.fixtures[kind])
+            fixture["location"] = {**fixture["location"], "name": query}
+            self.payloads[kind, query] = json.dumps(fixture).encode()
+        return self.payloads[kind, query]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        kind = request.match_info["kind"]
+        query = request.query.get("q", "")
+        await asyncio.sleep(self.latency)
+
+        self.calls[kind] += 1
+
+        if random.random() < self.error_rate:
+            self.calls["errors"] += 1
+            return web.json_response({"error": {"code": 9999}}, status=500)
+
+        if kind == "search":
+            results = [{"id": 1, "name": query, "region": "", "country": "UK"}]
+            return web.json_response(results)
+
+        return web.Response(
+            body=self.payload(kind, query), content_type="application/json"
+        )
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/{kind}.json", self.handle)
+        return app
+
+
+async def start_app(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def configure(args: argparse.Namespace, telegram_port: int, weather_port: int):
+    """Points the bot to the stand-ins before it's imported, since the settings are read
+    on import."""
+    os.environ.update(
+        {
+            "TOKEN": TOKEN,
+            "ADMIN": "1",
+            "API_KEY": "loadtest",
+            "TELEGRAM_API_URL": f"http://127.0.0.1:{telegram_port}",
+            "WEATHER_API_URL": f"http://127.0.0.1:{weather_port}",
+            "DATABASE_URL": f"sqlite:///{args.database}",
+            "COORDINATION": "none",
+            "TRACE_SAMPLE_RATE": "0",
+        }
+    )
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import globals as g
+
+    if not args.telegram_limits:
+        g.SENDER_GLOBAL_RATE = g.SENDER_CHAT_RATE = g.SENDER_CHAT_BURST = 1e9
+    g.WEATHER_RATE = g.WEATHER_BURST = 1e9
+
+
+def seed(users: int, locations: int):
+    from sqlalchemy.orm import Session
+
+    from database import Base, Location, User, create_db_engine
+
+    engine = create_db_engine()
+    tables = [User.__table__, Location.__table__]
+    Base.metadata.drop_all(engine, tables=tables)
+    Base.metadata.create_all(engine, tables=tables)
+
+    with Session(engine) as session:
+        session.add_all(
+            Location(id=i + 1, weather_id=i + 1, name=f"City {i}", country="UK")
+            for i in range(locations)
+        )
+        session.add_all(
+            User(
+                telegram_id=1000 + i,
+                username=f"user{i}",
+                location_id=i % locations + 1,
+                notify_today=True,
+            )
+            for i in range(users)
+        )
+        session.commit()
+
+
+def percentiles(latencies: list[float]) -> str:
+    if len(latencies) < 2:
+        return "-"
+    values = quantiles(latencies, n=100, method="inclusive")
+    return (
+        f"p50 {values[49] * 1000:.1f} ms, p90 {values[89] * 1000:.1f} ms, "
+        f"p99 {values[98] * 1000:.1f} ms"
+    )
+
+
+async def run(args: argparse.Namespace):
+    telegram = FakeTelegram(args.telegram_ms)
+    weather = FakeWeatherAPI(args.weather_ms, args.error_rate)
+
+    telegram_port, weather_port = free_port(), free_port()
+    runners = [
+        await start_app(telegram.app(), telegram_port),
+        await start_app(weather.app(), weather_port),
+    ]
+
+    configure(args, telegram_port, weather_port)
+    seed(args.users, args.locations)
+
+    import bot
+    import logger
+
+    from aiogram import Bot, Dispatcher
+    from cache import forecast_cache, image_cache
+
+    Bot.set_current(bot.bot)
+    Dispatcher.set_current(bot.dp)
+
+    latencies = {b: [] for b in BUTTONS}
+    update_ids = iter(range(1, sys.maxsize))
+
+    async def user(telegram_id: int):
+        for _ in range(args.rounds):
+            text = random.choice(BUTTONS)
+            update = message_update(next(update_ids), telegram_id, text)
+
+            start = perf_counter()
+            await process_update(bot.dp, update)
+            latencies[text].append(perf_counter() - start)
+
+            if args.think_ms:
+                await asyncio.sleep(random.expovariate(1000 / args.think_ms))
+
+    start = perf_counter()
+    await asyncio.gather(*[user(1000 + i) for i in range(args.users)])
+    interactive = perf_counter() - start
+
+    image_cache.clear()
+    forecast_cache.clear()
+    sent = telegram.calls["sendPhoto"]
+
+    start = perf_counter()
+    await bot.notify_users("today")
+    notification = perf_counter() - start
+
+    await (await bot.bot.get_session()).close()
+    for runner in runners:
+        await runner.cleanup()
+
+    logger.stop_listener()
+
+    updates = args.users * args.rounds
+    print(
+        f"users: {args.users} | updates: {updates} | "
+        f"updates/s: {updates / interactive:.1f}"
+    )
+    print(f"all updates: {percentiles(sum(latencies.values(), []))}")
+    for text, values in latencies.items():
+        print(f"{text}: {percentiles(values)}")
+    print(
+        f"notification run: {notification:.2f} s for {args.users} users, "
+        f"photos sent: {telegram.calls['sendPhoto'] - sent}"
+    )
+    print(f"Bot API calls: {dict(telegram.calls)}")
+    print(f"WeatherAPI calls: {dict(weather.calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--locations", type=int, default=20)
+    parser.add_argument("--think-ms", type=float, default=200)
+    parser.add_argument("--telegram-ms", type=float, default=30)
+    parser.add_argument("--weather-ms", type=float, default=150)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-limits", action="store_true")
+    parser.add_argument(
+        "--database", default=os.path.join(tempfile.gettempdir(), "load_test.sqlite3")
+    )
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
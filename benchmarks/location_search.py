@@ -0,0 +1,101 @@
+"""Concurrency check of the location search state with thousands of users changing their
+location at the same time. Telegram and WeatherAPI are replaced with in-process stand-ins,
+each user must receive search results only for their own query.
+
+    python -m benchmarks.location_search --users 5000
+"""
+
+import argparse
+import asyncio
+import random
+
+from time import perf_counter
+
+from aiogram import Bot, Dispatcher, types
+
+import api
+import bot
+
+from benchmarks.common import message_update, process_update
+from sender import TokenBucket
+
+
+class FakeInstance:
+    def __init__(self, telegram_id: int):
+        self.telegram_id = telegram_id
+
+    def search(self, query: str) -> list[dict]:
+        return [{"name": query, "country": "Benchmark"}]
+
+
+async def run(users: int) -> dict:
+    replies = {}
+
+    async def send_message(chat_id, text, reply_markup=None, **kwargs):
+        await asyncio.sleep(0)
+        if isinstance(reply_markup, types.InlineKeyboardMarkup):
+            replies[chat_id] = [row[0].text for row in reply_markup.inline_keyboard]
+
+    bot.bot.send_message = send_message
+    api.Instance = FakeInstance
+
+    # The stand-in of Telegram has no rate limits, so only the dispatching is measured.
+    bot.sender.global_bucket = TokenBucket(1e9, 1e9)
+
+    Bot.set_current(bot.bot)
+    Dispatcher.set_current(bot.dp)
+
+    handlers = len(bot.dp.message_handlers.handlers)
+
+    async def change_location(user_id: int):
+        await process_update(
+            bot.dp, message_update(user_id, user_id, bot.Buttons.CHANGE_LOCATION.value)
+        )
+        await asyncio.sleep(random.random() / 100)
+        await process_update(
+            bot.dp, message_update(user_id, user_id, f"City {user_id}")
+        )
+
+    start = perf_counter()
+    await asyncio.gather(*[change_location(user_id) for user_id in range(1, users + 1)])
+    elapsed = perf_counter() - start
+
+    wrong = [
+        user_id
+        for user_id in range(1, users + 1)
+        if replies.get(user_id) != [f"City {user_id}, Benchmark"]
+    ]
+    pending = [
+        user_id
+        for user_id in range(1, users + 1)
+        if await bot.dp.storage.get_state(chat=user_id, user=user_id)
+    ]
+
+    return {
+        "users": users,
+        "updates/s": 2 * users / elapsed,
+        "wrong results": len(wrong),
+        "pending states": len(pending),
+        "handlers added": len(bot.dp.message_handlers.handlers) - handlers,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=5000)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.users))
+    print(
+        " | ".join(
+            f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}"
+            for key, value in result.items()
+        )
+    )
+
+    if result["wrong results"] or result["pending states"] or result["handlers added"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
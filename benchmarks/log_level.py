@@ -0,0 +1,71 @@
+"""Benchmark of the render throughput with DEBUG logging on and off. Renders the forecast
+and current weather images from the fixture payloads, no network is used.
+
+    python -m benchmarks.log_level --iterations 50
+"""
+
+import argparse
+import json
+import logging
+import os
+
+from time import perf_counter
+
+import bot
+import logger
+
+from imaging import Drawer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+def set_level(level: int):
+    logger.set_level(level)
+    assert logger.loggers and all(
+        instance.getEffectiveLevel() == level for instance in logger.loggers
+    ), f"Failed to set the level [{logging.getLevelName(level)}] of the loggers."
+
+
+def render(iterations: int) -> float:
+    current = bot.extract_current_weather(load_fixture("current.json"))
+
+    forecastday = load_fixture("forecast.json")["forecast"]["forecastday"][0]
+    weather = bot.extract_forecast_weather(forecastday["hour"])
+    metadata = bot.extract_forecast_metadata(forecastday)
+    metadata.update({"location": "London", "date": forecastday["date"]})
+
+    d = Drawer()
+
+    start = perf_counter()
+    for _ in range(iterations):
+        os.remove(d.draw_current_weather(current))
+        os.remove(d.draw_forecast_weather(weather, metadata))
+    elapsed = perf_counter() - start
+
+    return 2 * iterations / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {}
+    for level in (logging.DEBUG, logging.INFO):
+        set_level(level)
+        results[logging.getLevelName(level)] = render(args.iterations)
+
+    # Waiting until the listener writes all queued records, so they don't mix with the results.
+    logger.stop_listener()
+
+    for level, images in results.items():
+        print(f"{level}: {images:.1f} images/s")
+
+
+if __name__ == "__main__":
+    main()
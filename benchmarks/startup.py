@@ -0,0 +1,107 @@
+"""Benchmark of the startup time. Starts fresh interpreters, which import the bot and run the
+initial checks against the local SQLite database, and reports the time of the import, the
+checks, the warm up in background and the whole startup until the bot is ready. The checks
+are run concurrently as on startup or one after another with --serial for comparison.
+
+    python -m benchmarks.startup --runs 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from statistics import median
+from time import perf_counter
+
+from sqlalchemy import create_engine, text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys
+from time import perf_counter
+
+started = perf_counter()
+import bot
+imported = perf_counter()
+
+if {serial}:
+    for step in bot.init_steps():
+        step()
+else:
+    bot.init_checks()
+checked = perf_counter()
+
+bot.warm_up()
+warmed = perf_counter()
+
+print(json.dumps({{
+    "import": imported - started,
+    "checks": checked - imported,
+    "warm_up": warmed - checked,
+}}))
+"""
+
+
+def run(serial: bool, env: dict) -> dict:
+    started = perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD.format(serial=serial)],
+        env=env,
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    ready = perf_counter() - started
+
+    result = json.loads(output.strip().splitlines()[-1])
+    # The warm up runs in background after the bot is ready.
+    result["ready"] = ready - result["warm_up"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--serial", action="store_true")
+    parser.add_argument(
+        "--database", default=os.path.join(tempfile.gettempdir(), "startup.sqlite3")
+    )
+    args = parser.parse_args()
+
+    with create_engine(f"sqlite:///{args.database}").begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS users (telegram_id BIGINT PRIMARY KEY, "
+                "username TEXT, location TEXT, coordinates TEXT, "
+                "notify_today BOOLEAN, notify_tomorrow BOOLEAN)"
+            )
+        )
+
+    env = {
+        **os.environ,
+        "TOKEN": "123456:startup",
+        "ADMIN": "1",
+        "API_KEY": "startup",
+        "DATABASE_URL": f"sqlite:///{args.database}",
+        "COORDINATION": "none",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    }
+
+    results = [run(args.serial, env) for _ in range(args.runs)]
+
+    print(f"checks: {'serial' if args.serial else 'concurrent'}, runs: {args.runs}")
+    for name in ("import", "checks", "ready", "warm_up"):
+        values = [result[name] for result in results]
+        print(
+            f"{name}: median {median(values) * 1000:.1f} ms, "
+            f"min {min(values) * 1000:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
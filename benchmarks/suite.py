@@ -0,0 +1,214 @@
+"""Micro-benchmark suite of rendering and decoding. Runs on the fixture payloads without
+network and reports ops/s, p50/p99 latency and peak memory of every case. The results can be
+saved as the baseline and the later runs are compared with it, the cases slower than the
+baseline by more than the tolerance are reported as regressions. The peak memory is measured
+with tracemalloc, so it includes only the Python allocations, the image buffers allocated by
+Pillow are reflected in the max RSS of the process printed at the end. The encode cases save
+the drawn forecast image in every output profile and report the size of the encoded file.
+
+    python -m benchmarks.suite --save-baseline
+    python -m benchmarks.suite --tolerance 0.1
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tracemalloc
+
+from statistics import quantiles
+from time import perf_counter_ns
+from typing import Callable
+
+import bot
+import globals as g
+import logger
+
+from PIL import Image
+
+from benchmarks.log_level import FIXTURES_DIR, load_fixture, set_level
+from imaging import Drawer
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Number of the operations measured under tracemalloc for the peak memory, the tracing
+# slows down the operations, so they are not used for the latency.
+MEMORY_ITERATIONS = 5
+
+# Sizes of the images encoded by the encode cases in bytes by the names of the cases.
+ENCODED_BYTES = {}
+
+
+def cases() -> dict[str, tuple[Callable, Callable]]:
+    """Returns the cases: pairs of the measured function and the cleanup of its result."""
+    with open(os.path.join(FIXTURES_DIR, "current.json"), "r", encoding="utf8") as f:
+        current_raw = f.read()
+    with open(os.path.join(FIXTURES_DIR, "forecast.json"), "r", encoding="utf8") as f:
+        forecast_raw = f.read()
+
+    current_payload = load_fixture("current.json")
+    forecastday = load_fixture("forecast.json")["forecast"]["forecastday"][0]
+
+    current = bot.extract_current_weather(current_payload)
+    weather = bot.extract_forecast_weather(forecastday["hour"])
+    metadata = bot.extract_forecast_metadata(forecastday)
+    metadata.update({"location": "London", "date": forecastday["date"]})
+
+    summary = {"name": "London", "localtime": "2023-03-21 12:00", **current}
+
+    d = Drawer()
+
+    def noop(result):
+        pass
+
+    # The forecast image is drawn once, so the encode cases measure only the output profiles.
+    path = d.draw_forecast_weather(weather, metadata)
+    with Image.open(path) as drawn:
+        image = drawn.copy()
+    os.remove(path)
+
+    def encode_case(profile: str) -> tuple[Callable, Callable]:
+        drawer = Drawer(profile)
+
+        def cleanup(path: str):
+            ENCODED_BYTES[f"encode_{profile}"] = os.path.getsize(path)
+            os.remove(path)
+
+        return lambda: drawer.save(image, "encode"), cleanup
+
+    return {
+        "decode_current": (lambda: json.loads(current_raw), noop),
+        "decode_forecast": (lambda: json.loads(forecast_raw), noop),
+        "extract_current_weather": (
+            lambda: bot.extract_current_weather(current_payload),
+            noop,
+        ),
+        "extract_forecast_weather": (
+            lambda: bot.extract_forecast_weather(forecastday["hour"]),
+            noop,
+        ),
+        "extract_forecast_metadata": (
+            lambda: bot.extract_forecast_metadata(forecastday),
+            noop,
+        ),
+        "select_background": (lambda: d.select_background(current), noop),
+        "select_icon": (
+            lambda: d.select_icon(current["icon"], current["is_day"]),
+            noop,
+        ),
+        "messages_format": (
+            lambda: bot.Messages.CURRENT_SUMMARY.format(**summary),
+            noop,
+        ),
+        "draw_current_weather": (lambda: d.draw_current_weather(current), os.remove),
+        "draw_forecast_weather": (
+            lambda: d.draw_forecast_weather(weather, metadata),
+            os.remove,
+        ),
+        **{f"encode_{profile}": encode_case(profile) for profile in g.IMAGE_PROFILES},
+    }
+
+
+def measure(function: Callable, cleanup: Callable, iterations: int) -> dict:
+    # Warming up the caches of the fonts, images and the interpreter.
+    for _ in range(min(iterations, 3)):
+        cleanup(function())
+
+    timings = []
+    for _ in range(iterations):
+        start = perf_counter_ns()
+        result = function()
+        timings.append(perf_counter_ns() - start)
+        cleanup(result)
+
+    tracemalloc.start()
+    for _ in range(MEMORY_ITERATIONS):
+        cleanup(function())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    percentiles = quantiles(timings, n=100, method="inclusive")
+    return {
+        "ops": len(timings) * 1e9 / sum(timings),
+        "p50_us": percentiles[49] / 1e3,
+        "p99_us": percentiles[98] / 1e3,
+        "peak_kib": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="allowed relative increase of p50 latency compared with the baseline",
+    )
+    parser.add_argument("--filter", default="", help="run only cases containing it")
+    args = parser.parse_args()
+
+    # Debug logging of the measured functions would dominate the fast cases, the level of
+    # the loggers is checked by set_level.
+    set_level(logging.WARNING)
+
+    results = {}
+    for name, (function, cleanup) in cases().items():
+        if args.filter in name:
+            results[name] = measure(function, cleanup, args.iterations)
+            if name in ENCODED_BYTES:
+                results[name]["bytes"] = ENCODED_BYTES[name]
+
+    logger.stop_listener()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf8") as f:
+            baseline = json.load(f)
+
+    regressions = []
+
+    print(
+        f"{'case':<28}{'ops/s':>12}{'p50 us':>12}{'p99 us':>12}{'peak KiB':>12}"
+        f"{'size KiB':>12}{'vs baseline':>14}"
+    )
+    for name, result in results.items():
+        line = (
+            f"{name:<28}{result['ops']:>12.1f}{result['p50_us']:>12.1f}"
+            f"{result['p99_us']:>12.1f}{result['peak_kib']:>12.1f}"
+        )
+        line += (
+            f"{result['bytes'] / 1024:>12.1f}" if "bytes" in result else f"{'-':>12}"
+        )
+
+        if name in baseline and not args.save_baseline:
+            change = result["p50_us"] / baseline[name]["p50_us"] - 1
+            line += f"{change:>+13.1%}"
+            if change > args.tolerance:
+                regressions.append(name)
+                line += " !"
+
+        print(line)
+
+    print(
+        f"max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB"
+    )
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf8") as f:
+            json.dump({**baseline, **results}, f, indent=2)
+        print(f"Saved baseline to [{args.baseline}].")
+
+    if regressions:
+        print(f"Regressions against the baseline: [{', '.join(regressions)}].")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Offline benchmark of the webhook mode with synthetic update payloads.
+Compares the webhook handler, which answers immediately and processes updates in background,
+with the inline mode, where the request waits until the update is processed.
+
+    python -m benchmarks.webhook --updates 2000 --handler-ms 50 --connections 40
+"""
+
+import argparse
+import asyncio
+
+from statistics import quantiles
+from time import perf_counter
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher, types
+
+import globals as g
+import webhook
+
+from benchmarks.common import message_payload
+
+
+def create_dispatcher(handler_ms: float, done: asyncio.Event, total: int) -> Dispatcher:
+    dp = Dispatcher(Bot(token="123456:benchmark"))
+    processed = 0
+
+    @dp.message_handler()
+    async def handler(message: types.Message):
+        nonlocal processed
+        await asyncio.sleep(handler_ms / 1000)
+
+        processed += 1
+        if processed == total:
+            done.set()
+
+    return dp
+
+
+def create_inline_app(dp: Dispatcher) -> web.Application:
+    async def handle(request: web.Request) -> web.Response:
+        Bot.set_current(dp.bot)
+        Dispatcher.set_current(dp)
+        await dp.process_update(types.Update(**await request.json()))
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_post(g.WEBHOOK_PATH, handle)
+    return app
+
+
+async def run(mode: str, args: argparse.Namespace) -> dict:
+    done = asyncio.Event()
+    dp = create_dispatcher(args.handler_ms, done, args.updates)
+
+    if mode == "webhook":
+        g.WEBHOOK_MAX_IN_FLIGHT = args.in_flight
+        app = webhook.create_app(dp)
+    else:
+        app = create_inline_app(dp)
+
+    client = TestClient(TestServer(app))
+    await client.start_server()
+
+    connections = asyncio.Semaphore(args.connections)
+    latencies = []
+
+    async def send(update_id: int):
+        async with connections:
+            start = perf_counter()
+            response = await client.post(
+                g.WEBHOOK_PATH,
+                json=message_payload(
+                    update_id, 1000 + update_id % args.users, "Current weather"
+                ),
+                headers={webhook.SECRET_HEADER: g.WEBHOOK_SECRET},
+            )
+            await response.release()
+            latencies.append(perf_counter() - start)
+
+    start = perf_counter()
+    await asyncio.gather(*[send(i) for i in range(args.updates)])
+    await done.wait()
+    elapsed = perf_counter() - start
+
+    await client.close()
+    await (await dp.bot.get_session()).close()
+
+    percentiles = quantiles(latencies, n=100)
+    return {
+        "mode": mode,
+        "updates/s": args.updates / elapsed,
+        "ack p50 ms": percentiles[49] * 1000,
+        "ack p99 ms": percentiles[98] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--handler-ms", type=float, default=50)
+    parser.add_argument("--connections", type=int, default=g.WEBHOOK_MAX_CONNECTIONS)
+    parser.add_argument("--in-flight", type=int, default=g.WEBHOOK_MAX_IN_FLIGHT)
+    args = parser.parse_args()
+
+    for mode in ("inline", "webhook"):
+        result = asyncio.run(run(mode, args))
+        print(
+            " | ".join(
+                f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}"
+                for key, value in result.items()
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,111 @@
 import os
+import json
 import asyncio
+import hashlib
+import importlib
 
-from aiocron import crontab
+import aiocron
 
 from datetime import datetime, timedelta
 from enum import Enum
+from functools import wraps
+from typing import Callable, Hashable
 from re import escape
+from string import Formatter
+from secrets import token_urlsafe
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, perf_counter, time
 
 from aiogram import Bot, Dispatcher, executor, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InputFile
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.dispatcher.filters import Text
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.dispatcher.middlewares import BaseMiddleware
 from decouple import config
 
 import globals as g
 
 from logger import Logger
-from database import Database
-from api import Instance
-from imaging import Drawer
+from database import Database, Location, migrate
+from cache import current_weather_cache, forecast_cache, image_cache
+from cache import search_results_cache, file_id_cache, Cache
+from cache import budget, sizeof
+from coordination import Coordinator
+from webhook import start_webhook
+from sender import Sender, Priority, TokenBucket
+from metrics import STAGE_SECONDS, NOTIFICATION_USERS, handler_timer, timed
+from metrics import start_server as start_metrics_server
+from tracing import trace, traced
+from monitor import monitor
+from assets import check_assets, check_icons, load_manifest, verify_hashes
+from snapshot import collect, load_snapshot, save_snapshot
+from grid import index, WEATHER_LOOKUPS
+from history import history
+from alerts import watcher
 
 logger = Logger(__name__)
 
 storage = MemoryStorage()
-bot = Bot(token=config("TOKEN"))
+# Alternative address of the Bot API, e.g. the local Bot API server or the stand-in for the
+# load tests.
+api_server = (
+    TelegramAPIServer.from_base(config("TELEGRAM_API_URL"))
+    if config("TELEGRAM_API_URL", default="")
+    else TELEGRAM_PRODUCTION
+)
+bot = Bot(token=config("TOKEN"), server=api_server)
 
 dp = Dispatcher(bot=bot, storage=storage)
+sender = Sender(bot)
+
+coordinator = Coordinator() if g.COORDINATION != "none" else None
+
+# Scheduled jobs, they're bound to the event loop on import, which is checked on startup.
+CRONS: list[aiocron.Cron] = []
+
+
+def crontab(spec: str, **kwargs) -> aiocron.Cron:
+    """Schedules the job with aiocron and registers it in [CRONS]."""
+    cron = aiocron.crontab(spec, **kwargs)
+    CRONS.append(cron)
+    return cron
+
+
+def check_crons():
+    """Checks that the scheduled jobs are bound to the running event loop, otherwise they
+    never fire.
+
+    Raises:
+        RuntimeError: if any job is bound to another event loop.
+    """
+    loop = asyncio.get_running_loop()
+    unbound = [cron.spec for cron in CRONS if cron.loop is not loop]
+
+    if unbound:
+        raise RuntimeError(
+            f"Scheduled jobs [{', '.join(unbound)}] are bound to another event loop."
+        )
+
+    logger.debug(f"All [{len(CRONS)}] scheduled jobs are bound to the running loop.")
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Starts the trace for every update, so its handlers, queries, API calls, rendering and
+    sending are recorded in one trace and the logs are marked with its ID."""
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data["trace"] = trace("update", update_id=update.update_id).__enter__()
+
+    async def on_post_process_update(
+        self, update: types.Update, results: list, data: dict
+    ):
+        data["trace"].__exit__(None, None, None)
+
+
+dp.middleware.setup(TracingMiddleware())
 
 
 class Messages(Enum):
@@ -44,6 +123,13 @@ class Messages(Enum):
     SEARCH_LOCATION = "Please, send the name of the  `location`  to search."
     SEARCH_RESULTS = "Please, choose the  `location`  from the list below."
     NO_RESULTS = "No results found for your query. Please, try again."
+    SEARCH_EXPIRED = (
+        "The search results have expired. Please, search the  `location`  again."
+    )
+    SEARCH_STATE_EXPIRED = (
+        "The location search has expired. Please, press the  `Change location`  "
+        "button to search again."
+    )
     LOCATION_UPDATED = "Your location has been updated to  `{location}` ."
     NO_LOCATION = (
         "You haven't saved a location yet. Please use the  `Change location`  "
@@ -51,9 +137,33 @@ class Messages(Enum):
     )
     LOCATION = "You have a saved location:  `{location}` ."
 
+    # Messages for image profiles.
+    IMAGE_PROFILES = (
+        "Please, choose the  `quality`  of the images. The smaller images are sent "
+        "faster on slow connections."
+    )
+    IMAGE_PROFILE_UPDATED = "The images will be sent as  `{profile}` ."
+
+    # Messages for weather summaries, which are sent before the images.
+    CURRENT_SUMMARY = (
+        "{name}, {localtime}: feels like {feelslike_c} °C, wind {wind_dir} {wind_kph} km/h, "
+        "humidity {humidity} %, pressure {pressure_mb} mb, UV {uv}."
+    )
+    FORECAST_SUMMARY = (
+        "{location}, {date}: {maxtemp_c} / {mintemp_c} °C, humidity {avg_humidity} %, "
+        "sunrise {sunrise}, sunset {sunset}."
+    )
+
     # Messages for notifications.
     NOTIFY_TRUE = "You will be notified about  `{notification}`  weather."
     NOTIFY_FALSE = "You won't be notified about  `{notification}`  weather."
+    COMPARED_WITH_YESTERDAY = "Compared with yesterday: {difference}."
+    ALERTS_TRUE = "You will be notified about rain and sharp temperature drops."
+    ALERTS_FALSE = "You won't be notified about rain and sharp temperature drops."
+    ALERT_RAIN = "{location}: rain is starting ({condition})."
+    ALERT_TEMPERATURE_DROP = (
+        "{location}: the temperature has dropped by {drop} °C to {temp_c} °C."
+    )
 
     # Messages for errors and exceptions.
     DRAWING_ERROR = (
@@ -62,18 +172,39 @@ class Messages(Enum):
     NO_WEATHER = (
         "Something went wrong while getting weather data. Please, try again later."
     )
+    STILL_WORKING = (
+        "Still working on your previous requests, please wait a few seconds."
+    )
 
     # Messages for admin.
     SHOW_USERS = (
         "Here's the list of all usernames in the database:\n\n{usernames}.\n\n"
         "Total number of users: {total}."
     )
+    PROFILING_STARTED = (
+        "Profiling started for {duration} seconds, the report will be sent when it's "
+        "stopped."
+    )
+    PROFILING_RUNNING = "Profiling is already running."
+    PROFILING_NOT_RUNNING = "Profiling is not running."
+    PROFILING_REPORT = "Profiling report: top functions and allocation sites."
+
+    def __init__(self, value: str):
+        # Escaping the templates once, only the arguments are escaped on formatting.
+        self.escaped_value = escape(value)
+        self.parts = [
+            (escape(literal), field)
+            for literal, field, _, _ in Formatter().parse(value)
+        ]
 
     def escaped(self):
-        return escape(self.value)
+        return self.escaped_value
 
     def format(self, **kwargs):
-        return escape(self.value.format(**kwargs))
+        return "".join(
+            literal + (escape(str(kwargs[field])) if field is not None else "")
+            for literal, field in self.parts
+        )
 
 
 class Buttons(Enum):
@@ -88,33 +219,127 @@ class Buttons(Enum):
     CURRENT_WEATHER = "Current weather"
     TODAY_WEATHER = "Today weather"
     TOMORROW_WEATHER = "Tomorrow weather"
+    IMAGE_QUALITY = "Image quality"
 
     SAVED_LOCATION = "Saved location"
     CHANGE_LOCATION = "Change location"
 
     NOTIFY_TODAY = "Today subscription"
     NOTIFY_TOMORROW = "Tomorrow subscription"
+    NOTIFY_ALERTS = "Weather alerts"
 
     SHOW_USERS = "Show users"
+    PROFILE_START = "Start profiling"
+    PROFILE_STOP = "Stop profiling"
 
     MAIN = [MAIN_FORECASTS, MAIN_LOCATION, MAIN_NOTIFICATIONS]
     ADMIN_MAIN = [MAIN_FORECASTS, MAIN_LOCATION, MAIN_NOTIFICATIONS, MAIN_ADMIN]
 
-    ADMIN = [SHOW_USERS, MAIN_MENU]
+    ADMIN = [SHOW_USERS, PROFILE_START, PROFILE_STOP, MAIN_MENU]
 
-    FORECASTS = [CURRENT_WEATHER, TODAY_WEATHER, TOMORROW_WEATHER, MAIN_MENU]
+    FORECASTS = [
+        CURRENT_WEATHER,
+        TODAY_WEATHER,
+        TOMORROW_WEATHER,
+        IMAGE_QUALITY,
+        MAIN_MENU,
+    ]
     LOCATION = [SAVED_LOCATION, CHANGE_LOCATION, MAIN_MENU]
 
-    NOTIFICATIONS = [NOTIFY_TODAY, NOTIFY_TOMORROW, MAIN_MENU]
+    NOTIFICATIONS = [NOTIFY_TODAY, NOTIFY_TOMORROW, NOTIFY_ALERTS, MAIN_MENU]
 
     def menu(self):
         return list(self.value)
 
 
+class LocationSearch(StatesGroup):
+    searching = State()
+
+
+# Handlers for the menu buttons, the text of the button is routed with one dict lookup
+# instead of checking a Text filter for each handler.
+BUTTON_HANDLERS = {}
+
+
+def button(*buttons: Buttons):
+    """Registers the handler for the menu buttons in the dispatch table."""
+
+    def decorator(handler):
+        for b in buttons:
+            BUTTON_HANDLERS[b.value] = handler
+        return handler
+
+    return decorator
+
+
+@dp.message_handler(lambda message: message.text in BUTTON_HANDLERS, state="*")
+async def button_router(message: types.Message):
+    handler = BUTTON_HANDLERS[message.text]
+
+    with handler_timer(handler.__name__):
+        await handler(message)
+
+
+# Weather requests in progress for each chat and rate limiters for each user.
+IN_FLIGHT = {}
+weather_buckets = Cache("weather_buckets", 600, g.CACHE_SIZE)
+
+
+def debounced(handler):
+    """Attaches repeated requests of the same kind from the chat to the one in progress instead
+    of starting new work, and answers with a short message when the user exceeds the rate limit.
+    Calls without message (notifications) are passed as is."""
+
+    @wraps(handler)
+    async def wrapper(message: types.Message = None, *args, **kwargs):
+        if message is None:
+            return await handler(message, *args, **kwargs)
+
+        telegram_id = message.from_user.id
+        key = (telegram_id, message.text)
+
+        pending = IN_FLIGHT.get(key)
+        if pending:
+            logger.debug(
+                f"Attached request [{message.text}] to the one in progress for user "
+                f"with telegram ID [{telegram_id}]."
+            )
+
+            await asyncio.wait([pending])
+            return
+
+        bucket = weather_buckets.get(telegram_id)
+        if bucket is None:
+            bucket = TokenBucket(g.WEATHER_RATE, g.WEATHER_BURST)
+            weather_buckets.set(telegram_id, bucket)
+
+        if bucket.take():
+            await sender.send_message(
+                telegram_id, Messages.STILL_WORKING.escaped(), parse_mode="MarkdownV2"
+            )
+
+            logger.debug(
+                f"Rate limited request [{message.text}] for user with telegram ID [{telegram_id}]."
+            )
+
+            return
+
+        task = asyncio.ensure_future(handler(message, *args, **kwargs))
+        IN_FLIGHT[key] = task
+
+        try:
+            return await task
+        finally:
+            IN_FLIGHT.pop(key, None)
+
+    return wrapper
+
+
 # Functions for commands.
 
 
-@dp.message_handler(commands=["start"])
+@dp.message_handler(commands=["start"], state="*")
+@timed
 async def start_handler(message: types.Message):
     telegram_id, username = await get_user_data(message)
 
@@ -124,18 +349,18 @@ async def start_handler(message: types.Message):
             f"Admin user executed /start command. ID: [{telegram_id}], username: [{username}]."
         )
 
-        await bot.send_message(
+        await sender.send_message(
             telegram_id,
             Messages.START.value,
-            reply_markup=await reply_keyboard(Buttons.ADMIN_MAIN.menu()),
+            reply_markup=KEYBOARDS[Buttons.ADMIN_MAIN],
             parse_mode="MarkdownV2",
             disable_web_page_preview=True,
         )
     else:
-        await bot.send_message(
+        await sender.send_message(
             telegram_id,
             Messages.START.value,
-            reply_markup=await reply_keyboard(Buttons.MAIN.menu()),
+            reply_markup=KEYBOARDS[Buttons.MAIN],
             parse_mode="MarkdownV2",
             disable_web_page_preview=True,
         )
@@ -144,7 +369,7 @@ async def start_handler(message: types.Message):
 # Functions for menu sections.
 
 
-@dp.message_handler(Text(equals=Buttons.MAIN_MENU.value))
+@button(Buttons.MAIN_MENU)
 async def main_menu(message: types.Message):
     telegram_id, username = await get_user_data(message)
 
@@ -154,65 +379,65 @@ async def main_menu(message: types.Message):
             f"Showing admin menu for user with telegram ID: [{telegram_id}], username: [{username}]."
         )
 
-        await bot.send_message(
+        await sender.send_message(
             telegram_id,
             Messages.MENU_CHANGED.format(menu=Buttons.MAIN_MENU.value),
-            reply_markup=await reply_keyboard(Buttons.ADMIN_MAIN.menu()),
+            reply_markup=KEYBOARDS[Buttons.ADMIN_MAIN],
             parse_mode="MarkdownV2",
         )
     else:
-        await bot.send_message(
+        await sender.send_message(
             telegram_id,
             Messages.MENU_CHANGED.format(menu=Buttons.MAIN_MENU.value),
-            reply_markup=await reply_keyboard(Buttons.MAIN.menu()),
+            reply_markup=KEYBOARDS[Buttons.MAIN],
             parse_mode="MarkdownV2",
         )
 
 
-@dp.message_handler(Text(equals=Buttons.MAIN_FORECASTS.value))
+@button(Buttons.MAIN_FORECASTS)
 async def forecasts(message: types.Message):
     telegram_id, username = await get_user_data(message)
-    await bot.send_message(
+    await sender.send_message(
         telegram_id,
         Messages.MENU_CHANGED.format(menu=Buttons.MAIN_FORECASTS.value),
-        reply_markup=await reply_keyboard(Buttons.FORECASTS.menu()),
+        reply_markup=KEYBOARDS[Buttons.FORECASTS],
         parse_mode="MarkdownV2",
     )
 
 
-@dp.message_handler(Text(equals=Buttons.MAIN_LOCATION.value))
+@button(Buttons.MAIN_LOCATION)
 async def location(message: types.Message):
     telegram_id, username = await get_user_data(message)
-    await bot.send_message(
+    await sender.send_message(
         telegram_id,
         Messages.MENU_CHANGED.format(menu=Buttons.MAIN_LOCATION.value),
-        reply_markup=await reply_keyboard(Buttons.LOCATION.menu()),
+        reply_markup=KEYBOARDS[Buttons.LOCATION],
         parse_mode="MarkdownV2",
     )
 
 
-@dp.message_handler(Text(equals=Buttons.MAIN_NOTIFICATIONS.value))
+@button(Buttons.MAIN_NOTIFICATIONS)
 async def notification(message: types.Message):
     telegram_id, username = await get_user_data(message)
-    await bot.send_message(
+    await sender.send_message(
         telegram_id,
         Messages.MENU_CHANGED.format(menu=Buttons.MAIN_NOTIFICATIONS.value),
-        reply_markup=await reply_keyboard(Buttons.NOTIFICATIONS.menu()),
+        reply_markup=KEYBOARDS[Buttons.NOTIFICATIONS],
         parse_mode="MarkdownV2",
     )
 
 
-@dp.message_handler(Text(equals=Buttons.MAIN_ADMIN.value))
+@button(Buttons.MAIN_ADMIN)
 async def admin(message: types.Message):
     telegram_id, username = await get_user_data(message)
 
     if telegram_id != g.ADMIN:
         return
 
-    await bot.send_message(
+    await sender.send_message(
         telegram_id,
         Messages.MENU_CHANGED.format(menu=Buttons.MAIN_ADMIN.value),
-        reply_markup=await reply_keyboard(Buttons.ADMIN.menu()),
+        reply_markup=KEYBOARDS[Buttons.ADMIN],
         parse_mode="MarkdownV2",
     )
 
@@ -220,21 +445,23 @@ async def admin(message: types.Message):
 # Functions for buttons.
 
 
-@dp.message_handler(Text(equals=Buttons.CHANGE_LOCATION.value))
+@button(Buttons.CHANGE_LOCATION)
 async def change_location(message: types.Message):
     telegram_id, username = await get_user_data(message)
 
-    message = await bot.send_message(
+    await sender.send_message(
         telegram_id, Messages.SEARCH_LOCATION.escaped(), parse_mode="MarkdownV2"
     )
-    dp.register_message_handler(location_search)
+
+    await LocationSearch.searching.set()
+    await dp.current_state().update_data(search_started=time())
 
     logger.debug(
-        f"Registered message handler (location_search) for user with telegram ID [{telegram_id}]."
+        f"Set location search state for user with telegram ID [{telegram_id}]."
     )
 
 
-@dp.message_handler(Text(equals=Buttons.SAVED_LOCATION.value))
+@button(Buttons.SAVED_LOCATION)
 async def saved_location(message: types.Message):
     telegram_id, username = await get_user_data(message)
 
@@ -243,7 +470,7 @@ async def saved_location(message: types.Message):
     db.disconnect()
 
     if not location:
-        await bot.send_message(
+        await sender.send_message(
             telegram_id, Messages.NO_LOCATION.escaped(), parse_mode="MarkdownV2"
         )
 
@@ -253,25 +480,26 @@ async def saved_location(message: types.Message):
 
         return
 
-    await bot.send_message(
+    await sender.send_message(
         telegram_id,
-        Messages.LOCATION.format(location=location),
+        Messages.LOCATION.format(location=location.label),
         parse_mode="MarkdownV2",
     )
 
     logger.debug(
-        f"Sent to user with telegram ID [{telegram_id}] location message. Location: [{location}]."
+        f"Sent to user with telegram ID [{telegram_id}] location message. Location: [{location.label}]."
     )
 
 
-@dp.message_handler(Text(equals=Buttons.CURRENT_WEATHER.value))
+@button(Buttons.CURRENT_WEATHER)
+@debounced
 async def current_weather(message: types.Message):
     telegram_id, username = await get_user_data(message)
 
-    location = get_user_location(telegram_id)
+    location, profile = get_user_settings(telegram_id)
 
     if not location:
-        await bot.send_message(
+        await sender.send_message(
             telegram_id, Messages.NO_LOCATION.escaped(), parse_mode="MarkdownV2"
         )
 
@@ -281,27 +509,34 @@ async def current_weather(message: types.Message):
 
         return
 
-    ins = Instance(telegram_id)
-    response = ins.get_current_weather(location)
+    image = image_cache.get(("current", location.id, profile))
 
-    if not response:
-        await bot.send_message(
-            telegram_id, Messages.NO_WEATHER.escaped(), parse_mode="MarkdownV2"
-        )
+    if not image:
+        response = await fetch_current_weather(telegram_id, location)
 
-        logger.warning(
-            f"Sent to user with telegram ID [{telegram_id}] no weather message."
-        )
+        if not response:
+            await sender.send_message(
+                telegram_id, Messages.NO_WEATHER.escaped(), parse_mode="MarkdownV2"
+            )
 
-        return
+            logger.warning(
+                f"Sent to user with telegram ID [{telegram_id}] no weather message."
+            )
+
+            return
+
+        rendering = asyncio.ensure_future(
+            render_current_weather(location, response, profile)
+        )
 
-    weather = extract_current_weather(response.to_dict())
+        if g.PROGRESSIVE_DELIVERY:
+            weather = {**extract_current_weather(response), "name": location.name}
+            await send_summary(telegram_id, Messages.CURRENT_SUMMARY.format(**weather))
 
-    d = Drawer()
-    image = d.draw_current_weather(weather)
+        image = await rendering
 
     if not image:
-        await bot.send_message(
+        await sender.send_message(
             telegram_id, Messages.DRAWING_ERROR.escaped(), parse_mode="MarkdownV2"
         )
 
@@ -309,26 +544,24 @@ async def current_weather(message: types.Message):
             f"Sent to user with telegram ID [{telegram_id}] drawing error message."
         )
 
-    photo = InputFile(image)
+        return
+
+    comparison = await asyncio.to_thread(history.compare, index.key(location))
 
-    await bot.send_photo(telegram_id, photo)
+    await send_image(
+        telegram_id,
+        image,
+        f"current_weather.{g.IMAGE_PROFILES[profile]['extension']}",
+        caption=compare_with_yesterday(comparison),
+    )
 
     logger.debug(
         f"Sent to user with telegram ID [{telegram_id}] current weather image."
     )
 
-    await asyncio.sleep(60)
 
-    try:
-        os.remove(image)
-        logger.debug(f"Successfully deleted image [{image}].")
-    except FileNotFoundError:
-        logger.error(f"There was an error while deleting image [{image}].")
-
-
-@dp.message_handler(
-    Text(equals=[Buttons.TODAY_WEATHER.value, Buttons.TOMORROW_WEATHER.value])
-)
+@button(Buttons.TODAY_WEATHER, Buttons.TOMORROW_WEATHER)
+@debounced
 async def day_weather(
     message: types.Message = None, telegram_id: int = None, day: str = None
 ):
@@ -348,76 +581,89 @@ async def day_weather(
         elif message.text == Buttons.TOMORROW_WEATHER.value:
             day = "tomorrow"
 
+    priority = Priority.INTERACTIVE if message else Priority.NOTIFICATION
+
     logger.debug(
         f"The function [{day_weather.__name__}] will prepare weather for [{day}]."
     )
 
-    location = get_user_location(telegram_id)
-
-    if day == "today":
-        date = datetime.now().strftime("%Y-%m-%d")
-    elif day == "tomorrow":
-        date = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
-
-    ins = Instance(telegram_id)
-    response = (
-        ins.get_forecast(location, date, 1)
-        .to_dict()
-        .get("forecast")
-        .get("forecastday")[0]
-    )
+    location, profile = get_user_settings(telegram_id)
 
-    if not response:
-        await bot.send_message(
-            telegram_id, Messages.NO_WEATHER.escaped(), parse_mode="MarkdownV2"
+    if not location:
+        await sender.send_message(
+            telegram_id,
+            Messages.NO_LOCATION.escaped(),
+            priority=priority,
+            parse_mode="MarkdownV2",
         )
 
-        logger.warning(
-            f"Sent to user with telegram ID [{telegram_id}] no weather message."
+        logger.debug(
+            f"Sent to user with telegram ID [{telegram_id}] no location message."
         )
 
         return
 
-    weather = extract_forecast_weather(response.get("hour"))
+    date = notification_date(day)
 
-    metadata = extract_forecast_metadata(response)
-    metadata.update(
-        {
-            "location": location,
-            "date": date,
-        }
-    )
+    image = image_cache.get(("forecast", location.id, date, profile))
+
+    if not image:
+        response = await fetch_forecast(telegram_id, location, date)
 
-    d = Drawer()
-    image = d.draw_forecast_weather(weather, metadata)
+        if not response:
+            await sender.send_message(
+                telegram_id,
+                Messages.NO_WEATHER.escaped(),
+                priority=priority,
+                parse_mode="MarkdownV2",
+            )
+
+            logger.warning(
+                f"Sent to user with telegram ID [{telegram_id}] no weather message."
+            )
+
+            return
+
+        rendering = asyncio.ensure_future(
+            render_forecast_weather(location, date, response, profile)
+        )
+
+        if g.PROGRESSIVE_DELIVERY and message:
+            metadata = extract_forecast_metadata(response)
+            await send_summary(
+                telegram_id,
+                Messages.FORECAST_SUMMARY.format(
+                    location=location.name, date=date, **metadata
+                ),
+            )
+
+        image = await rendering
 
     if not image:
-        await bot.send_message(
-            telegram_id, Messages.DRAWING_ERROR.escaped(), parse_mode="MarkdownV2"
+        await sender.send_message(
+            telegram_id,
+            Messages.DRAWING_ERROR.escaped(),
+            priority=priority,
+            parse_mode="MarkdownV2",
         )
 
         logger.warning(
             f"Sent to user with telegram ID [{telegram_id}] drawing error message."
         )
 
-    photo = InputFile(image)
-
-    await bot.send_photo(telegram_id, photo)
+        return
 
-    logger.debug(
-        f"Sent to user with telegram ID [{telegram_id}] current weather image."
+    await send_image(
+        telegram_id,
+        image,
+        f"forecast_weather.{g.IMAGE_PROFILES[profile]['extension']}",
+        priority,
     )
 
-    await asyncio.sleep(60)
-
-    try:
-        os.remove(image)
-        logger.debug(f"Successfully deleted image [{image}].")
-    except FileNotFoundError:
-        logger.error(f"There was an error while deleting image [{image}].")
+    logger.debug(f"Sent to user with telegram ID [{telegram_id}] {day} weather image.")
 
 
-@dp.message_handler(Text(equals=Buttons.NOTIFY_TODAY.value))
+@button(Buttons.NOTIFY_TODAY)
 async def notify_today(message: types.Message):
     telegram_id, username = await get_user_data(message)
 
@@ -429,20 +675,20 @@ async def notify_today(message: types.Message):
     db.disconnect()
 
     if status:
-        await bot.send_message(
+        await sender.send_message(
             telegram_id,
             Messages.NOTIFY_TRUE.format(notification=notification),
             parse_mode="MarkdownV2",
         )
     else:
-        await bot.send_message(
+        await sender.send_message(
             telegram_id,
             Messages.NOTIFY_FALSE.format(notification=notification),
             parse_mode="MarkdownV2",
         )
 
 
-@dp.message_handler(Text(equals=Buttons.NOTIFY_TOMORROW.value))
+@button(Buttons.NOTIFY_TOMORROW)
 async def notify_tomorrow(message: types.Message):
     telegram_id, username = await get_user_data(message)
 
@@ -454,24 +700,64 @@ async def notify_tomorrow(message: types.Message):
     db.disconnect()
 
     if status:
-        await bot.send_message(
+        await sender.send_message(
             telegram_id,
             Messages.NOTIFY_TRUE.format(notification=notification),
             parse_mode="MarkdownV2",
         )
     else:
-        await bot.send_message(
+        await sender.send_message(
             telegram_id,
             Messages.NOTIFY_FALSE.format(notification=notification),
             parse_mode="MarkdownV2",
         )
 
 
+@button(Buttons.NOTIFY_ALERTS)
+async def notify_alerts(message: types.Message):
+    telegram_id, username = await get_user_data(message)
+
+    notification = "alerts"
+
+    db = Database(telegram_id)
+    db.change_notification_status(notification)
+    status = db.notification_status(notification)
+    db.disconnect()
+
+    if status:
+        await sender.send_message(
+            telegram_id, Messages.ALERTS_TRUE.escaped(), parse_mode="MarkdownV2"
+        )
+    else:
+        await sender.send_message(
+            telegram_id, Messages.ALERTS_FALSE.escaped(), parse_mode="MarkdownV2"
+        )
+
+
+@button(Buttons.IMAGE_QUALITY)
+async def image_quality(message: types.Message):
+    telegram_id, username = await get_user_data(message)
+
+    inline_buttons = {
+        f"imageprofile_{name}": profile["label"]
+        for name, profile in g.IMAGE_PROFILES.items()
+    }
+
+    await sender.send_message(
+        telegram_id,
+        Messages.IMAGE_PROFILES.escaped(),
+        reply_markup=await inline_keyboard(inline_buttons),
+        parse_mode="MarkdownV2",
+    )
+
+    logger.debug(f"Sent to user with telegram ID [{telegram_id}] image profiles.")
+
+
 # Functions for notifications.
 
 
-@crontab("0 6 * * *")
-@crontab("0 17 * * *")
+@crontab(f"0 {g.NOTIFY_TODAY_HOUR} * * *")
+@crontab(f"0 {g.NOTIFY_TOMORROW_HOUR} * * *")
 async def day_notifications():
     """Send notifications about today or tomorrow weather depending on the time of day."""
 
@@ -485,24 +771,408 @@ async def day_notifications():
         f"Current hour is [{hour}]. Sending notifications about [{notification}] weather."
     )
 
+    if g.COORDINATION == "leader" and not await asyncio.to_thread(
+        coordinator.is_leader
+    ):
+        return
+
+    for status in ("total", "sent", "failed"):
+        NOTIFICATION_USERS.set(0, notification=notification, status=status)
+
+    if g.COORDINATION != "shard":
+        await notify_users(notification)
+        return
+
+    run_id = f"{notification}_{notification_date(notification)}"
+    await asyncio.to_thread(coordinator.create_units, run_id)
+
+    # The shards pre-warmed by this replica are claimed first, since their images are
+    # already in its cache. The replica waits until all shards are delivered, so the shards
+    # of a replica, which died during the run, are delivered when their leases expire.
+    await process_units(
+        run_id,
+        lambda shard: notify_users(notification, shard),
+        preferred=PREWARMED_SHARDS.pop(run_id, set()),
+        wait=True,
+    )
+
+
+# Shards pre-warmed by this replica by the IDs of the notification runs.
+PREWARMED_SHARDS: dict[str, set[int]] = {}
+
+
+async def process_units(
+    run_id: str, work: Callable, preferred: set[int] = (), wait: bool = False
+) -> list[int]:
+    """Claims the shards of the run one by one and processes them, the lease of the shard is
+    renewed while it's processed. The shards are spread between the replicas by their
+    throughput. The shard, which fails, is left unfinished and retried after its lease
+    expires by any replica, this replica gives up after [g.COORDINATION_ATTEMPTS] attempts.
+
+    Args:
+        run_id (str): identifier of the run.
+        work (Callable): coroutine function called with the number of the shard.
+        preferred (set[int], optional): shards, which are claimed first if available.
+        wait (bool, optional): whether to wait for the shards claimed by other replicas until
+            all shards of the run are done, and claim them if their leases expire.
+
+    Returns:
+        list[int]: numbers of the shards processed by this replica.
+    """
+    processed = []
+    # Failed attempts of this replica and the time of the last one by the shards.
+    failures: dict[int, tuple[int, float]] = {}
+
+    while True:
+        now = monotonic()
+        abandoned = {
+            shard
+            for shard, (attempts, _) in failures.items()
+            if attempts >= g.COORDINATION_ATTEMPTS
+        }
+        excluded = abandoned | {
+            shard
+            for shard, (_, failed) in failures.items()
+            if now - failed < g.COORDINATION_LEASE
+        }
+
+        shard = await asyncio.to_thread(
+            coordinator.claim_unit, run_id, list(preferred), list(excluded)
+        )
+
+        if shard is None:
+            if (
+                not wait
+                or set(await asyncio.to_thread(coordinator.pending_units, run_id))
+                <= abandoned
+            ):
+                return processed
+
+            await asyncio.sleep(g.COORDINATION_LEASE / 3)
+            continue
+
+        renewal = asyncio.create_task(renew_lease(run_id, shard))
+        try:
+            await work(shard)
+        except Exception as error:
+            attempts = failures.get(shard, (0, 0))[0] + 1
+            failures[shard] = (attempts, monotonic())
+
+            logger.error(
+                f"Failed to process shard [{shard}] of run [{run_id}], attempt "
+                f"[{attempts}]: [{error}]."
+            )
+            continue
+        finally:
+            renewal.cancel()
+
+        await asyncio.to_thread(coordinator.complete_unit, run_id, shard)
+        processed.append(shard)
+
+
+async def renew_lease(run_id: str, shard: int):
+    """Renews the lease of the claimed shard until the task is cancelled."""
+    while True:
+        await asyncio.sleep(g.COORDINATION_LEASE / 3)
+        try:
+            await asyncio.to_thread(coordinator.renew_unit, run_id, shard)
+        except Exception as error:
+            logger.warning(
+                f"Failed to renew the lease of shard [{shard}] of run [{run_id}]: [{error}]."
+            )
+
+
+async def notify_users(notification: str, shard: int = None):
+    """Sends the notification to all subscribed users or only to the users in the shard.
+
+    Args:
+        notification (str): notification to send ("today" or "tomorrow")
+        shard (int, optional): number of the shard to send notifications to.
+    """
+    shards = g.COORDINATION_SHARDS if shard is not None else None
+
     db = Database(g.ADMIN)
-    users = db.get_notified_users(notification)
+    users = db.get_notified_users(notification, shard, shards)
     db.disconnect()
 
+    NOTIFICATION_USERS.inc(len(users), notification=notification, status="total")
+
     logger.debug(
-        f"Retrived [{len(users)}] users to notify about [{notification}] weather. Starting notifications..."
+        f"Retrived [{len(users)}] users in shard [{shard}] to notify about [{notification}] weather. "
+        "Starting notifications..."
+    )
+
+    # The notifications are sent concurrently, the sender queue limits the rate and gives
+    # priority to the interactive replies.
+    semaphore = asyncio.Semaphore(g.NOTIFY_CONCURRENCY)
+
+    async def notify_user(telegram_id: int):
+        async with semaphore:
+            with trace(
+                "notification", telegram_id=telegram_id, notification=notification
+            ):
+                try:
+                    await day_weather(telegram_id=telegram_id, day=notification)
+                except Exception:
+                    NOTIFICATION_USERS.inc(notification=notification, status="failed")
+                    raise
+
+            NOTIFICATION_USERS.inc(notification=notification, status="sent")
+
+    results = await asyncio.gather(
+        *[notify_user(user.telegram_id) for user in users], return_exceptions=True
+    )
+
+    for user, result in zip(users, results):
+        if isinstance(result, Exception):
+            logger.error(
+                f"Failed to notify user with telegram ID [{user.telegram_id}] about "
+                f"[{notification}] weather: [{result}]."
+            )
+
+
+async def prewarm_notifications(notification: str):
+    """Fetches forecasts and renders images for all distinct locations of users subscribed
+    to the notification, so when the notification is triggered it only sends cached images.
+
+    Args:
+        notification (str): notification to prepare images for ("today" or "tomorrow")
+    """
+    logger.debug(f"Crontab triggered pre-warm for [{notification}] notifications.")
+
+    if g.COORDINATION == "leader" and not await asyncio.to_thread(
+        coordinator.is_leader
+    ):
+        return
+
+    if g.COORDINATION != "shard":
+        await prewarm_locations(notification)
+        return
+
+    # The pre-warm has its own work units, so the delivery is balanced separately. The
+    # pre-warmed shards are preferred on delivery, since the images are in the cache.
+    run_id = f"{notification}_{notification_date(notification)}"
+    await asyncio.to_thread(coordinator.create_units, f"prewarm_{run_id}")
+
+    PREWARMED_SHARDS[run_id] = set(
+        await process_units(
+            f"prewarm_{run_id}", lambda shard: prewarm_locations(notification, shard)
+        )
+    )
+
+
+async def prewarm_locations(notification: str, shard: int = None):
+    """Fetches forecasts and renders images in rate-limited batches for distinct locations
+    of subscribed users or only of the users in the shard.
+
+    Args:
+        notification (str): notification to prepare images for ("today" or "tomorrow")
+        shard (int, optional): number of the shard to prepare images for.
+    """
+    date = notification_date(notification)
+    shards = g.COORDINATION_SHARDS if shard is not None else None
+
+    db = Database(g.ADMIN)
+    locations = db.get_notified_locations(notification, shard, shards)
+    db.disconnect()
+
+    logger.debug(
+        f"Retrieved [{len(locations)}] distinct locations in shard [{shard}] to pre-warm for "
+        f"[{notification}] notifications on date [{date}]."
+    )
+
+    async def prewarm_location(location: Location) -> bool:
+        # Only the images of the deployment profile are prepared, the users with another
+        # profile get theirs rendered on delivery.
+        if ("forecast", location.id, date, g.IMAGE_PROFILE) in image_cache:
+            return True
+
+        with trace("prewarm", location=location.id, date=date):
+            response = await fetch_forecast(g.ADMIN, location, date)
+            if not response:
+                return False
+
+            image = await render_forecast_weather(
+                location, date, response, g.IMAGE_PROFILE
+            )
+            return bool(image)
+
+    prepared = 0
+    for i in range(0, len(locations), g.PREWARM_BATCH_SIZE):
+        if i:
+            await asyncio.sleep(g.PREWARM_BATCH_DELAY)
+
+        batch = locations[i : i + g.PREWARM_BATCH_SIZE]
+        results = await asyncio.gather(
+            *[prewarm_location(location) for location in batch],
+            return_exceptions=True,
+        )
+
+        for location, result in zip(batch, results):
+            if result is True:
+                prepared += 1
+            else:
+                logger.warning(
+                    f"Failed to pre-warm [{notification}] forecast for location [{location.label}]: [{result}]."
+                )
+
+    logger.info(
+        f"Pre-warmed [{prepared}] of [{len(locations)}] locations in shard [{shard}] "
+        f"for [{notification}] notifications."
+    )
+
+
+@crontab(f"*/{g.ALERTS_MINUTES} * * * *")
+async def check_alerts():
+    """Polls the current weather of the locations subscribed to the alerts and notifies the
+    users of the locations, which weather crossed the thresholds since the previous poll.
+    """
+    if g.COORDINATION != "none" and not await asyncio.to_thread(coordinator.is_leader):
+        return
+
+    db = Database(g.ADMIN)
+    locations = db.get_notified_locations("alerts")
+    db.disconnect()
+
+    watcher.retain({location.id for location in locations})
+
+    alerts = {}
+
+    async def poll_location(location: Location):
+        response = await fetch_current_weather(g.ADMIN, location)
+        if response:
+            alerts[location] = watcher.update(location.id, response)
+
+    for i in range(0, len(locations), g.ALERTS_BATCH_SIZE):
+        if i:
+            await asyncio.sleep(g.ALERTS_BATCH_DELAY)
+
+        batch = locations[i : i + g.ALERTS_BATCH_SIZE]
+        results = await asyncio.gather(
+            *[poll_location(location) for location in batch], return_exceptions=True
+        )
+
+        for location, result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.warning(
+                    f"Failed to poll weather for alerts in location [{location.label}]: [{result}]."
+                )
+
+    changed = {location.id: (location, a) for location, a in alerts.items() if a}
+
+    logger.info(
+        f"Polled [{len(alerts)}] of [{len(locations)}] locations for alerts, "
+        f"[{len(changed)}] of them changed."
     )
 
-    for user in users:
-        telegram_id = user.telegram_id
+    if not changed:
+        return
+
+    db = Database(g.ADMIN)
+    users = db.get_alerted_users(list(changed))
+    db.disconnect()
+
+    semaphore = asyncio.Semaphore(g.NOTIFY_CONCURRENCY)
+
+    async def alert_user(telegram_id: int, location_id: int):
+        location, location_alerts = changed[location_id]
+
+        text = "\n".join(
+            (
+                Messages.ALERT_RAIN
+                if kind == "rain"
+                else Messages.ALERT_TEMPERATURE_DROP
+            ).format(location=location.name, **arguments)
+            for kind, arguments in location_alerts
+        )
+
+        async with semaphore:
+            await sender.send_message(
+                telegram_id,
+                text,
+                priority=Priority.NOTIFICATION,
+                parse_mode="MarkdownV2",
+            )
+
+    results = await asyncio.gather(
+        *[alert_user(telegram_id, location_id) for telegram_id, location_id in users],
+        return_exceptions=True,
+    )
+
+    for (telegram_id, _), result in zip(users, results):
+        if isinstance(result, Exception):
+            NOTIFICATION_USERS.inc(notification="alerts", status="failed")
+            logger.error(
+                f"Failed to alert user with telegram ID [{telegram_id}]: [{result}]."
+            )
+        else:
+            NOTIFICATION_USERS.inc(notification="alerts", status="sent")
+
+
+def prewarm_spec(hour: int) -> str:
+    """Returns the crontab spec which triggers [g.PREWARM_MINUTES] before the specified hour.
 
-        await day_weather(telegram_id=telegram_id, day=notification)
+    Args:
+        hour (int): hour of the day when the notification is sent.
+
+    Returns:
+        str: crontab spec for the pre-warm stage.
+    """
+    time = datetime(2000, 1, 1, hour) - timedelta(minutes=g.PREWARM_MINUTES)
+    return f"{time.minute} {time.hour} * * *"
+
+
+crontab(prewarm_spec(g.NOTIFY_TODAY_HOUR), func=prewarm_notifications, args=("today",))
+crontab(
+    prewarm_spec(g.NOTIFY_TOMORROW_HOUR),
+    func=prewarm_notifications,
+    args=("tomorrow",),
+)
+
+
+@crontab(f"*/{g.CACHE_SNAPSHOT_MINUTES} * * * *")
+async def snapshot_caches():
+    """Saves the persistent caches to the snapshot."""
+    entries = collect()
+    await asyncio.to_thread(save_snapshot, entries)
+
+
+@crontab("30 3 * * *")
+async def compact_history():
+    """Drops the old days from the local history of the weather and thins the previous ones."""
+    await asyncio.to_thread(history.compact)
+
+
+@crontab("* * * * *")
+async def measure_memory():
+    """Measures the size of the FSM storage, which is counted in the memory budget of the
+    caches, and evicts the cached entries if the budget is exceeded."""
+    budget.measure("fsm", sizeof(storage.data))
+
+
+@crontab("*/5 * * * *")
+async def sweep_search_states():
+    """Removes the expired location search states from the FSM storage, which are otherwise
+    removed only when the user writes again."""
+    expired = [
+        (chat, user)
+        for chat, users in storage.data.items()
+        for user, record in users.items()
+        if record["state"] == LocationSearch.searching.state
+        and time() - record["data"].get("search_started", 0) > g.LOCATION_SEARCH_TIMEOUT
+    ]
+
+    for chat, user in expired:
+        await storage.finish(chat=chat, user=user)
+
+    if expired:
+        logger.debug(f"Removed [{len(expired)}] expired location search states.")
 
 
 # Functions for admin buttons.
 
 
-@dp.message_handler(Text(equals=Buttons.SHOW_USERS.value))
+@button(Buttons.SHOW_USERS)
 async def show_users(message: types.Message):
     telegram_id, username = await get_user_data(message)
 
@@ -515,26 +1185,96 @@ async def show_users(message: types.Message):
 
     usernames_string = ", ".join(usernames)
 
-    await bot.send_message(
+    await sender.send_message(
         telegram_id,
         Messages.SHOW_USERS.value.format(
             usernames=usernames_string, total=len(usernames)
         ),
+        priority=Priority.BULK,
     )
 
 
-# Functions for registered message handlers.
+@button(Buttons.PROFILE_START)
+async def profile_start(message: types.Message):
+    telegram_id, username = await get_user_data(message)
 
+    if telegram_id != g.ADMIN:
+        return
+
+    from profiling import profiler
+
+    if profiler.running:
+        await sender.send_message(telegram_id, Messages.PROFILING_RUNNING.value)
+        return
+
+    async def send_report(report: bytes):
+        await sender.send_document(
+            telegram_id,
+            report,
+            f"profile_{datetime.now():%Y%m%d_%H%M%S}.txt",
+            priority=Priority.BULK,
+            caption=Messages.PROFILING_REPORT.value,
+        )
+
+    profiler.start(g.PROFILE_DURATION, send_report)
 
-async def location_search(message: types.Message):
+    await sender.send_message(
+        telegram_id,
+        Messages.PROFILING_STARTED.value.format(duration=g.PROFILE_DURATION),
+    )
+
+
+@button(Buttons.PROFILE_STOP)
+async def profile_stop(message: types.Message):
+    telegram_id, username = await get_user_data(message)
+
+    if telegram_id != g.ADMIN:
+        return
+
+    from profiling import profiler
+
+    if not profiler.running:
+        await sender.send_message(telegram_id, Messages.PROFILING_NOT_RUNNING.value)
+        return
+
+    await profiler.stop()
+
+
+# Functions for states.
+
+
+@dp.message_handler(state=LocationSearch.searching)
+@timed
+async def location_search(message: types.Message, state: FSMContext):
     telegram_id, username = await get_user_data(message)
     query = message.text
 
+    data = await state.get_data()
+
+    if time() - data.get("search_started", 0) > g.LOCATION_SEARCH_TIMEOUT:
+        await state.finish()
+
+        await sender.send_message(
+            telegram_id,
+            Messages.SEARCH_STATE_EXPIRED.escaped(),
+            parse_mode="MarkdownV2",
+        )
+
+        logger.debug(
+            f"Location search state expired for user with telegram ID [{telegram_id}]."
+        )
+
+        return
+
+    from api import Instance
+
     instance = Instance(telegram_id)
-    search_results = instance.search(query)
+    search_results = await asyncio.to_thread(instance.search, query)
 
     if not search_results:
-        await bot.send_message(
+        await state.update_data(search_started=time())
+
+        await sender.send_message(
             telegram_id, Messages.NO_RESULTS.escaped(), parse_mode="MarkdownV2"
         )
 
@@ -544,12 +1284,22 @@ async def location_search(message: types.Message):
 
         return
 
-    inline_buttons = {
-        f"setlocation_{result['name']}": f"{result['name']}, {result['country']}"
-        for result in search_results
-    }
+    inline_buttons = {}
+    for result in search_results:
+        # Storing the result on the server, since the callback data is limited to 64 bytes.
+        token = token_urlsafe(6)
+        search_results_cache.set(token, (telegram_id, result))
 
-    await bot.send_message(
+        label = ", ".join(
+            part
+            for part in (result["name"], result.get("region"), result["country"])
+            if part
+        )
+        inline_buttons[f"setlocation_{token}"] = label
+
+    await state.finish()
+
+    await sender.send_message(
         telegram_id,
         Messages.SEARCH_RESULTS.escaped(),
         reply_markup=await inline_keyboard(inline_buttons),
@@ -560,30 +1310,43 @@ async def location_search(message: types.Message):
         f"Sent to user with telegram ID [{telegram_id}] search results with length {len(inline_buttons)}."
     )
 
-    dp.message_handlers.unregister(location_search)
-
-    logger.debug(
-        f"Cleared message handler (location_search) for user with telegram ID [{telegram_id}]."
-    )
-
 
 # Functions for callback data catching.
 
 
-@dp.callback_query_handler(text_contains="setlocation_")
+@dp.callback_query_handler(text_contains="setlocation_", state="*")
+@timed
 async def setlocation_callback(callback_query: types.CallbackQuery):
     telegram_id, username = await get_user_data(callback_query)
-    location = callback_query.data.split("setlocation_")[1]
+    token = callback_query.data.split("setlocation_")[1]
+
+    stored = search_results_cache.get(token)
+
+    if not stored or stored[0] != telegram_id:
+        await sender.send_message(
+            telegram_id, Messages.SEARCH_EXPIRED.escaped(), parse_mode="MarkdownV2"
+        )
+
+        logger.debug(
+            f"Search result for token [{token}] expired for user with telegram ID [{telegram_id}]."
+        )
+
+        return
+
+    result = stored[1]
+    location = result["name"]
 
     logger.debug(
-        f"Extracted location [{location}] from callback data for user with telegram ID [{telegram_id}]."
+        f"Resolved location [{location}] with WeatherAPI ID [{result['id']}] from callback data "
+        f"for user with telegram ID [{telegram_id}]."
     )
 
     db = Database(telegram_id)
-    db.update_user(username, location)
+    location_id = db.save_location(result)
+    db.update_user(username, location_id)
     db.disconnect()
 
-    await bot.send_message(
+    await sender.send_message(
         telegram_id,
         Messages.LOCATION_UPDATED.format(location=location),
         parse_mode="MarkdownV2",
@@ -594,17 +1357,66 @@ async def setlocation_callback(callback_query: types.CallbackQuery):
     )
 
 
+@dp.callback_query_handler(text_contains="imageprofile_", state="*")
+@timed
+async def imageprofile_callback(callback_query: types.CallbackQuery):
+    telegram_id, username = await get_user_data(callback_query)
+    profile = callback_query.data.split("imageprofile_")[1]
+
+    if profile not in g.IMAGE_PROFILES:
+        logger.warning(
+            f"Unknown image profile [{profile}] from user with telegram ID [{telegram_id}]."
+        )
+        return
+
+    db = Database(telegram_id)
+    updated = db.set_image_profile(profile)
+    db.disconnect()
+
+    if not updated:
+        await sender.send_message(
+            telegram_id, Messages.NO_LOCATION.escaped(), parse_mode="MarkdownV2"
+        )
+        return
+
+    await sender.send_message(
+        telegram_id,
+        Messages.IMAGE_PROFILE_UPDATED.format(
+            profile=g.IMAGE_PROFILES[profile]["label"]
+        ),
+        parse_mode="MarkdownV2",
+    )
+
+    logger.debug(
+        f"Sent to user with telegram ID [{telegram_id}] image profile update message."
+    )
+
+
 # Keyboard generators.
 
 
-async def reply_keyboard(reply_buttons: list):
+def reply_keyboard(reply_buttons: list) -> str:
+    """Builds the reply keyboard and serializes it to JSON, which is sent as is."""
     reply_keyboard = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
     for button in reply_buttons:
         reply_keyboard.add(KeyboardButton(button))
 
     logger.debug(f"Generated reply keyboard with length [{len(reply_buttons)}].")
 
-    return reply_keyboard
+    return json.dumps(reply_keyboard.to_python())
+
+
+KEYBOARDS = {
+    menu: reply_keyboard(menu.menu())
+    for menu in (
+        Buttons.MAIN,
+        Buttons.ADMIN_MAIN,
+        Buttons.ADMIN,
+        Buttons.FORECASTS,
+        Buttons.LOCATION,
+        Buttons.NOTIFICATIONS,
+    )
+}
 
 
 async def inline_keyboard(inline_buttons: dict):
@@ -622,21 +1434,385 @@ async def inline_keyboard(inline_buttons: dict):
 # Utility functons.
 
 
-def get_user_location(telegram_id: int) -> str:
+def get_user_settings(telegram_id: int) -> tuple[Location | None, str]:
+    """Returns the location of the user and the image profile, the deployment profile is used
+    if the user hasn't chosen one or it's not configured anymore."""
 
     logger.debug(
         f"Trying to get user location for user with telegram ID [{telegram_id}]."
     )
 
     db = Database(telegram_id)
-    location = db.get_user_location()
+    location, profile = db.get_user_settings()
     db.disconnect()
 
+    if profile not in g.IMAGE_PROFILES:
+        profile = g.IMAGE_PROFILE
+
     logger.debug(
-        f"Retrieved location [{location}] for user with telegram ID [{telegram_id}]."
+        f"Retrieved location [{location and location.label}] and image profile [{profile}] "
+        f"for user with telegram ID [{telegram_id}]."
     )
 
-    return location
+    return location, profile
+
+
+# Requests to WeatherAPI in progress by the kinds and cache keys of the weather.
+FETCHING = {}
+
+
+def remember_timezone(location: Location, response: dict):
+    """Saves the timezone of the location from the WeatherAPI response, if it's not known yet."""
+    tz_id = (response.get("location") or {}).get("tz_id")
+
+    if location.tz_id or not tz_id:
+        return
+
+    db = Database(g.ADMIN)
+    db.set_location_timezone(location.id, tz_id)
+    db.disconnect()
+
+    location.tz_id = tz_id
+
+
+async def fetch_current_weather(telegram_id: int, location: Location) -> dict | None:
+    """Returns current weather for the location from the cache or from WeatherAPI.
+
+    Args:
+        telegram_id (int): telegram_id of the user who requested the weather.
+        location (Location): location of the user.
+
+    Returns:
+        dict | None: response of the WeatherAPI as a dict, None if request failed.
+    """
+    key = index.key(location)
+    response = current_weather_cache.get(key)
+
+    if response is not None:
+        index.record("current", key, location, fetched=False)
+        return response
+
+    response = await from_history("current", key, g.CURRENT_WEATHER_TTL)
+    if response is not None:
+        return response
+
+    async def fetch() -> dict | None:
+        from api import Instance
+
+        ins = Instance(telegram_id)
+        response = await asyncio.to_thread(
+            ins.get_current_weather, index.query(location)
+        )
+
+        if not response:
+            return None
+
+        response = response.to_dict()
+        current_weather_cache.set(key, response)
+        await asyncio.to_thread(history.append, key, "current", response)
+
+        remember_timezone(location, response)
+
+        return response
+
+    return await fetch_once("current", key, location, fetch)
+
+
+async def fetch_forecast(
+    telegram_id: int, location: Location, date: str
+) -> dict | None:
+    """Returns forecast for the location on the date from the cache or from WeatherAPI.
+
+    Args:
+        telegram_id (int): telegram_id of the user who requested the forecast.
+        location (Location): location of the user.
+        date (str): date of the forecast in format YYYY-MM-DD.
+
+    Returns:
+        dict | None: forecastday of the WeatherAPI response as a dict, None if request failed.
+    """
+    weather_key = index.key(location)
+    key = (weather_key, date)
+    response = forecast_cache.get(key)
+
+    if response is not None:
+        index.record("forecast", key, location, fetched=False)
+        return response
+
+    response = await from_history("forecast", weather_key, g.FORECAST_TTL, date)
+    if response is not None:
+        return response
+
+    async def fetch() -> dict | None:
+        from api import Instance
+
+        ins = Instance(telegram_id)
+        response = await asyncio.to_thread(
+            ins.get_forecast, index.query(location), date, 1
+        )
+
+        if not response:
+            return None
+
+        response = response.to_dict()
+        remember_timezone(location, response)
+
+        response = response.get("forecast").get("forecastday")[0]
+        forecast_cache.set(key, response)
+        await asyncio.to_thread(history.append, weather_key, "forecast", response, date)
+
+        return response
+
+    return await fetch_once("forecast", key, location, fetch)
+
+
+async def from_history(
+    kind: str, key: Hashable, ttl: int, date: str = None
+) -> dict | None:
+    """Returns the response fetched within the ttl from the local history and stores it in the
+    cache for the rest of the ttl.
+
+    Args:
+        kind (str): kind of the weather: "current" or "forecast".
+        key (Hashable): key of the weather of the location.
+        ttl (int): time to live of the weather in seconds.
+        date (str, optional): date of the forecast in format YYYY-MM-DD.
+
+    Returns:
+        dict | None: response of the WeatherAPI as a dict, None if it's not in the history.
+    """
+    found = await asyncio.to_thread(history.recent, key, kind, ttl, date)
+    if found is None:
+        return None
+
+    response, fetched = found
+    remaining = max(int(fetched + ttl - time()), 1)
+
+    if kind == "current":
+        current_weather_cache.set(key, response, remaining)
+    else:
+        forecast_cache.set((key, date), response, remaining)
+
+    WEATHER_LOOKUPS.inc(kind=kind, result="history")
+
+    return response
+
+
+async def fetch_once(
+    kind: str, key: Hashable, location: Location, fetch: Callable
+) -> dict | None:
+    """Sends the request to WeatherAPI or waits for the same request in progress, so the
+    concurrent lookups of the same weather, e.g. of the locations in one grid cell, are
+    served by one request.
+
+    Args:
+        kind (str): kind of the weather: "current" or "forecast".
+        key (Hashable): key of the weather in the cache.
+        location (Location): location, which requested the weather.
+        fetch (Callable): coroutine function, which requests and caches the weather.
+
+    Returns:
+        dict | None: response of the WeatherAPI as a dict, None if request failed.
+    """
+    task = FETCHING.get((kind, key))
+    fetched = task is None
+
+    if fetched:
+        index.claim(kind, key, location)
+        task = asyncio.ensure_future(fetch())
+        FETCHING[kind, key] = task
+        task.add_done_callback(lambda _: FETCHING.pop((kind, key), None))
+
+    # Shielding the request, so it's not cancelled with one of the waiting handlers.
+    response = await asyncio.shield(task)
+
+    if response is not None:
+        index.record(kind, key, location, fetched)
+
+    return response
+
+
+async def render_current_weather(
+    location: Location, response: dict, profile: str
+) -> bytes | None:
+    """Draws the current weather image in a separate thread and stores it in the cache.
+
+    Args:
+        location (Location): location of the weather.
+        response (dict): response of the WeatherAPI as a dict.
+        profile (str): output profile of the image.
+
+    Returns:
+        bytes | None: encoded image, None if drawing failed.
+    """
+    # The weather of the grid cell is shared by the nearby locations, so the name of the
+    # location is shown instead of the name from the response.
+    weather = {**extract_current_weather(response), "name": location.name}
+
+    from imaging import Drawer
+
+    d = Drawer(profile)
+    image = await asyncio.to_thread(read_image, d.draw_current_weather, weather)
+
+    if image:
+        image_cache.set(("current", location.id, profile), image, g.CURRENT_WEATHER_TTL)
+
+    return image
+
+
+async def render_forecast_weather(
+    location: Location, date: str, response: dict, profile: str
+) -> bytes | None:
+    """Draws the forecast image in a separate thread and stores it in the cache.
+
+    Args:
+        location (Location): location of the forecast, its name is shown on the image.
+        date (str): date of the forecast in format YYYY-MM-DD.
+        response (dict): forecastday of the WeatherAPI response as a dict.
+        profile (str): output profile of the image.
+
+    Returns:
+        bytes | None: encoded image, None if drawing failed.
+    """
+    weather = extract_forecast_weather(response.get("hour"))
+
+    metadata = extract_forecast_metadata(response)
+    metadata.update(
+        {
+            "location": location.name,
+            "date": date,
+        }
+    )
+
+    from imaging import Drawer
+
+    d = Drawer(profile)
+    image = await asyncio.to_thread(
+        read_image, d.draw_forecast_weather, weather, metadata
+    )
+
+    if image:
+        image_cache.set(("forecast", location.id, date, profile), image)
+
+    return image
+
+
+def read_image(draw, *args) -> bytes | None:
+    """Calls the drawing function, reads the saved image into memory and deletes the file.
+
+    Args:
+        draw (Callable): one of the Drawer methods which returns path to the saved image.
+
+    Returns:
+        bytes | None: content of the image, None if drawing failed.
+    """
+    with STAGE_SECONDS.time(stage="render"):
+        filepath = draw(*args)
+
+    if not filepath:
+        return None
+
+    with open(filepath, "rb") as f:
+        image = f.read()
+
+    try:
+        os.remove(filepath)
+        logger.debug(f"Successfully deleted image [{filepath}].")
+    except FileNotFoundError:
+        logger.error(f"There was an error while deleting image [{filepath}].")
+
+    return image
+
+
+async def send_image(
+    telegram_id: int,
+    image: bytes,
+    filename: str,
+    priority: Priority = Priority.INTERACTIVE,
+    caption: str = None,
+):
+    """Sends the rendered image. The image is uploaded once, then it's sent by the file_id
+    returned by Telegram.
+
+    Args:
+        telegram_id (int): telegram_id of the user.
+        image (bytes): content of the image.
+        filename (str): name of the file to upload.
+        priority (Priority, optional): priority class of the message.
+        caption (str, optional): caption of the image in MarkdownV2.
+    """
+    digest = hashlib.blake2b(image, digest_size=16).hexdigest()
+    file_id = file_id_cache.get(digest)
+
+    kwargs = {"caption": caption, "parse_mode": "MarkdownV2"} if caption else {}
+
+    message = await sender.send_photo(
+        telegram_id, file_id or image, filename, priority=priority, **kwargs
+    )
+
+    if not file_id and message and message.photo:
+        file_id_cache.set(digest, message.photo[-1].file_id)
+
+
+async def send_summary(telegram_id: int, summary: str):
+    """Sends the text summary of the weather, while the image is being drawn, and shows
+    the upload photo action in the chat until the image is sent.
+
+    Args:
+        telegram_id (int): telegram_id of the user.
+        summary (str): escaped summary of the weather.
+    """
+    await sender.send_message(telegram_id, summary, parse_mode="MarkdownV2")
+
+    try:
+        await bot.send_chat_action(telegram_id, types.ChatActions.UPLOAD_PHOTO)
+    except Exception as error:
+        logger.warning(
+            f"Failed to send chat action to user with telegram ID [{telegram_id}]: [{error}]."
+        )
+
+    logger.debug(f"Sent to user with telegram ID [{telegram_id}] weather summary.")
+
+
+def compare_with_yesterday(comparison: tuple[dict, dict] | None) -> str | None:
+    """Returns the caption comparing the temperature with the observation a day before.
+
+    Args:
+        comparison (tuple[dict, dict] | None): latest observation and the one a day before it.
+
+    Returns:
+        str | None: caption in MarkdownV2, None if there's no observation to compare with.
+    """
+    if not comparison:
+        return None
+
+    latest, previous = comparison
+    if latest["temp_c"] is None or previous["temp_c"] is None:
+        return None
+
+    difference = latest["temp_c"] - previous["temp_c"]
+
+    if abs(difference) < 1:
+        text = "about the same temperature"
+    else:
+        text = f"{abs(difference):.0f} °C {'warmer' if difference > 0 else 'colder'}"
+
+    return Messages.COMPARED_WITH_YESTERDAY.format(difference=text)
+
+
+def notification_date(day: str) -> str:
+    """Returns the date for the day in format YYYY-MM-DD.
+
+    Args:
+        day (str): "today" or "tomorrow"
+
+    Returns:
+        str: date of the day.
+    """
+    if day == "today":
+        return datetime.now().strftime("%Y-%m-%d")
+    elif day == "tomorrow":
+        return (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
 
 
 def extract_current_weather(data: dict) -> dict:
@@ -698,6 +1874,7 @@ def extract_forecast_metadata(data: dict) -> dict:
     }
 
 
+@traced("get_user_data")
 async def get_user_data(data: dict):
     """Extracting data from message or callback and logging it."""
     telegram_id = data.from_user.id
@@ -715,69 +1892,122 @@ async def get_user_data(data: dict):
     return telegram_id, username
 
 
-def init_checks():
-    logger.debug("Starting initial checks.")
+# Modules with heavy imports, which are loaded on the first use. They are imported in background
+# after the start, so the first requests don't wait for them.
+LAZY_MODULES = ("api", "imaging", "profiling")
+
+
+def check_assets_step():
+    logger.debug(f"Defined path to the font as [{g.ARIMO_BOLD}].")
+
+    if not os.path.exists(g.ARIMO_BOLD):
+        logger.error("File with font is missing. Will raise an error.")
+
+        raise FileNotFoundError("File with font is missing.")
+
+    manifest = load_manifest()
+
+    if manifest:
+        check_assets(manifest)
+    else:
+        logger.warning(
+            f"Assets manifest [{g.ASSETS_MANIFEST}] is missing, checking the icons list."
+        )
+
+        check_icons()
+
+
+def check_database_step():
+    # Migrating first, since the queries of the models select the new columns.
+    migrate()
+
+    test = Database(0)
 
-    logger.debug(f"Loaded icons list with [{len(g.ICONS)}] icons.")
+    if not test.exists_in_database():
+        logger.debug("Successfully checked connection to the database.")
+
+    test.disconnect()
 
-    icons_day = sorted(os.listdir(os.path.join(g.ICONS_DIR, "day")))
-    icons_night = sorted(os.listdir(os.path.join(g.ICONS_DIR, "night")))
+
+def setup_coordinator_step():
+    coordinator.setup()
 
     logger.debug(
-        f"Readed [{len(icons_day)}] day icons and [{len(icons_night)}] night icons."
+        f"Coordination mode is set to [{g.COORDINATION}] for replica [{g.REPLICA_ID}]."
     )
 
-    if icons_day == icons_night == g.ICONS:
-        logger.debug("All icons compared to the list are present.")
-    else:
-        day_difference = set(g.ICONS) - set(icons_day)
-        night_difference = set(g.ICONS) - set(icons_night)
 
-        if not day_difference:
-            day_difference = "None"
+def init_steps() -> list[Callable]:
+    """Returns the independent startup checks: the assets against the manifest, the connection
+    to the database with migrations, restoring the caches from the snapshot and the setup of
+    the coordination tables."""
+    steps = [check_assets_step, check_database_step, load_snapshot]
+    if coordinator:
+        steps.append(setup_coordinator_step)
 
-        if not night_difference:
-            night_difference = "None"
+    return steps
 
-        logger.error(
-            f"Missing icons: [{day_difference}] in day icons and [{night_difference}] in night icons. "
-            f"Will raise an error."
-        )
 
-        raise FileNotFoundError(
-            f"Missing icons: [{day_difference}] in day icons and [{night_difference}] in night icons."
-        )
+def init_checks():
+    """Runs the startup checks from [init_steps] concurrently."""
+    logger.debug("Starting initial checks.")
+
+    started = perf_counter()
 
     logger.debug(f"Readed absolute path as [{g.ABSOLUTE_PATH}].")
+    logger.debug(f"The log file path is set to [{g.LOG_FILE}].")
 
-    logger.debug(f"The log directory path is set to [{g.LOG_DIR}].")
-    logger.debug(f"The tmp directory path is set to [{g.TMP_DIR}].")
+    steps = init_steps()
 
-    logger.debug(f"The log file path is set to [{g.LOG_FILE}].")
+    with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+        futures = [executor.submit(step) for step in steps]
 
-    logger.debug(f"Loaded JSON file with [{len(g.CONDITIONS)}] conditions.")
-    logger.debug(f"Loaded JSON file with [{len(g.CONDITIONS_TYPES)}] condition types.")
+    # Raising the first error in the order of the steps.
+    for future in futures:
+        future.result()
 
-    logger.debug(f"Defined path to the font as [{g.ARIMO_BOLD}].")
+    logger.debug(
+        f"Initial checks successfully completed in [{perf_counter() - started:.3f}] seconds."
+    )
 
-    if os.path.exists(g.ARIMO_BOLD):
-        logger.debug(f"File with the font exists: [{os.path.exists(g.ARIMO_BOLD)}].")
-    else:
-        logger.error("File with font is missing. Will raise an error.")
 
-        raise FileNotFoundError("File with font is missing.")
+def warm_up():
+    """Imports the modules with heavy dependencies and verifies the hashes of the assets."""
+    started = perf_counter()
 
-    test = Database(0)
+    for module in LAZY_MODULES:
+        importlib.import_module(module)
 
-    if not test.exists_in_database():
-        logger.debug("Successfully checked connection to the database.")
+    manifest = load_manifest()
+    if manifest:
+        verify_hashes(manifest)
 
-    test.disconnect()
+    logger.debug(f"Warm up completed in [{perf_counter() - started:.3f}] seconds.")
+
+
+async def on_startup(dp: Dispatcher):
+    """Starts the event loop monitor and the warm up in background, in the polling mode also
+    the metrics server, in the webhook mode the metrics are served by the webhook server.
+    """
+    check_crons()
+    monitor.start()
+    dp["warm_up"] = asyncio.create_task(asyncio.to_thread(warm_up))
+
+    if g.MODE != "webhook":
+        await start_metrics_server()
 
-    logger.debug("Initial checks successfully completed.")
+
+async def on_shutdown(dp: Dispatcher):
+    """Saves the persistent caches to the snapshot, so the bot starts warm after restart."""
+    entries = collect()
+    await asyncio.to_thread(save_snapshot, entries)
 
 
 if __name__ == "__main__":
     init_checks()
-    logger.info("Bot starting.")
-    executor.start_polling(dp)
+    logger.info(f"Bot starting in [{g.MODE}] mode.")
+
+    if g.MODE == "webhook":
+        start_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
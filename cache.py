@@ -0,0 +1,354 @@
+import sys
+
+from collections import OrderedDict
+from time import monotonic, time
+from typing import Any, Hashable
+
+import globals as g
+
+from logger import Logger
+from metrics import Counter, Gauge
+
+logger = Logger(__name__)
+
+caches = []
+
+
+def sizeof(value: Any) -> int:
+    """Returns the approximate size of the value in bytes with the contained objects. The
+    shared objects are counted once, the objects without [__dict__] are counted shallowly.
+    """
+    size = 0
+    seen = set()
+    stack = [value]
+
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+
+        size += sys.getsizeof(item)
+
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, "__dict__"):
+            stack.append(item.__dict__)
+
+    return size
+
+
+class MemoryBudget:
+    """Accountant of the memory used by the caches, which keeps their total size within the
+    budget. The sizes of other in-process stores, which can't be evicted, are measured
+    periodically and reduce the budget left for the caches.
+
+    When the budget is exceeded, the entries are evicted across all caches by their priority
+    as in GreedyDual-Size: the entry gets the priority of the current clock plus its cost per
+    byte when it's stored or hit, and the clock advances to the priority of every evicted entry.
+    So large entries, which are cheap to recreate, are evicted first and the entries, which are
+    not used for a long time, are evicted eventually regardless of their cost. Only the least
+    recently used entries of the caches are compared, so the eviction takes time proportional
+    to the number of caches.
+
+    Args:
+        limit (int): budget in bytes.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.clock = 0.0
+        self.external = {}
+
+    def priority(self, cost: float, size: int) -> float:
+        return self.clock + cost / max(size, 1)
+
+    @property
+    def used(self) -> int:
+        return sum(cache.bytes for cache in caches) + sum(self.external.values())
+
+    def measure(self, name: str, size: int):
+        """Records the size of the store, which is not a cache, and evicts the entries of the
+        caches if the budget is exceeded.
+
+        Args:
+            name (str): name of the store.
+            size (int): size of the store in bytes.
+        """
+        self.external[name] = size
+        self.enforce()
+
+    def enforce(self):
+        """Evicts the entries with the lowest priority until the budget is met."""
+        used = self.used
+
+        while used > self.limit:
+            candidates = [
+                cache for cache in caches if cache.evictable and cache.entries
+            ]
+            if not candidates:
+                stores = {
+                    **self.external,
+                    **{c.name: c.bytes for c in caches if not c.evictable},
+                }
+                logger.warning(
+                    f"Memory budget [{self.limit}] bytes is exceeded by the stores, "
+                    f"which can't be evicted: [{stores}]."
+                )
+                return
+
+            victim = min(candidates, key=Cache.head_priority)
+            self.clock = max(self.clock, victim.head_priority())
+            used -= victim.evict("budget")
+
+
+budget = MemoryBudget(g.CACHE_MEMORY_MB * 1024**2)
+
+
+class Cache:
+    """Bounded in-memory cache with per-entry expiry. When the cache is full, the least
+    recently used entry is evicted, the memory of all caches is limited by the [budget].
+
+    Args:
+        name (str): name of the cache, used in logs.
+        ttl (int): time to live of the entries in seconds.
+        max_size (int): maximum number of entries in the cache.
+        persistent (bool, optional): whether the cache is saved to the snapshot on shutdown.
+        cost (float, optional): relative cost of recreating the entry, the entries of the
+            caches with the higher cost are kept longer under the memory budget.
+        evictable (bool, optional): whether the entries can be evicted by the memory budget,
+            otherwise they're only counted in it and expire by their ttl or the max_size.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: int,
+        max_size: int,
+        persistent: bool = False,
+        cost: float = 1.0,
+        evictable: bool = True,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.persistent = persistent
+        self.cost = cost
+        self.evictable = evictable
+
+        # Entries by keys: value, expiry, size in bytes and priority under the budget.
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"size": 0, "budget": 0, "expired": 0}
+
+        caches.append(self)
+
+    def get(self, key: Hashable) -> Any | None:
+        """Returns the value for the key if it exists in the cache and is not expired.
+
+        Args:
+            key (Hashable): key of the entry.
+
+        Returns:
+            Any | None: cached value if it exists and is not expired, None otherwise.
+        """
+        entry = self.entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires, size, _ = entry
+        if expires < monotonic():
+            self.remove(key)
+            self.evictions["expired"] += 1
+            self.misses += 1
+            return None
+
+        self.entries[key] = (value, expires, size, budget.priority(self.cost, size))
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: int = None):
+        """Stores the value in the cache and evicts the least recently used entries
+        if the cache is full.
+
+        Args:
+            key (Hashable): key of the entry.
+            value (Any): value to store.
+            ttl (int, optional): time to live of the entry in seconds, defaults to the ttl of the cache.
+        """
+        self.store(key, value, monotonic() + (ttl or self.ttl))
+        budget.enforce()
+
+    def store(self, key: Hashable, value: Any, expires: float):
+        size = sizeof(key) + sizeof(value)
+
+        if key in self.entries:
+            self.remove(key)
+
+        if size > budget.limit:
+            logger.warning(
+                f"Entry [{key}] of [{size}] bytes exceeds the memory budget, "
+                f"it's not stored in cache [{self.name}]."
+            )
+            return
+
+        self.entries[key] = (value, expires, size, budget.priority(self.cost, size))
+        self.bytes += size
+
+        while len(self.entries) > self.max_size:
+            self.evict("size")
+
+    def remove(self, key: Hashable):
+        _, _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def head_priority(self) -> float:
+        """Returns the priority of the least recently used entry, the expired entry has the
+        lowest priority, so it's evicted first."""
+        _, expires, _, priority = next(iter(self.entries.values()))
+        return float("-inf") if expires < monotonic() else priority
+
+    def evict(self, reason: str) -> int:
+        """Evicts the least recently used entry.
+
+        Args:
+            reason (str): reason of the eviction: "size" or "budget".
+
+        Returns:
+            int: size of the evicted entry in bytes.
+        """
+        key, (_, expires, size, _) = self.entries.popitem(last=False)
+        self.bytes -= size
+
+        if expires < monotonic():
+            reason = "expired"
+        self.evictions[reason] += 1
+
+        logger.debug("Evicted entry [%s] from cache [%s].", key, self.name)
+        return size
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        self.entries.clear()
+        self.bytes = 0
+
+    def snapshot(self) -> list[tuple[Hashable, Any, float]]:
+        """Returns the entries, which are not expired, from the least to the most recently used
+        with their expiry as the wall clock time, so they can be restored after restart.
+        """
+        now, wall = monotonic(), time()
+        return [
+            (key, value, wall + expires - now)
+            for key, (value, expires, _, _) in list(self.entries.items())
+            if expires > now
+        ]
+
+    def restore(self, entries: list[tuple[Hashable, Any, float]]) -> int:
+        """Stores the entries from the snapshot, the expired entries are discarded.
+
+        Returns:
+            int: number of restored entries.
+        """
+        now, wall = monotonic(), time()
+
+        restored = 0
+        for key, value, expires in entries:
+            if expires > wall:
+                self.store(key, value, now + expires - wall)
+                restored += 1
+
+        budget.enforce()
+
+        return restored
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and entry[1] >= monotonic()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+CACHE_REQUESTS = Counter(
+    "bot_cache_requests_total",
+    "Number of cache lookups by result: hit or miss.",
+    ("cache", "result"),
+    collect=lambda: [
+        item
+        for cache in caches
+        for item in (
+            ((cache.name, "hit"), cache.hits),
+            ((cache.name, "miss"), cache.misses),
+        )
+    ],
+)
+CACHE_HIT_RATIO = Gauge(
+    "bot_cache_hit_ratio",
+    "Ratio of the cache hits to all lookups.",
+    ("cache",),
+    collect=lambda: [
+        ((cache.name,), cache.hits / (cache.hits + cache.misses))
+        for cache in caches
+        if cache.hits + cache.misses
+    ],
+)
+CACHE_ENTRIES = Gauge(
+    "bot_cache_entries",
+    "Number of entries in the cache.",
+    ("cache",),
+    collect=lambda: [((cache.name,), len(cache)) for cache in caches],
+)
+CACHE_EVICTIONS = Counter(
+    "bot_cache_evictions_total",
+    "Number of evicted entries by reason: size, budget or expired.",
+    ("cache", "reason"),
+    collect=lambda: [
+        ((cache.name, reason), count)
+        for cache in caches
+        for reason, count in cache.evictions.items()
+    ],
+)
+MEMORY_USED = Gauge(
+    "bot_memory_used_bytes",
+    "Approximate memory used by the caches and other in-process stores.",
+    ("store",),
+    collect=lambda: [
+        *[((cache.name,), cache.bytes) for cache in caches],
+        *[((name,), size) for name, size in budget.external.items()],
+    ],
+)
+MEMORY_BUDGET = Gauge(
+    "bot_memory_budget_bytes",
+    "Memory budget of the caches and other in-process stores.",
+    collect=lambda: [((), budget.limit)],
+)
+
+
+# The costs are relative: the weather is requested from WeatherAPI, the image is rendered from
+# the weather, the file_id is returned by Telegram after the upload of the image. Search results
+# can't be recreated, the user has to search again, if they are evicted.
+current_weather_cache = Cache(
+    "current_weather", g.CURRENT_WEATHER_TTL, g.CACHE_SIZE, persistent=True
+)
+forecast_cache = Cache("forecast", g.FORECAST_TTL, g.CACHE_SIZE, persistent=True)
+image_cache = Cache("image", g.FORECAST_TTL, g.CACHE_SIZE, persistent=True, cost=2)
+# Telegram file_ids of the uploaded images by the digest of the image, so the same image is
+# uploaded once and then sent by its file_id.
+file_id_cache = Cache("file_id", g.FORECAST_TTL, g.CACHE_SIZE, persistent=True, cost=4)
+search_results_cache = Cache(
+    "search_results",
+    g.SEARCH_RESULTS_TTL,
+    g.SEARCH_RESULTS_SIZE,
+    persistent=True,
+    cost=10,
+)
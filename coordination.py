@@ -0,0 +1,222 @@
+from datetime import timedelta
+from threading import Lock
+
+from sqlalchemy import Column, Text, Integer, Boolean, DateTime
+from sqlalchemy import delete, func, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+
+import globals as g
+
+from database import Base, create_db_engine
+from logger import Logger
+
+logger = Logger(__name__)
+
+# Key of the advisory lock, which is held by the leader replica.
+LEADER_LOCK_KEY = 0x1BA7_4E2B
+
+# Work units older than this are removed when a new run is created.
+RUN_RETENTION = timedelta(days=1)
+
+
+class WorkUnit(Base):
+    __tablename__ = "work_units"
+
+    run_id = Column(Text, primary_key=True, nullable=False)
+    shard = Column(Integer, primary_key=True, nullable=False)
+    owner = Column(Text)
+    claimed_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    done = Column(Boolean, default=False, nullable=False)
+
+
+class Coordinator:
+    """Coordinates scheduled work between several replicas of the bot. The leader is elected
+    with a session-level Postgres advisory lock, which is held on a dedicated connection and
+    released automatically by Postgres if the replica dies. Notification runs are split into
+    shards by telegram_id, which are claimed by the replicas as work units with a short lease.
+    The lease is renewed while the shard is processed, so the shards of a replica, which died,
+    are claimed by the other replicas after [g.COORDINATION_LEASE] seconds.
+    """
+
+    def __init__(self):
+        self.engine = create_db_engine()
+        self.lock_connection = None
+        # The jobs check the leadership from the worker threads, sometimes at the same time,
+        # while the connection holding the lock can't be used by several threads.
+        self.leader_lock = Lock()
+
+    def setup(self):
+        """Creates the table for work units if it doesn't exist."""
+        Base.metadata.create_all(self.engine, tables=[WorkUnit.__table__])
+
+        logger.debug(f"Coordinator is ready for replica [{g.REPLICA_ID}].")
+
+    def is_leader(self) -> bool:
+        """Checks if this replica holds the leader lock and tries to acquire it otherwise.
+
+        Returns:
+            bool: True if this replica is the leader, False otherwise.
+        """
+        with self.leader_lock:
+            return self.check_leader()
+
+    def check_leader(self) -> bool:
+        if self.lock_connection is not None:
+            try:
+                self.lock_connection.execute(text("SELECT 1"))
+                self.lock_connection.commit()
+                return True
+            except Exception as error:
+                logger.warning(
+                    f"Lost connection holding the leader lock for replica [{g.REPLICA_ID}]: [{error}]."
+                )
+                self.lock_connection.invalidate()
+                self.lock_connection = None
+
+        connection = self.engine.connect()
+        acquired = connection.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": LEADER_LOCK_KEY}
+        ).scalar()
+        connection.commit()
+
+        if not acquired:
+            connection.close()
+            logger.debug(f"Replica [{g.REPLICA_ID}] is not the leader.")
+            return False
+
+        self.lock_connection = connection
+        logger.info(f"Replica [{g.REPLICA_ID}] was elected as the leader.")
+
+        return True
+
+    def create_units(self, run_id: str):
+        """Creates work units for all shards of the run if they don't exist yet and removes
+        work units of the old runs.
+
+        Args:
+            run_id (str): identifier of the run, e.g. "today_2023-03-21".
+        """
+        with self.engine.begin() as connection:
+            connection.execute(
+                insert(WorkUnit)
+                .values(
+                    [
+                        {"run_id": run_id, "shard": shard}
+                        for shard in range(g.COORDINATION_SHARDS)
+                    ]
+                )
+                .on_conflict_do_nothing()
+            )
+            connection.execute(
+                delete(WorkUnit).where(WorkUnit.created_at < func.now() - RUN_RETENTION)
+            )
+
+        logger.debug(
+            f"Created [{g.COORDINATION_SHARDS}] work units for run [{run_id}]."
+        )
+
+    def claim_unit(
+        self, run_id: str, preferred: list[int] = (), excluded: list[int] = ()
+    ) -> int | None:
+        """Claims one unfinished work unit of the run, which is not claimed by any replica,
+        whose lease has expired or which was claimed by this replica before a restart.
+        Concurrent claims skip locked rows instead of waiting.
+
+        Args:
+            run_id (str): identifier of the run.
+            preferred (list[int], optional): shards, which are claimed first if available.
+            excluded (list[int], optional): shards, which are not claimed.
+
+        Returns:
+            int | None: number of the claimed shard, None if there are no units available.
+        """
+        available = (
+            select(WorkUnit.shard)
+            .where(
+                WorkUnit.run_id == run_id,
+                WorkUnit.done == False,
+                WorkUnit.shard.not_in(excluded),
+                or_(
+                    WorkUnit.owner == None,
+                    WorkUnit.owner == g.REPLICA_ID,
+                    WorkUnit.claimed_at
+                    < func.now() - timedelta(seconds=g.COORDINATION_LEASE),
+                ),
+            )
+            .order_by(WorkUnit.shard.in_(preferred).desc(), WorkUnit.shard)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+
+        with self.engine.begin() as connection:
+            shard = connection.execute(
+                update(WorkUnit)
+                .where(WorkUnit.run_id == run_id, WorkUnit.shard == available)
+                .values(owner=g.REPLICA_ID, claimed_at=func.now())
+                .returning(WorkUnit.shard)
+            ).scalar()
+
+        if shard is not None:
+            logger.debug(
+                f"Replica [{g.REPLICA_ID}] claimed shard [{shard}] of run [{run_id}]."
+            )
+
+        return shard
+
+    def renew_unit(self, run_id: str, shard: int):
+        """Extends the lease of the work unit claimed by this replica.
+
+        Args:
+            run_id (str): identifier of the run.
+            shard (int): number of the shard.
+        """
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(WorkUnit)
+                .where(
+                    WorkUnit.run_id == run_id,
+                    WorkUnit.shard == shard,
+                    WorkUnit.owner == g.REPLICA_ID,
+                )
+                .values(claimed_at=func.now())
+            )
+
+    def pending_units(self, run_id: str) -> list[int]:
+        """Returns the unfinished shards of the run, including the claimed ones.
+
+        Args:
+            run_id (str): identifier of the run.
+
+        Returns:
+            list[int]: numbers of the shards.
+        """
+        with self.engine.connect() as connection:
+            return (
+                connection.execute(
+                    select(WorkUnit.shard).where(
+                        WorkUnit.run_id == run_id, WorkUnit.done == False
+                    )
+                )
+                .scalars()
+                .all()
+            )
+
+    def complete_unit(self, run_id: str, shard: int):
+        """Marks the work unit as done.
+
+        Args:
+            run_id (str): identifier of the run.
+            shard (int): number of the shard.
+        """
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(WorkUnit)
+                .where(WorkUnit.run_id == run_id, WorkUnit.shard == shard)
+                .values(done=True)
+            )
+
+        logger.debug(
+            f"Replica [{g.REPLICA_ID}] completed shard [{shard}] of run [{run_id}]."
+        )
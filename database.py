@@ -1,53 +1,280 @@
+from itertools import count
+from threading import Lock
+from time import perf_counter
+
 from decouple import config
-from sqlalchemy import create_engine, Column, Text, BigInteger, Boolean
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event, inspect, Column, Text, BigInteger, Boolean
+from sqlalchemy import Float, ForeignKey, Integer, make_url, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
 
+from cache import Cache
 from logger import Logger
+from metrics import STAGE_SECONDS
+from tracing import span, traced
 
 logger = Logger(__name__)
 Base = declarative_base()
 
 
+class Location(Base):
+    """Canonical location from the WeatherAPI search results, which is shared by all users
+    who selected it, so the weather is fetched and cached once for the location."""
+
+    __tablename__ = "locations"
+
+    id = Column(Integer, primary_key=True)
+    # ID of the location in WeatherAPI, it's missing for the locations of the users, which were
+    # saved by name before the locations table was introduced.
+    weather_id = Column(BigInteger, unique=True)
+    name = Column(Text, nullable=False)
+    region = Column(Text)
+    country = Column(Text)
+    lat = Column(Float)
+    lon = Column(Float)
+    tz_id = Column(Text)
+
+    @property
+    def query(self) -> str:
+        """Returns the location in WeatherAPI format: coordinates if they're known or name."""
+        if self.lat is None or self.lon is None:
+            return self.name
+        return f"{self.lat},{self.lon}"
+
+    @property
+    def label(self) -> str:
+        """Returns the name of the location with the region and country."""
+        return ", ".join(
+            part for part in (self.name, self.region, self.country) if part
+        )
+
+
 class User(Base):
     __tablename__ = "users"
 
     telegram_id = Column(BigInteger, primary_key=True, nullable=False)
     username = Column(Text)
+    location_id = Column(Integer, ForeignKey("locations.id"))
+    # Location by name and its coordinates, which were saved before the locations table was
+    # introduced, they're only read by the migration.
     location = Column(Text)
+    coordinates = Column(Text)
     notify_today = Column(Boolean, default=False)
     notify_tomorrow = Column(Boolean, default=False)
+    notify_alerts = Column(Boolean, default=False)
+    # Output profile of the images, the deployment profile is used if it's not set.
+    image_profile = Column(Text)
 
 
-class Database:
-    """A class to create connection sessions to the database for user with specific telegram_id.
+def create_db_engine(replica: str = None):
+    """Creates an engine for the database from the environment configuration. The database
+    can be also set with [DATABASE_URL], e.g. the local SQLite database for the load tests.
 
     Args:
-        telegram_id (int): telegram_id to connect to the database.
+        replica (str, optional): URL or host of the read replica, the host is connected with
+            the credentials of the primary database.
+
+    Raises:
+        ValueError: if the replica is set by the host and [DATABASE_URL] has no host to
+            replace, e.g. SQLite.
     """
+    url = (
+        replica if replica and "://" in replica else config("DATABASE_URL", default="")
+    )
+
+    if url and replica and "://" not in replica:
+        # The host of the replica replaces the host of the primary in the URL.
+        url = make_url(url)
+        if not url.host:
+            raise ValueError(
+                f"Replica [{replica}] is set by the host, but the database URL "
+                f"[{url.render_as_string()}] has no host to replace."
+            )
 
-    def __init__(self, telegram_id: int):
-        self.telegram_id = telegram_id
+        host, _, port = replica.partition(":")
+        url = url.set(host=host, port=int(port) if port else url.port)
+
+    if url:
+        engine = create_engine(url)
 
+        if replica:
+            logger.info(f"Replica engine uses [{engine.url.render_as_string()}].")
+    else:
         connection_config = {
             "user": config("DBUSER"),
             "password": config("PASSWORD"),
-            "host": config("HOST"),
+            "host": replica or config("HOST"),
             "port": config("PORT"),
             "database": config("DATABASE"),
             "sslmode": "require",
         }
 
-        self.engine = create_engine("postgresql://", connect_args=connection_config)
+        engine = create_engine("postgresql://", connect_args=connection_config)
+
+        if replica:
+            logger.info(f"Replica engine uses host [{replica}].")
+
+    stage = "db_replica" if replica else "db"
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        context.started = perf_counter()
+        context.span = span("db.query", statement=statement.split(None, 1)[0])
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        STAGE_SECONDS.observe(perf_counter() - context.started, stage=stage)
+        context.span.finish()
+
+    return engine
+
+
+# Engines are shared by all sessions, so the connections are reused from their pools instead of
+# being opened for every request.
+engines = {}
+engines_lock = Lock()
+replica_counter = count()
+
+# Users who changed their data recently, their queries are sent to the primary database until
+# the replicas catch up with the changes. The marks are kept in the memory of the process, so
+# they don't cover the requests of the user handled by other replicas of the bot. They're not
+# evicted by the memory budget, since a lost mark sends the next read to a lagging replica.
+recent_writes = Cache(
+    "recent_writes",
+    config("READ_YOUR_WRITES_SECONDS", default=10, cast=int),
+    config("READ_YOUR_WRITES_SIZE", default=10000, cast=int),
+    evictable=False,
+)
+
+
+def primary_engine():
+    """Returns the shared engine of the primary database."""
+    with engines_lock:
+        if "primary" not in engines:
+            engines["primary"] = create_db_engine()
+        return engines["primary"]
+
+
+def replica_engine():
+    """Returns the shared engine of the next replica from [DATABASE_REPLICAS] in round-robin
+    order, None if the replicas are not configured."""
+    with engines_lock:
+        if "replicas" not in engines:
+            replicas = config("DATABASE_REPLICAS", default="")
+            engines["replicas"] = [
+                create_db_engine(replica.strip())
+                for replica in replicas.split(",")
+                if replica.strip()
+            ]
+        replicas = engines["replicas"]
+
+    if not replicas:
+        return None
+
+    return replicas[next(replica_counter) % len(replicas)]
+
+
+def migrate():
+    """Adds tables and columns, which were introduced after the users table was created."""
+    with primary_engine().begin() as connection:
+        Base.metadata.create_all(connection, tables=[Location.__table__])
+
+        # Checking the columns instead of IF NOT EXISTS, which is not supported by SQLite.
+        columns = {
+            column["name"] for column in inspect(connection).get_columns("users")
+        }
+
+        if "coordinates" not in columns:
+            connection.execute(text("ALTER TABLE users ADD COLUMN coordinates TEXT"))
+
+        if "location_id" not in columns:
+            connection.execute(
+                text(
+                    "ALTER TABLE users ADD COLUMN location_id INTEGER "
+                    "REFERENCES locations (id)"
+                )
+            )
+
+        if "notify_alerts" not in columns:
+            connection.execute(
+                text("ALTER TABLE users ADD COLUMN notify_alerts BOOLEAN DEFAULT FALSE")
+            )
+
+        if "image_profile" not in columns:
+            connection.execute(text("ALTER TABLE users ADD COLUMN image_profile TEXT"))
+
+        migrate_locations(connection)
+
+    logger.debug("Database migrations applied.")
+
+
+def migrate_locations(connection):
+    """Moves the locations of the users, which were saved by name, to the locations table.
+    The users with the same name and coordinates share the location, the WeatherAPI ID is
+    unknown for them until they select the location again.
+    """
+    with Session(bind=connection) as session:
+        legacy = (
+            session.query(User.location, User.coordinates)
+            .filter(User.location_id == None, User.location != None)
+            .distinct()
+            .all()
+        )
+
+        for name, coordinates in legacy:
+            lat, lon = None, None
+            if coordinates:
+                lat, lon = map(float, coordinates.split(","))
+
+            location = Location(name=name, lat=lat, lon=lon)
+            session.add(location)
+            session.flush()
+
+            session.query(User).filter(
+                User.location_id == None,
+                User.location == name,
+                (
+                    User.coordinates == coordinates
+                    if coordinates
+                    else User.coordinates == None
+                ),
+            ).update({User.location_id: location.id}, synchronize_session=False)
+
+        session.commit()
+
+    if legacy:
+        logger.info(f"Moved [{len(legacy)}] locations of users to the locations table.")
+
+
+class Database:
+    """A class to create connection sessions to the database for user with specific telegram_id.
+    The changes are written to the primary database, the read queries are sent to the replicas
+    if they're configured, except for the users who changed their data recently.
+
+    Args:
+        telegram_id (int): telegram_id to connect to the database.
+    """
+
+    def __init__(self, telegram_id: int):
+        self.telegram_id = telegram_id
+
+        self.engine = primary_engine()
+        self.replica = replica_engine()
+        self.read_session = None
 
         self.connect()
 
+    @traced("db.connect")
     def connect(self):
         """Creates a connection session to the database."""
         try:
             Connection = sessionmaker(bind=self.engine)
             self.session = Connection()
+            if self.replica is not None:
+                self.read_session = sessionmaker(bind=self.replica)()
             logger.info(
-                f"Connected to database [{config('DATABASE')}] with telegram ID [{self.telegram_id}]."
+                f"Connected to database [{self.engine.url.database or config('DATABASE')}] "
+                f"with telegram ID [{self.telegram_id}]."
             )
         except Exception as error:
             logger.error(
@@ -57,10 +284,27 @@ class Database:
     def disconnect(self):
         """Closes the connection session to the database."""
         self.session.close()
+        if self.read_session is not None:
+            self.read_session.close()
         logger.debug(
             f"Disconnected from database with telegram ID [{self.telegram_id}]."
         )
 
+    @property
+    def reader(self) -> Session:
+        """Returns the session for the read queries: the replica session, unless the user
+        changed their data recently, so the user reads their own writes from the primary.
+        """
+        if self.read_session is None or self.telegram_id in recent_writes:
+            return self.session
+        return self.read_session
+
+    def commit(self):
+        """Commits the changes to the primary database and routes the read queries of the user
+        to it until the replicas catch up."""
+        self.session.commit()
+        recent_writes.set(self.telegram_id, True)
+
     def exists_in_database(self) -> bool:
         """Checks if user with telegram_id exists in the database.
 
@@ -68,9 +312,7 @@ class Database:
             bool: True if user exists in the database, False otherwise.
         """
         exists = (
-            self.session.query(User)
-            .filter(User.telegram_id == self.telegram_id)
-            .count()
+            self.reader.query(User).filter(User.telegram_id == self.telegram_id).count()
             > 0
         )
 
@@ -80,67 +322,168 @@ class Database:
 
         return exists
 
-    def update_user(self, username: str, location: str):
+    def save_location(self, result: dict) -> int:
+        """Adds the location from the WeatherAPI search result to the database if it doesn't
+        exist, otherwise updates it, the locations are identified by their WeatherAPI ID.
+
+        Args:
+            result (dict): search result of WeatherAPI.
+
+        Returns:
+            int: ID of the location in the database.
+        """
+        fields = {
+            "name": result["name"],
+            "region": result.get("region") or None,
+            "country": result.get("country") or None,
+            "lat": result.get("lat"),
+            "lon": result.get("lon"),
+        }
+        if result.get("tz_id"):
+            fields["tz_id"] = result["tz_id"]
+
+        query = self.session.query(Location).filter(Location.weather_id == result["id"])
+        location = query.first()
+
+        if location is None:
+            try:
+                location = Location(weather_id=result["id"], **fields)
+                self.session.add(location)
+                self.session.commit()
+            except IntegrityError:
+                # The location was added by another user at the same time.
+                self.session.rollback()
+                location = query.first()
+
+        for field, value in fields.items():
+            setattr(location, field, value)
+        self.commit()
+
+        logger.debug(
+            f"Saved location [{location.label}] with ID [{location.id}] and WeatherAPI ID "
+            f"[{location.weather_id}]."
+        )
+
+        return location.id
+
+    def set_location_timezone(self, location_id: int, tz_id: str):
+        """Sets the timezone of the location, which is not returned by the search of WeatherAPI,
+        but is known from the weather responses.
+
+        Args:
+            location_id (int): ID of the location in the database.
+            tz_id (str): timezone of the location, e.g. "Europe/London".
+        """
+        self.session.query(Location).filter(Location.id == location_id).update(
+            {Location.tz_id: tz_id}
+        )
+        self.commit()
+
+        logger.debug(f"Set timezone [{tz_id}] of location with ID [{location_id}].")
+
+    def update_user(self, username: str, location_id: int):
         """Adds user to the database if it doesn't exist, otherwise updates the username and location
         for existing user in the database.
 
         Args:
             username (str): telegram username
-            location (str): string-like location of the user in WeatherAPI format
+            location_id (int): ID of the location of the user in the database.
         """
-        if not self.exists_in_database():
+        # Getting user from the primary database, since the replica can be behind.
+        user = (
+            self.session.query(User)
+            .filter(User.telegram_id == self.telegram_id)
+            .first()
+        )
+
+        if user is None:
             # Creating new user if it doesn't exist in the database.
             user = User(
-                telegram_id=self.telegram_id, username=username, location=location
+                telegram_id=self.telegram_id,
+                username=username,
+                location_id=location_id,
             )
 
             # Adding user to the database.
             self.session.add(user)
-            self.session.commit()
+            self.commit()
 
             logger.info(
                 f"User with telegram ID [{self.telegram_id}] added to the database."
             )
         else:
-            # Getting user from the database.
-            user = (
-                self.session.query(User)
-                .filter(User.telegram_id == self.telegram_id)
-                .first()
-            )
-
             logger.debug(
                 f"Updating username from [{user.username}] to [{username}] for "
                 f"user with telegram ID [{self.telegram_id}]."
             )
             logger.debug(
-                f"Updating location from [{user.location}] to [{location}] for "
+                f"Updating location from [{user.location_id}] to [{location_id}] for "
                 f"user with telegram ID [{self.telegram_id}]."
             )
 
             # Updating user data.
             user.username = username
-            user.location = location
-            self.session.commit()
+            user.location_id = location_id
+            self.commit()
 
             logger.debug(
                 f"Location and username updated for user with telegram ID [{self.telegram_id}]."
             )
 
-    def get_user_location(self) -> str | None:
+    def get_user_location(self) -> Location | None:
         """Returns the location of the user with telegram_id if it exists in the database.
 
         Returns:
-            str | None: location of the user in WeatherAPI format if it exists in the database, None otherwise.
+            Location | None: location of the user if it's set, None otherwise.
         """
-        if self.exists_in_database():
-            location = (
-                self.session.query(User)
-                .filter(User.telegram_id == self.telegram_id)
-                .first()
-                .location
-            )
-            return location
+        return (
+            self.reader.query(Location)
+            .join(User, User.location_id == Location.id)
+            .filter(User.telegram_id == self.telegram_id)
+            .first()
+        )
+
+    def get_user_settings(self) -> tuple[Location | None, str | None]:
+        """Returns the location and the image profile of the user with telegram_id in one query.
+
+        Returns:
+            tuple[Location | None, str | None]: location of the user and the name of the image
+                profile if they're set, None otherwise.
+        """
+        row = (
+            self.reader.query(Location, User.image_profile)
+            .select_from(User)
+            .outerjoin(Location, User.location_id == Location.id)
+            .filter(User.telegram_id == self.telegram_id)
+            .first()
+        )
+        return (row[0], row[1]) if row else (None, None)
+
+    def set_image_profile(self, profile: str) -> bool:
+        """Sets the output profile of the images for the user with telegram_id.
+
+        Args:
+            profile (str): name of the profile from [g.IMAGE_PROFILES].
+
+        Returns:
+            bool: True if the profile was set, False if the user doesn't exist in the database.
+        """
+        user = (
+            self.session.query(User)
+            .filter(User.telegram_id == self.telegram_id)
+            .first()
+        )
+        if user is None:
+            return False
+
+        user.image_profile = profile
+        self.commit()
+
+        logger.debug(
+            f"User with telegram ID [{self.telegram_id}] changed image profile to [{profile}]."
+        )
+
+        return True
 
     def get_all_usernames(self) -> list[str]:
         """Retrieves all usernames from the database, adds @ to the beginning of
@@ -149,7 +492,7 @@ class Database:
         Returns:
             list[str]: list of usernames with @ in front of each username.
         """
-        query = self.session.query(User.username).all()
+        query = self.reader.query(User.username).all()
         usernames = [f"@{username[0]}" for username in query]
 
         logger.debug(f"Get [{len(usernames)}] usernames from database.")
@@ -158,10 +501,10 @@ class Database:
 
     def change_notification_status(self, notification: str):
         """Changes the notification status for user with telegram_id to opposite of the current status.
-        Requires notification to be either "today" or "tomorrow".
+        Requires notification to be either "today", "tomorrow" or "alerts".
 
         Args:
-            notification (str): notification to change status for ("today" or "tomorrow")
+            notification (str): notification to change status for ("today", "tomorrow" or "alerts")
         """
         user = (
             self.session.query(User)
@@ -184,22 +527,28 @@ class Database:
                 f"notification status to [{user.notify_tomorrow}]."
             )
 
-        self.session.commit()
+        elif notification == "alerts":
+            user.notify_alerts = not user.notify_alerts
+
+            logger.debug(
+                f"User with telegram ID [{self.telegram_id}] changed {notification} "
+                f"notification status to [{user.notify_alerts}]."
+            )
+
+        self.commit()
 
     def notification_status(self, notification: str) -> bool:
         """Retrieves the status for specified notification for user in the database.
         Returns True if notification is enabled, False otherwise.
 
         Args:
-            notification (str): notification to retrieve status for ("today" or "tomorrow")
+            notification (str): notification to retrieve status for ("today", "tomorrow" or "alerts")
 
         Returns:
             bool: boolean value representing the status of the notification.
         """
         user = (
-            self.session.query(User)
-            .filter(User.telegram_id == self.telegram_id)
-            .first()
+            self.reader.query(User).filter(User.telegram_id == self.telegram_id).first()
         )
 
         logger.debug(
@@ -210,23 +559,93 @@ class Database:
             return user.notify_today
         elif notification == "tomorrow":
             return user.notify_tomorrow
+        elif notification == "alerts":
+            return user.notify_alerts
 
-    def get_notified_users(self, notification: str) -> list[User]:
-        """Retrieves all users with specified notification enabled.
+    def get_notified_users(
+        self, notification: str, shard: int = None, shards: int = None
+    ) -> list[User]:
+        """Retrieves all users with specified notification enabled. If shard and shards are
+        specified, retrieves only users whose telegram_id belongs to the shard.
 
         Args:
-            notification (str): notification to retrieve users for ("today" or "tomorrow")
+            notification (str): notification to retrieve users for ("today", "tomorrow" or "alerts")
+            shard (int, optional): number of the shard to retrieve users for.
+            shards (int, optional): total number of shards.
 
         Returns:
             list[User]: list of User objects with specified notification enabled.
         """
         if notification == "today":
-            users = self.session.query(User).filter(User.notify_today == True).all()
+            query = self.reader.query(User).filter(User.notify_today == True)
         elif notification == "tomorrow":
-            users = self.session.query(User).filter(User.notify_tomorrow == True).all()
+            query = self.reader.query(User).filter(User.notify_tomorrow == True)
+        elif notification == "alerts":
+            query = self.reader.query(User).filter(User.notify_alerts == True)
+
+        if shards:
+            query = query.filter(User.telegram_id % shards == shard)
+
+        users = query.all()
 
         logger.debug(
             f"Retrieved [{len(users)}] users with [{notification}] enabled notification status."
         )
 
         return users
+
+    def get_notified_locations(
+        self, notification: str, shard: int = None, shards: int = None
+    ) -> list[Location]:
+        """Retrieves distinct locations of all users with specified notification enabled.
+        If shard and shards are specified, retrieves only locations of users in the shard.
+
+        Args:
+            notification (str): notification to retrieve locations for ("today", "tomorrow" or "alerts")
+            shard (int, optional): number of the shard to retrieve locations for.
+            shards (int, optional): total number of shards.
+
+        Returns:
+            list[Location]: list of distinct locations.
+        """
+        query = self.reader.query(Location).join(User, User.location_id == Location.id)
+
+        if notification == "today":
+            query = query.filter(User.notify_today == True)
+        elif notification == "tomorrow":
+            query = query.filter(User.notify_tomorrow == True)
+        elif notification == "alerts":
+            query = query.filter(User.notify_alerts == True)
+
+        if shards:
+            query = query.filter(User.telegram_id % shards == shard)
+
+        locations = query.distinct().all()
+
+        logger.debug(
+            f"Retrieved [{len(locations)}] distinct locations with [{notification}] "
+            "enabled notification status."
+        )
+
+        return locations
+
+    def get_alerted_users(self, location_ids: list[int]) -> list[tuple[int, int]]:
+        """Retrieves users subscribed to the alerts, whose locations are in the list.
+
+        Args:
+            location_ids (list[int]): IDs of the locations with the alerts.
+
+        Returns:
+            list[tuple[int, int]]: list of telegram_id and location ID of the users.
+        """
+        users = (
+            self.reader.query(User.telegram_id, User.location_id)
+            .filter(User.notify_alerts == True, User.location_id.in_(location_ids))
+            .all()
+        )
+
+        logger.debug(
+            f"Retrieved [{len(users)}] users subscribed to alerts in [{len(location_ids)}] locations."
+        )
+
+        return users
@@ -1,7 +1,6 @@
 import os
 import json
-
-from datetime import datetime
+import socket
 
 from decouple import config
 
@@ -20,25 +19,181 @@ ICONS_DIR = os.path.join(MEDIA_DIR, "icons")
 FONTS_DIR = os.path.join(ABSOLUTE_PATH, MEDIA_DIR, "fonts")
 ARIMO_BOLD = os.path.join(FONTS_DIR, "Arimo-Bold.ttf")
 
-with open(os.path.join(MEDIA_DIR, "conditions.json"), "r", encoding="utf8") as f:
-    CONDITIONS = json.load(f)
-
-with open(
-    os.path.join(MEDIA_DIR, "conditions_types.json"),
-    "r",
-    encoding="utf8",
-) as f:
-    CONDITIONS_TYPES = json.load(f)
-
-with open(
-    os.path.join(MEDIA_DIR, "icons.json"),
-    "r",
-    encoding="utf8",
-) as f:
-    ICONS = json.load(f)
-
-LOG_FORMATTER = "%(name)s | %(asctime)s | %(levelname)s | %(message)s"
-LOG_FILE = os.path.join(LOG_DIR, f"{datetime.now().strftime('%Y-%m-%d')}_log.txt")
+ASSETS_MANIFEST = os.path.join(MEDIA_DIR, "manifest.json")
+
+# JSON assets are loaded on the first access to the setting, so they are not read on import.
+JSON_ASSETS = {
+    "CONDITIONS": "conditions.json",
+    "CONDITIONS_TYPES": "conditions_types.json",
+    "ICONS": "icons.json",
+}
+
+
+def __getattr__(name: str):
+    if name not in JSON_ASSETS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    with open(os.path.join(MEDIA_DIR, JSON_ASSETS[name]), "r", encoding="utf8") as f:
+        value = json.load(f)
+
+    globals()[name] = value
+    return value
+
+
+# Hours of the day when the notifications about today and tomorrow weather are sent.
+NOTIFY_TODAY_HOUR = 6
+NOTIFY_TOMORROW_HOUR = 17
+
+# Pre-warm stage which fetches forecasts and renders images before the notifications.
+PREWARM_MINUTES = int(config("PREWARM_MINUTES", default=10))
+PREWARM_BATCH_SIZE = int(config("PREWARM_BATCH_SIZE", default=5))
+PREWARM_BATCH_DELAY = float(config("PREWARM_BATCH_DELAY", default=1))
+
+# Time to live of the cached weather data and rendered images in seconds.
+CURRENT_WEATHER_TTL = int(config("CURRENT_WEATHER_TTL", default=600))
+FORECAST_TTL = int(config("FORECAST_TTL", default=3600))
+CACHE_SIZE = int(config("CACHE_SIZE", default=1000))
+# Memory budget of the caches in MiB, which includes the size of the FSM storage.
+CACHE_MEMORY_MB = int(config("CACHE_MEMORY_MB", default=256))
+# Size of the lat/lon grid cell in degrees, the weather of the locations in one cell is fetched
+# once for the center of the cell, 0 disables the grid. 0.05 degrees is about 5 km.
+WEATHER_GRID_DEGREES = float(config("WEATHER_GRID_DEGREES", default=0))
+# Search results are stored on the server and referenced by short tokens in the callback data.
+SEARCH_RESULTS_TTL = int(config("SEARCH_RESULTS_TTL", default=900))
+SEARCH_RESULTS_SIZE = int(config("SEARCH_RESULTS_SIZE", default=10000))
+
+# Output profiles of the rendered images: format, quality of the lossy formats, number of colors
+# of the palette PNG and scale of the resolution. The profile of the deployment is set with
+# [IMAGE_PROFILE], the users can choose another one.
+IMAGE_QUALITY = int(config("IMAGE_QUALITY", default=80))
+IMAGE_PROFILES = {
+    "png": {"label": "Original PNG", "format": "PNG", "extension": "png"},
+    "png8": {
+        "label": "PNG, 256 colors",
+        "format": "PNG",
+        "extension": "png",
+        "colors": 256,
+    },
+    "jpeg": {
+        "label": "JPEG",
+        "format": "JPEG",
+        "extension": "jpg",
+        "quality": IMAGE_QUALITY,
+    },
+    "webp": {
+        "label": "WebP",
+        "format": "WEBP",
+        "extension": "webp",
+        "quality": IMAGE_QUALITY,
+    },
+    "lite": {
+        "label": "Lite, half resolution",
+        "format": "JPEG",
+        "extension": "jpg",
+        "quality": IMAGE_QUALITY,
+        "scale": 0.5,
+    },
+}
+IMAGE_PROFILE = config("IMAGE_PROFILE", default="png")
+
+# Alerts about the weather changes: current weather of the subscribed locations is polled
+# every [ALERTS_MINUTES] minutes in batches and compared with the previous observation.
+ALERTS_MINUTES = int(config("ALERTS_MINUTES", default=15))
+ALERTS_BATCH_SIZE = int(config("ALERTS_BATCH_SIZE", default=10))
+ALERTS_BATCH_DELAY = float(config("ALERTS_BATCH_DELAY", default=1))
+# The drop of the temperature is measured from the highest one in the trailing window of
+# [ALERT_TEMPERATURE_WINDOW_HOURS] or since the previous alert about the drop.
+ALERT_TEMPERATURE_DROP = float(config("ALERT_TEMPERATURE_DROP", default=5))
+ALERT_TEMPERATURE_WINDOW_HOURS = float(
+    config("ALERT_TEMPERATURE_WINDOW_HOURS", default=3)
+)
+
+# Coordination of the scheduled work between several replicas of the bot.
+# Modes: "none" - single replica, "leader" - only the elected leader runs scheduled jobs,
+# "shard" - recipients are split into shards, which are claimed by the replicas.
+COORDINATION = config("COORDINATION", default="none")
+COORDINATION_SHARDS = int(config("COORDINATION_SHARDS", default=16))
+# Lease of the claimed shard in seconds, it's renewed while the shard is processed.
+COORDINATION_LEASE = int(config("COORDINATION_LEASE", default=60))
+# Number of the attempts of the replica to process the shard, which fails, the failed shard is
+# retried after its lease expires.
+COORDINATION_ATTEMPTS = 3
+# The ID must survive restarts, so the restarted replica resumes its claimed shards. The host
+# name is stable for containers, [REPLICA_ID] must be set if replicas share the host.
+REPLICA_ID = config("REPLICA_ID", default=socket.gethostname())
+
+# Time in seconds after which the location search state expires.
+LOCATION_SEARCH_TIMEOUT = int(config("LOCATION_SEARCH_TIMEOUT", default=300))
+
+# Outbound queue of the messages to Telegram.
+SENDER_WORKERS = int(config("SENDER_WORKERS", default=8))
+SENDER_GLOBAL_RATE = float(config("SENDER_GLOBAL_RATE", default=25))
+SENDER_CHAT_RATE = float(config("SENDER_CHAT_RATE", default=1))
+SENDER_CHAT_BURST = float(config("SENDER_CHAT_BURST", default=3))
+SENDER_MAX_RETRIES = int(config("SENDER_MAX_RETRIES", default=3))
+NOTIFY_CONCURRENCY = int(config("NOTIFY_CONCURRENCY", default=20))
+
+# Rate limit of the weather requests for each user: requests per second and burst size.
+WEATHER_RATE = float(config("WEATHER_RATE", default=0.2))
+WEATHER_BURST = float(config("WEATHER_BURST", default=3))
+
+# Sends the text summary of the weather before the image is drawn.
+PROGRESSIVE_DELIVERY = config("PROGRESSIVE_DELIVERY", default=True, cast=bool)
+
+# Endpoint with the metrics in the Prometheus text format, in the webhook mode it's served
+# by the webhook server, in the polling mode by a separate server on [METRICS_PORT].
+METRICS_HOST = config("METRICS_HOST", default="0.0.0.0")
+METRICS_PORT = int(config("METRICS_PORT", default=9100))
+METRICS_PATH = config("METRICS_PATH", default="/metrics")
+
+# Each update and notification job gets a trace ID, which is attached to the logs, the spans
+# of [TRACE_SAMPLE_RATE] part of the traces are written to [TRACE_FILE].
+TRACE_FILE = os.path.join(LOG_DIR, "traces.jsonl")
+TRACE_SAMPLE_RATE = float(config("TRACE_SAMPLE_RATE", default=0.1))
+
+# The lag of the event loop is measured every [LOOP_MONITOR_INTERVAL] seconds, when the loop
+# is blocked longer than [LOOP_STALL_THRESHOLD] seconds, the stack of the blocking code is logged.
+LOOP_MONITOR_INTERVAL = float(config("LOOP_MONITOR_INTERVAL", default=0.1))
+LOOP_STALL_THRESHOLD = float(config("LOOP_STALL_THRESHOLD", default=0.5))
+LOOP_STACK_DEPTH = 15
+
+# Maximum duration of the profiling session started from the admin menu in seconds and
+# number of the functions and allocation sites in the report.
+PROFILE_DURATION = int(config("PROFILE_DURATION", default=60))
+PROFILE_TOP = 40
+# Interval in seconds, at which the stacks of the worker threads are sampled during the session.
+PROFILE_SAMPLE_INTERVAL = float(config("PROFILE_SAMPLE_INTERVAL", default=0.005))
+
+# Persistent caches are saved to the snapshot every [CACHE_SNAPSHOT_MINUTES] minutes and on
+# shutdown, and restored on startup, so the restarted bot starts with warm caches.
+CACHE_SNAPSHOT_FILE = config(
+    "CACHE_SNAPSHOT_FILE", default=os.path.join(TMP_DIR, "cache_snapshot.sqlite3")
+)
+CACHE_SNAPSHOT_MINUTES = int(config("CACHE_SNAPSHOT_MINUTES", default=10))
+
+# Fetched weather is appended to the local history, which serves the repeated requests and the
+# comparison with yesterday. It's compacted daily, the days older than the retention are dropped.
+HISTORY_FILE = config("HISTORY_FILE", default=os.path.join(TMP_DIR, "history.sqlite3"))
+HISTORY_RETENTION_DAYS = int(config("HISTORY_RETENTION_DAYS", default=7))
+
+# Mode of receiving updates: "polling" or "webhook".
+MODE = config("MODE", default="polling")
+# Public HTTPS URL of the webhook, TLS is terminated by the proxy in front of the bot.
+WEBHOOK_URL = config("WEBHOOK_URL", default="")
+WEBHOOK_PATH = config("WEBHOOK_PATH", default="/webhook")
+WEBHOOK_HOST = config("WEBHOOK_HOST", default="0.0.0.0")
+WEBHOOK_PORT = int(config("WEBHOOK_PORT", default=8080))
+WEBHOOK_SECRET = config("WEBHOOK_SECRET", default="")
+WEBHOOK_CERTIFICATE = config("WEBHOOK_CERTIFICATE", default="")
+WEBHOOK_MAX_CONNECTIONS = int(config("WEBHOOK_MAX_CONNECTIONS", default=40))
+WEBHOOK_MAX_IN_FLIGHT = int(config("WEBHOOK_MAX_IN_FLIGHT", default=100))
+WEBHOOK_SHUTDOWN_TIMEOUT = int(config("WEBHOOK_SHUTDOWN_TIMEOUT", default=30))
+
+LOG_FORMATTER = "%(name)s | %(asctime)s | %(levelname)s | %(trace_id)s | %(message)s"
+# The log file is rotated at midnight, the rotated files get the date as a suffix.
+LOG_FILE = os.path.join(LOG_DIR, "log.txt")
+LOG_LEVEL = config("LOG_LEVEL", default="DEBUG").upper()
+LOG_RETENTION_DAYS = int(config("LOG_RETENTION_DAYS", default=14))
 
 os.makedirs(LOG_DIR, exist_ok=True)
 os.makedirs(TMP_DIR, exist_ok=True)
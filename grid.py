@@ -0,0 +1,127 @@
+import math
+
+from typing import Hashable
+
+import globals as g
+
+from cache import Cache
+from database import Location
+from logger import Logger
+from metrics import Counter, Gauge
+
+logger = Logger(__name__)
+
+
+class SpatialIndex:
+    """Index of the known locations by the cells of the lat/lon grid. When the grid is enabled,
+    the weather is fetched for the center of the cell and cached by the cell, so the nearby
+    locations share one request to WeatherAPI. The images are still rendered for each location
+    with its own name. The locations are added to the index when their weather is requested.
+
+    Args:
+        size (float): size of the cell in degrees, 0 disables the grid.
+    """
+
+    def __init__(self, size: float):
+        self.size = size
+
+        self.cells: dict[tuple[int, int], set[int]] = {}
+        self.locations: dict[int, tuple[int, int]] = {}
+
+        # Locations, which fetched the weather for the cache keys, so the lookups of the weather
+        # fetched for another location in the cell are counted as shared.
+        self.owners = Cache("weather_owners", g.FORECAST_TTL, g.CACHE_SIZE)
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.size), math.floor(lon / self.size)
+
+    def center(self, cell: tuple[int, int]) -> str:
+        """Returns the center of the cell in WeatherAPI format "lat,lon"."""
+        lat, lon = ((index + 0.5) * self.size for index in cell)
+        return f"{round(lat, 4)},{round(lon, 4)}"
+
+    def add(self, location: Location) -> tuple[int, int] | None:
+        """Adds the location to the index or moves it to the new cell if its coordinates
+        changed.
+
+        Returns:
+            tuple[int, int] | None: cell of the location, None if the grid is disabled or the
+                coordinates of the location are unknown.
+        """
+        if not self.enabled or location.lat is None or location.lon is None:
+            return None
+
+        cell = self.cell(location.lat, location.lon)
+        previous = self.locations.get(location.id)
+
+        if previous != cell:
+            if previous is not None:
+                self.cells[previous].discard(location.id)
+                if not self.cells[previous]:
+                    del self.cells[previous]
+
+            self.cells.setdefault(cell, set()).add(location.id)
+            self.locations[location.id] = cell
+
+            logger.debug(f"Indexed location [{location.id}] in grid cell [{cell}].")
+
+        return cell
+
+    def key(self, location: Location) -> Hashable:
+        """Returns the key of the weather of the location in the caches."""
+        cell = self.add(location)
+        return location.id if cell is None else ("cell", *cell)
+
+    def query(self, location: Location) -> str:
+        """Returns the location in WeatherAPI format, which is used to fetch its weather."""
+        cell = self.add(location)
+        return location.query if cell is None else self.center(cell)
+
+    def claim(self, kind: str, key: Hashable, location: Location):
+        """Records the location, which requests the weather from WeatherAPI. It's recorded
+        before the request, so the concurrent lookups waiting for it are counted as shared.
+        """
+        self.owners.set((kind, key), location.id)
+
+    def record(self, kind: str, key: Hashable, location: Location, fetched: bool):
+        """Counts the lookup of the weather: fetched from WeatherAPI, cached for the location
+        or shared with another location in the cell.
+
+        Args:
+            kind (str): kind of the weather: "current" or "forecast".
+            key (Hashable): key of the weather in the cache.
+            location (Location): location, which requested the weather.
+            fetched (bool): whether the weather was fetched from WeatherAPI.
+        """
+        if fetched:
+            WEATHER_LOOKUPS.inc(kind=kind, result="fetched")
+            return
+
+        owner = self.owners.get((kind, key))
+        shared = owner is not None and owner != location.id
+        WEATHER_LOOKUPS.inc(kind=kind, result="shared" if shared else "cached")
+
+
+index = SpatialIndex(g.WEATHER_GRID_DEGREES)
+
+
+WEATHER_LOOKUPS = Counter(
+    "bot_weather_lookups_total",
+    "Lookups of the weather by result: fetched from WeatherAPI, cached for the location, "
+    "shared with another location in the grid cell or served from the local history.",
+    ("kind", "result"),
+)
+WEATHER_GRID_LOCATIONS = Gauge(
+    "bot_weather_grid_locations",
+    "Number of the locations in the grid index.",
+    collect=lambda: [((), len(index.locations))],
+)
+WEATHER_GRID_CELLS = Gauge(
+    "bot_weather_grid_cells",
+    "Number of the grid cells with locations, the weather is fetched once per cell.",
+    collect=lambda: [((), len(index.cells))],
+)
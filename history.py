@@ -0,0 +1,280 @@
+import json
+import os
+import sqlite3
+import zlib
+
+from threading import Lock
+from time import gmtime, strftime, time
+from typing import Hashable
+
+import globals as g
+
+from logger import Logger
+from metrics import Gauge
+
+logger = Logger(__name__)
+
+HOUR = 3600
+DAY = 86400
+
+# Columns of the observations, the numeric values are kept after the compaction, so the
+# comparisons work for the whole retention period.
+COLUMNS = (
+    "key TEXT NOT NULL, kind TEXT NOT NULL, date TEXT, fetched INTEGER NOT NULL, "
+    "observed INTEGER NOT NULL, temp_c REAL, feelslike_c REAL, humidity INTEGER, "
+    "code INTEGER, payload BLOB"
+)
+
+
+def partition(epoch: float) -> str:
+    """Returns the name of the table with the observations fetched on the day (UTC)."""
+    return strftime("observations_%Y%m%d", gmtime(epoch))
+
+
+def key_text(key: Hashable) -> str:
+    """Returns the key of the weather in the caches as text: the location ID or the grid cell."""
+    return ":".join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+
+class History:
+    """Local SQLite store of the fetched weather. The responses are appended to the table of
+    the day with the compressed payloads, so the recent repeats are served without requests to
+    WeatherAPI after the entries are evicted from the caches or the bot is restarted. The
+    tables older than [g.HISTORY_RETENTION_DAYS] are dropped by the compaction, the older days
+    are thinned to one observation per hour without the payloads.
+
+    Args:
+        path (str): path to the SQLite file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = None
+        self.tables = set()
+        self.lock = Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS compacted (name TEXT PRIMARY KEY)"
+            )
+            self.tables = set(self.partitions())
+
+        return self.connection
+
+    def partitions(self) -> list[str]:
+        return [
+            name
+            for (name,) in self.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                "AND name LIKE 'observations_%' ORDER BY name"
+            )
+        ]
+
+    def ensure(self, table: str):
+        if table in self.tables:
+            return
+
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({COLUMNS})")
+        self.connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_lookup "
+            f"ON {table} (key, kind, date, fetched)"
+        )
+        self.tables.add(table)
+
+    def append(self, key: Hashable, kind: str, response: dict, date: str = None):
+        """Appends the response of WeatherAPI to the table of the current day.
+
+        Args:
+            key (Hashable): key of the weather in the caches.
+            kind (str): kind of the weather: "current" or "forecast".
+            response (dict): current weather response or forecastday of the forecast response.
+            date (str, optional): date of the forecast in format YYYY-MM-DD.
+        """
+        fetched = int(time())
+        current = response.get("current") or {}
+        condition = current.get("condition") or {}
+
+        row = (
+            key_text(key),
+            kind,
+            date,
+            fetched,
+            current.get("last_updated_epoch", fetched),
+            current.get("temp_c"),
+            current.get("feelslike_c"),
+            current.get("humidity"),
+            condition.get("code"),
+            zlib.compress(json.dumps(response, separators=(",", ":")).encode()),
+        )
+
+        table = partition(fetched)
+
+        with self.lock:
+            connection = self.connect()
+            self.ensure(table)
+            connection.execute(
+                f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row
+            )
+
+    def recent(
+        self, key: Hashable, kind: str, max_age: int, date: str = None
+    ) -> tuple[dict, int] | None:
+        """Returns the latest response for the key, which was fetched within max_age seconds.
+
+        Args:
+            key (Hashable): key of the weather in the caches.
+            kind (str): kind of the weather: "current" or "forecast".
+            max_age (int): maximum age of the response in seconds.
+            date (str, optional): date of the forecast in format YYYY-MM-DD.
+
+        Returns:
+            tuple[dict, int] | None: response of WeatherAPI and the time when it was fetched,
+                None if there's no recent response.
+        """
+        now = time()
+        since = int(now - max_age)
+
+        with self.lock:
+            connection = self.connect()
+
+            # The window can start on the previous day.
+            for table in dict.fromkeys((partition(now), partition(since))):
+                if table not in self.tables:
+                    continue
+
+                row = connection.execute(
+                    f"SELECT payload, fetched FROM {table} WHERE key = ? AND kind = ? "
+                    f"AND date IS ? AND fetched >= ? AND payload IS NOT NULL "
+                    f"ORDER BY fetched DESC LIMIT 1",
+                    (key_text(key), kind, date, since),
+                ).fetchone()
+
+                if row:
+                    return json.loads(zlib.decompress(row[0])), row[1]
+
+        return None
+
+    def observation(self, key: Hashable, epoch: float, window: int) -> dict | None:
+        """Returns the current weather observation for the key, which is the closest to
+        the time within the window.
+
+        Args:
+            key (Hashable): key of the weather in the caches.
+            epoch (float): time of the observation.
+            window (int): maximum difference from the time in seconds.
+
+        Returns:
+            dict | None: observed time, temp_c, feelslike_c, humidity and code of the
+                observation, None if there's no observation within the window.
+        """
+        tables = dict.fromkeys(
+            (partition(epoch - window), partition(epoch), partition(epoch + window))
+        )
+
+        best = None
+        with self.lock:
+            connection = self.connect()
+
+            for table in tables:
+                if table not in self.tables:
+                    continue
+
+                row = connection.execute(
+                    f"SELECT observed, temp_c, feelslike_c, humidity, code FROM {table} "
+                    f"WHERE key = ? AND kind = 'current' AND observed BETWEEN ? AND ? "
+                    f"ORDER BY abs(observed - ?) LIMIT 1",
+                    (key_text(key), epoch - window, epoch + window, epoch),
+                ).fetchone()
+
+                if row and (best is None or abs(row[0] - epoch) < abs(best[0] - epoch)):
+                    best = row
+
+        if best is None:
+            return None
+
+        return dict(
+            zip(("observed", "temp_c", "feelslike_c", "humidity", "code"), best)
+        )
+
+    def latest(self, key: Hashable) -> dict | None:
+        """Returns the latest current weather observation for the key within the last hour."""
+        return self.observation(key, time(), HOUR)
+
+    def compare(self, key: Hashable) -> tuple[dict, dict] | None:
+        """Returns the latest current weather observation for the key and the observation
+        a day before it, the observations of the previous days are kept one per hour.
+
+        Returns:
+            tuple[dict, dict] | None: latest observation and the observation a day before it,
+                None if one of them is missing.
+        """
+        latest = self.latest(key)
+        if latest is None:
+            return None
+
+        previous = self.observation(key, latest["observed"] - DAY, HOUR)
+        if previous is None:
+            return None
+
+        return latest, previous
+
+    def compact(self):
+        """Drops the tables older than the retention period and thins the tables of the
+        previous days to one observation per location and hour without the payloads."""
+        today = partition(time())
+        oldest = partition(time() - g.HISTORY_RETENTION_DAYS * DAY)
+
+        with self.lock:
+            connection = self.connect()
+            compacted = {
+                name for (name,) in connection.execute("SELECT name FROM compacted")
+            }
+
+            dropped, thinned = 0, 0
+            for table in self.partitions():
+                if table < oldest:
+                    connection.execute(f"DROP TABLE {table}")
+                    connection.execute("DELETE FROM compacted WHERE name = ?", (table,))
+                    self.tables.discard(table)
+                    dropped += 1
+                elif table < today and table not in compacted:
+                    connection.execute("BEGIN")
+                    connection.execute(
+                        f"DELETE FROM {table} WHERE rowid NOT IN (SELECT min(rowid) "
+                        f"FROM {table} GROUP BY key, kind, date, observed / {HOUR})"
+                    )
+                    connection.execute(f"UPDATE {table} SET payload = NULL")
+                    connection.execute("INSERT INTO compacted VALUES (?)", (table,))
+                    connection.execute("COMMIT")
+                    thinned += 1
+
+            if dropped or thinned:
+                connection.execute("VACUUM")
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        logger.info(
+            f"Compacted history: dropped [{dropped}] and thinned [{thinned}] daily tables, "
+            f"size [{self.size()}] bytes."
+        )
+
+    def size(self) -> int:
+        return sum(
+            os.path.getsize(path)
+            for path in (self.path, f"{self.path}-wal")
+            if os.path.exists(path)
+        )
+
+
+history = History(g.HISTORY_FILE)
+
+
+HISTORY_BYTES = Gauge(
+    "bot_history_bytes",
+    "Size of the local history of the weather on disk.",
+    collect=lambda: [((), history.size())],
+)
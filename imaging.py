@@ -1,33 +1,50 @@
 import os
 
+from uuid import uuid4
+
 from PIL import Image, ImageDraw, ImageFont
 
 import globals as g
 
 from logger import Logger
+from tracing import traced
 
 logger = Logger(__name__)
 
 
 class Drawer:
+    """Draws the weather images and saves them in the output profile.
+
+    Args:
+        profile (str, optional): name of the output profile from [g.IMAGE_PROFILES], defaults
+            to [g.IMAGE_PROFILE].
+    """
+
+    def __init__(self, profile: str = None):
+        self.profile = profile or g.IMAGE_PROFILE
+
     def select_background(self, weather):
         code = weather.get("code")
         condition = "fair" if code in g.CONDITIONS_TYPES["fair"] else "rain"
 
         logger.debug(
-            f"Readed code: [{code}] from weather data, identified it as [{condition}]."
+            "Readed code: [%s] from weather data, identified it as [%s].",
+            code,
+            condition,
         )
 
         is_day = weather.get("is_day")
         time = "day" if is_day == 1 else "night"
 
         logger.debug(
-            f"Readed is_day: [{is_day}] from weather data, identified it as [{time}]."
+            "Readed is_day: [%s] from weather data, identified it as [%s].",
+            is_day,
+            time,
         )
 
         background = os.path.join(g.BACKGROUNDS_DIR, f"{condition}_{time}.png")
 
-        logger.debug(f"Selected background: {background}.")
+        logger.debug("Selected background: %s.", background)
 
         return background
 
@@ -36,10 +53,11 @@ class Drawer:
 
         icon = os.path.join(g.ICONS_DIR, time, os.path.basename(link))
 
-        logger.debug(f"Path to the selected icon: [{icon}].")
+        logger.debug("Path to the selected icon: [%s].", icon)
 
         return icon
 
+    @traced("render.current")
     def draw_current_weather(self, weather):
         background = self.select_background(weather)
         icon = self.select_icon(weather.get("icon"), weather.get("is_day"))
@@ -51,11 +69,11 @@ class Drawer:
 
         background_image = Image.open(background)
 
-        logger.debug(f"Successfully opened background image: [{background}].")
+        logger.debug("Successfully opened background image: [%s].", background)
 
         icon_image = Image.open(icon).convert("RGBA")
 
-        logger.debug(f"Successfully opened icon image: [{icon}].")
+        logger.debug("Successfully opened icon image: [%s].", icon)
 
         try:
             background_image.paste(icon_image, XY_ICON, mask=icon_image)
@@ -73,7 +91,8 @@ class Drawer:
             name_font = ImageFont.truetype(g.ARIMO_BOLD, 50)
 
             logger.debug(
-                f"Name of the city [{weather.get('name')}] is too long, using smaller font."
+                "Name of the city [%s] is too long, using smaller font.",
+                weather.get("name"),
             )
 
         else:
@@ -118,16 +137,11 @@ class Drawer:
         for text, xy in xy_base.items():
             draw.text(xy, text, font=base_font, fill="white", anchor="mt")
 
-            logger.debug(f"Successfully drawn [{text}] on the background image.")
+            logger.debug("Successfully drawn [%s] on the background image.", text)
 
-        filepath = os.path.join(g.TMP_DIR, f"current_weather_{weather.get('name')}.png")
-
-        background_image.save(filepath)
-
-        logger.debug(f"Successfully saved image to: [{filepath}].")
-
-        return filepath
+        return self.save(background_image, f"current_weather_{weather.get('name')}")
 
+    @traced("render.forecast")
     def draw_forecast_weather(self, weather: list, metadata: dict[str, int]) -> str:
         XY_DATE = (256, 82)
         XY_TEMP = (768, 50)
@@ -137,11 +151,11 @@ class Drawer:
 
         background = os.path.join(g.BACKGROUNDS_DIR, "forecast.png")
 
-        logger.debug(f"Selected background: {background}.")
+        logger.debug("Selected background: %s.", background)
 
         background_image = Image.open(background)
 
-        logger.debug(f"Successfully opened background image: [{background}].")
+        logger.debug("Successfully opened background image: [%s].", background)
 
         draw = ImageDraw.Draw(background_image)
 
@@ -177,7 +191,7 @@ class Drawer:
         for text, xy in xy_base.items():
             draw.text(xy, text, font=base_font, fill="white", anchor="mm")
 
-            logger.debug(f"Successfully drawn [{text}] on the background image.")
+            logger.debug("Successfully drawn [%s] on the background image.", text)
 
         hour_font = ImageFont.truetype(g.ARIMO_BOLD, 20)
         temp_font = ImageFont.truetype(g.ARIMO_BOLD, 30)
@@ -185,12 +199,12 @@ class Drawer:
 
         for row in range(ROWS):
 
-            logger.debug(f"Starting to draw row [{row}]...")
+            logger.debug("Starting to draw row [%s]...", row)
 
             y = ROW_YS + row * CELL_H
             for col in range(COLS):
 
-                logger.debug(f"Starting to draw column [{col}]...")
+                logger.debug("Starting to draw column [%s]...", col)
 
                 x = ROW_XS + col * CELL_W
 
@@ -204,7 +218,10 @@ class Drawer:
                 )
 
                 logger.debug(
-                    f"Got cell data. Hour: [{hour}], temp: [{temp}], prec: [{prec}]."
+                    "Got cell data. Hour: [%s], temp: [%s], prec: [%s].",
+                    hour,
+                    temp,
+                    prec,
                 )
 
                 draw.text(
@@ -247,18 +264,54 @@ class Drawer:
                         f"Error while pasting icon on the background image: [{error}]."
                     )
 
-                logger.debug(f"Finished working on index [{index}] and column [{col}].")
+                logger.debug(
+                    "Finished working on index [%s] and column [%s].", index, col
+                )
 
-            logger.debug(f"Finished working on row [{row}].")
+            logger.debug("Finished working on row [%s].", row)
 
         logger.debug("Successfully drawn all cells on the background image.")
 
+        return self.save(
+            background_image, f"forecast_weather_{metadata.get('location')}"
+        )
+
+    def save(self, image: Image.Image, name: str) -> str:
+        """Saves the image in the format of the output profile: the image is scaled down, the
+        alpha channel is dropped for the lossy formats and the colors are quantized to the
+        palette if the profile sets them.
+
+        Args:
+            image (Image.Image): drawn image.
+            name (str): name of the file without the extension.
+
+        Returns:
+            str: path to the saved image.
+        """
+        profile = g.IMAGE_PROFILES[self.profile]
+
+        scale = profile.get("scale")
+        if scale:
+            size = (round(image.width * scale), round(image.height * scale))
+            image = image.resize(size, Image.LANCZOS)
+
+        options = {}
+        if profile.get("colors"):
+            image = image.convert("RGB").quantize(
+                profile["colors"], method=Image.Quantize.FASTOCTREE
+            )
+        elif profile["format"] != "PNG":
+            image = image.convert("RGB")
+            options["quality"] = profile["quality"]
+
         filepath = os.path.join(
-            g.TMP_DIR, f"forecast_weather_{metadata.get('location')}.png"
+            g.TMP_DIR, f"{name}_{uuid4().hex}.{profile['extension']}"
         )
 
-        background_image.save(filepath)
+        image.save(filepath, profile["format"], **options)
 
-        logger.debug(f"Successfully saved image to: [{filepath}].")
+        logger.debug(
+            "Successfully saved image in profile [%s] to: [%s].", self.profile, filepath
+        )
 
         return filepath
@@ -1,26 +1,94 @@
-import logging
-import sys
-
-import globals as g
-
-
-class Logger(logging.getLoggerClass()):
-    """Handles logging to the file and stroudt with timestamps."""
-
-    def __init__(self, name: str):
-        super().__init__(name)
-        self.setLevel(logging.DEBUG)
-        self.stdout_handler = logging.StreamHandler(sys.stdout)
-        self.file_handler = logging.FileHandler(
-            filename=g.LOG_FILE, mode="a", encoding="utf-8"
-        )
-        self.fmt = g.LOG_FORMATTER
-        self.stdout_handler.setFormatter(logging.Formatter(g.LOG_FORMATTER))
-        self.file_handler.setFormatter(logging.Formatter(g.LOG_FORMATTER))
-        self.addHandler(self.stdout_handler)
-        self.addHandler(self.file_handler)
-
-
-def get_log_file() -> str:
-    """Returns the path to the main_log file."""
-    return g.LOG_FILE
+import atexit
+import logging
+import sys
+
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from queue import SimpleQueue
+
+import globals as g
+
+from tracing import trace_id
+
+# All loggers put records into one queue, the records are written to stdout and to the file
+# by the listener in a separate thread, so logging never blocks the event loop.
+log_queue = SimpleQueue()
+queue_handler = QueueHandler(log_queue)
+listener = None
+
+# Instances of [Logger], which are created directly and so are not registered in the manager
+# of the logging module.
+loggers = []
+
+
+class TraceFilter(logging.Filter):
+    """Attaches the ID of the current trace to the record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id()
+        return True
+
+
+queue_handler.addFilter(TraceFilter())
+
+
+def start_listener():
+    """Starts the listener, which writes the records from the queue to stdout and to the log
+    file. The log file is rotated at midnight and [g.LOG_RETENTION_DAYS] old files are kept.
+    """
+    global listener
+
+    formatter = logging.Formatter(g.LOG_FORMATTER)
+
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    file_handler = TimedRotatingFileHandler(
+        filename=g.LOG_FILE,
+        when="midnight",
+        backupCount=g.LOG_RETENTION_DAYS,
+        encoding="utf-8",
+    )
+
+    for handler in (stdout_handler, file_handler):
+        handler.setFormatter(formatter)
+
+    listener = QueueListener(log_queue, stdout_handler, file_handler)
+    listener.start()
+
+    atexit.register(stop_listener)
+
+
+def stop_listener():
+    """Writes the remaining records from the queue and stops the listener."""
+    global listener
+
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+class Logger(logging.getLoggerClass()):
+    """Handles logging to the file and stroudt with timestamps."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.setLevel(g.LOG_LEVEL)
+        self.fmt = g.LOG_FORMATTER
+
+        if listener is None:
+            start_listener()
+
+        self.addHandler(queue_handler)
+
+        loggers.append(self)
+
+
+def set_level(level: int):
+    """Sets the level of all instances of [Logger]."""
+    for instance in loggers:
+        instance.setLevel(level)
+        # The cache of isEnabledFor is cleared by the manager only for the registered loggers.
+        instance._cache.clear()
+
+
+def get_log_file() -> str:
+    """Returns the path to the main_log file."""
+    return g.LOG_FILE
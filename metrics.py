@@ -0,0 +1,205 @@
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Iterable
+
+from aiohttp import web
+
+import globals as g
+
+from logger import Logger
+
+logger = Logger(__name__)
+
+# Upper bounds of the latency histogram buckets in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REGISTRY = []
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Metric:
+    """Base class of the metrics, which are exposed in the Prometheus text format. Values of
+    the metric are either stored in the metric or collected with the function on every scrape.
+
+    Args:
+        name (str): name of the metric.
+        documentation (str): help text of the metric.
+        labels (tuple, optional): names of the labels.
+        collect (Callable, optional): function which returns pairs of label values and values.
+    """
+
+    type = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        collect: Callable[[], Iterable[tuple[tuple, float]]] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+
+        self.values = {}
+        self.lock = Lock()
+
+        REGISTRY.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> list[str]:
+        values = self.collect() if self.collect else list(self.values.items())
+        return [
+            f"{self.name}{format_labels(self.labels, key)} {value}"
+            for key, value in values
+        ]
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            buckets, total, count = self.values.get(key, ([0] * len(BUCKETS), 0, 0))
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+            self.values[key] = (buckets, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the time spent in the block."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            values = [(key, (list(b), s, c)) for key, (b, s, c) in self.values.items()]
+
+        lines = []
+        for key, (buckets, total, count) in values:
+            for bound, bucket in zip(BUCKETS, buckets):
+                labels = format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {bucket}")
+
+            labels = format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "bot_stage_seconds",
+    "Latency of the request stages: db, weather_api, render, upload, send.",
+    ("stage",),
+)
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Latency of the update handlers.", ("handler",)
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Number of errors in the update handlers.", ("handler",)
+)
+NOTIFICATION_USERS = Gauge(
+    "bot_notification_run_users",
+    "Progress of the last notification run: total, sent and failed users.",
+    ("notification", "status"),
+)
+
+
+@contextmanager
+def handler_timer(name: str):
+    """Observes the latency of the handler and counts its errors."""
+    try:
+        with HANDLER_SECONDS.time(handler=name):
+            yield
+    except Exception:
+        HANDLER_ERRORS.inc(handler=name)
+        raise
+
+
+def timed(handler: Callable) -> Callable:
+    """Decorator, which observes the latency and errors of the async handler."""
+
+    @wraps(handler)
+    async def wrapper(*args, **kwargs):
+        with handler_timer(handler.__name__):
+            return await handler(*args, **kwargs)
+
+    return wrapper
+
+
+def render() -> str:
+    """Returns all metrics in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def handle(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+def add_routes(app: web.Application):
+    """Adds the metrics endpoint to the aiohttp application."""
+    app.router.add_get(g.METRICS_PATH, handle)
+
+
+async def start_server():
+    """Starts the aiohttp server with the metrics endpoint in the running event loop."""
+    app = web.Application()
+    add_routes(app)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, g.METRICS_HOST, g.METRICS_PORT).start()
+
+    logger.info(
+        f"Metrics are served on [{g.METRICS_HOST}:{g.METRICS_PORT}{g.METRICS_PATH}]."
+    )
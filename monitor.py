@@ -0,0 +1,135 @@
+import asyncio
+import os
+import sys
+import threading
+import traceback
+
+from collections import deque
+from statistics import quantiles
+from time import monotonic, sleep
+
+import globals as g
+
+from logger import Logger
+from metrics import Counter, Gauge, Histogram
+
+logger = Logger(__name__)
+
+LOOP_LAG = Histogram(
+    "bot_loop_lag_seconds", "Delay of the event loop in running the scheduled callback."
+)
+LOOP_STALLS = Counter(
+    "bot_loop_stalls_total",
+    "Number of times the event loop was blocked longer than the threshold by the code site.",
+    ("site",),
+)
+
+
+class LoopMonitor:
+    """Measures the lag of the event loop by scheduling the tick every [interval] seconds. The
+    watcher thread checks that the ticks are running, when the loop is blocked longer than the
+    [threshold], it captures the stack of the loop thread, so the blocking code is logged
+    together with the duration of the stall.
+
+    Args:
+        interval (float): interval between the ticks in seconds.
+        threshold (float): lag in seconds, after which the loop is considered stalled.
+    """
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+
+        self.lags = deque(maxlen=1000)
+        self.heartbeat = monotonic()
+        self.loop_thread = None
+        self.task = None
+
+        # Stack and site of the current stall, captured by the watcher thread.
+        self.stack = None
+        self.site = None
+
+        Gauge(
+            "bot_loop_lag_recent_seconds",
+            "Percentiles of the event loop lag over the last ticks.",
+            ("quantile",),
+            collect=self.percentiles,
+        )
+
+    def start(self):
+        """Starts the ticks in the running event loop and the watcher thread."""
+        if self.task is not None:
+            return
+
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = monotonic()
+        self.task = asyncio.create_task(self.tick())
+
+        threading.Thread(target=self.watch, daemon=True).start()
+
+        logger.info(
+            f"Started event loop monitor with threshold [{self.threshold}] seconds."
+        )
+
+    async def tick(self):
+        while True:
+            start = monotonic()
+            await asyncio.sleep(self.interval)
+
+            lag = max(monotonic() - start - self.interval, 0)
+            self.heartbeat = monotonic()
+
+            LOOP_LAG.observe(lag)
+            self.lags.append(lag)
+
+            if self.stack is not None:
+                self.report(lag)
+
+    def watch(self):
+        while True:
+            sleep(self.interval)
+
+            if self.stack is None and monotonic() - self.heartbeat > self.threshold:
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    self.capture(frame)
+
+    def capture(self, frame):
+        stack = traceback.extract_stack(frame)
+
+        # The innermost frame in the code of the bot is the site which blocks the loop.
+        own = [
+            f
+            for f in stack
+            if f.filename.startswith(os.path.abspath(g.ABSOLUTE_PATH))
+            and f.filename != os.path.abspath(__file__)
+        ]
+        site = own[-1] if own else stack[-1]
+
+        self.site = f"{os.path.basename(site.filename)}:{site.name}"
+        self.stack = "".join(traceback.format_list(stack[-g.LOOP_STACK_DEPTH :]))
+
+    def report(self, lag: float):
+        LOOP_STALLS.inc(site=self.site)
+
+        logger.warning(
+            f"Event loop was blocked for [{lag:.3f}] seconds in [{self.site}]. "
+            f"Stack:\n{self.stack}"
+        )
+
+        self.stack = None
+        self.site = None
+
+    def percentiles(self) -> list[tuple[tuple, float]]:
+        if len(self.lags) < 2:
+            return []
+
+        values = quantiles(self.lags, n=100, method="inclusive")
+        return [
+            (("0.5",), values[49]),
+            (("0.99",), values[98]),
+            (("1",), max(self.lags)),
+        ]
+
+
+monitor = LoopMonitor(g.LOOP_MONITOR_INTERVAL, g.LOOP_STALL_THRESHOLD)
@@ -0,0 +1,210 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+from collections import Counter
+from datetime import datetime
+from time import monotonic
+from typing import Awaitable, Callable
+
+import globals as g
+
+from logger import Logger
+
+logger = Logger(__name__)
+
+
+# Innermost frames of the idle threads, their samples are skipped: the workers of the executor
+# waiting for the work, the threads blocked on a condition, the log listener, the exporter of
+# the traces and the watchdog of the loop monitor.
+IDLE_FRAMES = {
+    ("thread.py", "_worker"),
+    ("threading.py", "wait"),
+    ("handlers.py", "dequeue"),
+    ("tracing.py", "run"),
+    ("monitor.py", "watch"),
+}
+
+
+class Sampler:
+    """Samples the stacks of all threads except the event loop thread. cProfile instruments
+    only the thread it's enabled in, while the images are drawn and WeatherAPI and the history
+    are queried in the workers of asyncio.to_thread, which are started before the session.
+
+    Args:
+        interval (float): interval between the samples in seconds.
+        loop_thread (int): identifier of the event loop thread, which is profiled by cProfile.
+    """
+
+    def __init__(self, interval: float, loop_thread: int):
+        self.interval = interval
+        self.loop_thread = loop_thread
+        self.samples = 0
+        self.own = Counter()
+        self.total = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="profiling-sampler", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        skipped = {self.loop_thread, threading.get_ident()}
+
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident in skipped:
+                    continue
+
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+
+                functions = []
+                while frame is not None:
+                    code = frame.f_code
+                    functions.append(
+                        f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+                    )
+                    frame = frame.f_back
+
+                self.samples += 1
+                self.own[functions[0]] += 1
+                # Recursive functions are counted once per sample.
+                self.total.update(set(functions))
+
+    def report(self, stream: io.StringIO):
+        stream.write(
+            f"\nTop {g.PROFILE_TOP} functions in the worker threads by [{self.samples}] "
+            f"samples every {self.interval * 1000:.0f} ms (own, total, function):\n"
+        )
+        for function, total in self.total.most_common(g.PROFILE_TOP):
+            stream.write(f"{self.own[function]:>8}{total:>8}  {function}\n")
+
+
+class Profiler:
+    """Time-bounded profiling session over the running bot: cProfile of the event loop thread,
+    the sampled stacks of the worker threads and the diff of tracemalloc snapshots taken at
+    the start and at the end of the session. Only one session can run at the same time.
+    """
+
+    def __init__(self):
+        self.profile = None
+        self.sampler = None
+        self.snapshot = None
+        self.started = None
+        self.started_at = None
+        self.tracing_started = False
+        self.timeout = None
+        self.on_finish = None
+
+    @property
+    def running(self) -> bool:
+        return self.profile is not None
+
+    def start(self, duration: float, on_finish: Callable[[bytes], Awaitable]):
+        """Starts the session, which is stopped after [duration] seconds if it's not stopped
+        earlier.
+
+        Args:
+            duration (float): maximum duration of the session in seconds.
+            on_finish (Callable): coroutine function, which receives the report.
+        """
+        if self.running:
+            raise RuntimeError("Profiling session is already running.")
+
+        self.tracing_started = not tracemalloc.is_tracing()
+        if self.tracing_started:
+            tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+
+        self.on_finish = on_finish
+        self.started = monotonic()
+        self.started_at = datetime.now()
+
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+        self.sampler = Sampler(g.PROFILE_SAMPLE_INTERVAL, threading.get_ident())
+        self.sampler.start()
+
+        self.timeout = asyncio.get_running_loop().call_later(
+            duration, lambda: asyncio.create_task(self.stop())
+        )
+
+        logger.info(f"Started profiling session for [{duration}] seconds.")
+
+    async def stop(self):
+        """Stops the session and passes the report to the callback."""
+        if not self.running:
+            return
+
+        profile, self.profile = self.profile, None
+        profile.disable()
+
+        sampler, self.sampler = self.sampler, None
+        await asyncio.to_thread(sampler.stop)
+
+        start, on_finish = self.snapshot, self.on_finish
+        self.timeout.cancel()
+        duration = monotonic() - self.started
+
+        snapshot = tracemalloc.take_snapshot()
+        if self.tracing_started:
+            tracemalloc.stop()
+
+        report = await asyncio.to_thread(
+            self.report, profile, sampler, start, snapshot, duration
+        )
+
+        logger.info(f"Stopped profiling session after [{duration:.1f}] seconds.")
+
+        await on_finish(report)
+
+    def report(
+        self,
+        profile: cProfile.Profile,
+        sampler: Sampler,
+        start: tracemalloc.Snapshot,
+        end: tracemalloc.Snapshot,
+        duration: float,
+    ) -> bytes:
+        stream = io.StringIO()
+        stream.write(
+            f"Profiling session started at {self.started_at:%Y-%m-%d %H:%M:%S}, "
+            f"duration {duration:.1f} seconds.\n\n"
+            f"Top {g.PROFILE_TOP} functions by cumulative time in the event loop thread:\n"
+        )
+
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(g.PROFILE_TOP)
+
+        sampler.report(stream)
+
+        filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+        differences = end.filter_traces(filters).compare_to(
+            start.filter_traces(filters), "lineno"
+        )
+
+        stream.write(f"\nTop {g.PROFILE_TOP} allocation sites by size difference:\n")
+        for difference in differences[: g.PROFILE_TOP]:
+            stream.write(f"{difference}\n")
+
+        return stream.getvalue().encode("utf-8")
+
+
+profiler = Profiler()
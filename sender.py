@@ -0,0 +1,330 @@
+import asyncio
+
+from collections import deque
+from enum import IntEnum
+from io import BytesIO
+from itertools import count
+from statistics import quantiles
+from time import monotonic
+
+from aiogram import Bot
+from aiogram.types import InputFile
+from aiogram.utils.exceptions import NetworkError, RetryAfter
+
+import globals as g
+
+from cache import Cache
+from logger import Logger
+from metrics import STAGE_SECONDS, Counter, Gauge, Histogram
+from tracing import current_span, activate, span
+
+logger = Logger(__name__)
+
+
+class Priority(IntEnum):
+    """Priority classes of the outbound messages, lower value is sent first."""
+
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+    BULK = 2
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    Args:
+        rate (float): number of tokens added per second.
+        capacity (float): maximum number of tokens in the bucket.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def take(self) -> float:
+        """Takes a token from the bucket if it's available.
+
+        Returns:
+            float: 0 if the token was taken, otherwise time in seconds until the token is available.
+        """
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+
+class Job:
+    def __init__(self, method: str, chat_id: int, kwargs: dict, priority: Priority):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.attempts = 0
+        self.created = monotonic()
+        self.span = current_span.get()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class Sender:
+    """Central outbound queue for the messages to Telegram. Messages are sent by the workers in
+    the order of their priority, limited by the global and per-chat token buckets. When Telegram
+    responds with flood wait, the sending is paused for the requested time and the message is
+    retried.
+
+    Args:
+        bot (Bot): bot to send messages with.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+
+        self.queue = None
+        self.sequence = count()
+        self.workers = []
+
+        self.global_bucket = TokenBucket(g.SENDER_GLOBAL_RATE, g.SENDER_GLOBAL_RATE)
+        self.chat_buckets = Cache("chat_buckets", 60, g.CACHE_SIZE)
+        self.paused_until = 0
+
+        self.depth = {priority: 0 for priority in Priority}
+        self.latencies = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+        Gauge(
+            "bot_sender_queue_depth",
+            "Number of messages in the outbound queue by priority.",
+            ("priority",),
+            collect=lambda: [
+                ((priority.name.lower(),), depth)
+                for priority, depth in self.depth.items()
+            ],
+        )
+        Counter(
+            "bot_sender_messages_total",
+            "Number of outbound messages by status: sent, failed or retried.",
+            ("status",),
+            collect=lambda: [
+                (("sent",), self.sent),
+                (("failed",), self.failed),
+                (("retried",), self.retried),
+            ],
+        )
+        self.latency = Histogram(
+            "bot_sender_latency_seconds",
+            "Time from putting the message to the queue until it's sent.",
+        )
+
+    def start(self):
+        """Creates the queue and starts the workers in the running event loop."""
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [
+            asyncio.create_task(self.worker()) for _ in range(g.SENDER_WORKERS)
+        ]
+
+        logger.debug(f"Started [{g.SENDER_WORKERS}] sender workers.")
+
+    async def send_message(
+        self,
+        chat_id: int,
+        text: str,
+        priority: Priority = Priority.INTERACTIVE,
+        **kwargs,
+    ):
+        """Puts the message to the queue and waits until it's sent.
+
+        Args:
+            chat_id (int): telegram_id of the chat.
+            text (str): text of the message.
+            priority (Priority, optional): priority class of the message.
+
+        Returns:
+            types.Message: sent message.
+        """
+        return await self.enqueue(
+            "send_message", chat_id, {"text": text, **kwargs}, priority
+        )
+
+    async def send_photo(
+        self,
+        chat_id: int,
+        photo: bytes | str,
+        filename: str = "image.png",
+        priority: Priority = Priority.INTERACTIVE,
+        **kwargs,
+    ):
+        """Puts the photo to the queue and waits until it's sent.
+
+        Args:
+            chat_id (int): telegram_id of the chat.
+            photo (bytes | str): content of the image or file_id of the uploaded photo.
+            filename (str, optional): name of the file to upload.
+            priority (Priority, optional): priority class of the message.
+
+        Returns:
+            types.Message: sent message.
+        """
+        return await self.enqueue(
+            "send_photo",
+            chat_id,
+            {"photo": photo, "filename": filename, **kwargs},
+            priority,
+        )
+
+    async def send_document(
+        self,
+        chat_id: int,
+        document: bytes,
+        filename: str,
+        priority: Priority = Priority.INTERACTIVE,
+        **kwargs,
+    ):
+        """Puts the document to the queue and waits until it's sent.
+
+        Args:
+            chat_id (int): telegram_id of the chat.
+            document (bytes): content of the file.
+            filename (str): name of the file to upload.
+            priority (Priority, optional): priority class of the message.
+
+        Returns:
+            types.Message: sent message.
+        """
+        return await self.enqueue(
+            "send_document",
+            chat_id,
+            {"document": document, "filename": filename, **kwargs},
+            priority,
+        )
+
+    async def enqueue(
+        self, method: str, chat_id: int, kwargs: dict, priority: Priority
+    ):
+        if self.queue is None:
+            self.start()
+
+        job = Job(method, chat_id, kwargs, priority)
+        self.put(job)
+
+        return await job.future
+
+    def put(self, job: Job):
+        self.depth[job.priority] += 1
+        self.queue.put_nowait((job.priority, next(self.sequence), job))
+
+    async def worker(self):
+        # The worker sends the jobs of different traces, so it doesn't keep the trace of the
+        # task which started it.
+        current_span.set(None)
+
+        while True:
+            _, _, job = await self.queue.get()
+            self.depth[job.priority] -= 1
+
+            chat_bucket = self.chat_buckets.get(job.chat_id)
+            if chat_bucket is None:
+                chat_bucket = TokenBucket(g.SENDER_CHAT_RATE, g.SENDER_CHAT_BURST)
+                self.chat_buckets.set(job.chat_id, chat_bucket)
+
+            delay = chat_bucket.take()
+            if delay:
+                # Returning the job to the queue later, so the worker can send to other chats.
+                asyncio.get_running_loop().call_later(delay, self.put, job)
+                continue
+
+            while (delay := max(self.paused_until - monotonic(), 0)) or (
+                delay := self.global_bucket.take()
+            ):
+                await asyncio.sleep(delay)
+
+            with activate(job.span), span(
+                f"sender.{job.method}",
+                attempt=job.attempts + 1,
+                queued=round(monotonic() - job.created, 3),
+            ):
+                await self.send(job)
+
+    async def send(self, job: Job):
+        kwargs = dict(job.kwargs)
+        filename = kwargs.pop("filename", None)
+        for field in ("photo", "document"):
+            if isinstance(kwargs.get(field), bytes):
+                kwargs[field] = InputFile(BytesIO(kwargs[field]), filename)
+
+        job.attempts += 1
+
+        stage = "send" if job.method == "send_message" else "upload"
+
+        try:
+            with STAGE_SECONDS.time(stage=stage):
+                result = await getattr(self.bot, job.method)(job.chat_id, **kwargs)
+        except RetryAfter as error:
+            self.paused_until = max(self.paused_until, monotonic() + error.timeout)
+
+            logger.warning(
+                f"Flood wait for [{error.timeout}] seconds while sending to chat [{job.chat_id}]."
+            )
+
+            self.retry(job, error)
+        except NetworkError as error:
+            logger.warning(
+                f"Network error while sending to chat [{job.chat_id}]: [{error}]."
+            )
+
+            self.retry(job, error)
+        except Exception as error:
+            self.fail(job, error)
+        else:
+            self.sent += 1
+            self.latencies.append(monotonic() - job.created)
+            self.latency.observe(monotonic() - job.created)
+
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def retry(self, job: Job, error: Exception):
+        if job.attempts > g.SENDER_MAX_RETRIES:
+            self.fail(job, error)
+            return
+
+        self.retried += 1
+        self.put(job)
+
+    def fail(self, job: Job, error: Exception):
+        self.failed += 1
+
+        logger.error(
+            f"Failed to [{job.method}] to chat [{job.chat_id}] after [{job.attempts}] attempts: [{error}]."
+        )
+
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def stats(self) -> dict:
+        """Returns the metrics of the queue: depth per priority, number of sent, failed and
+        retried messages and the latency percentiles from enqueue to sending in seconds.
+        """
+        stats = {
+            "depth": {
+                priority.name.lower(): depth for priority, depth in self.depth.items()
+            },
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+        if len(self.latencies) > 1:
+            percentiles = quantiles(self.latencies, n=100)
+            stats.update(
+                {"latency_p50": percentiles[49], "latency_p99": percentiles[98]}
+            )
+
+        return stats
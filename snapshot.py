@@ -0,0 +1,102 @@
+import os
+import pickle
+import sqlite3
+
+from time import perf_counter, time
+
+import globals as g
+
+from cache import Cache, caches
+from logger import Logger
+
+logger = Logger(__name__)
+
+
+def collect() -> dict[str, list]:
+    """Copies the entries of the persistent caches. It's called in the event loop, so the
+    caches are not changed while they are copied, the copies are written in a thread."""
+    return {cache.name: cache.snapshot() for cache in caches if cache.persistent}
+
+
+def save_snapshot(entries: dict[str, list], path: str = None):
+    """Writes the entries of the caches to the SQLite file. The snapshot is written to the
+    temporary file first, which replaces the previous snapshot, so it's never half-written.
+
+    Args:
+        entries (dict[str, list]): entries of the caches by their names from [collect].
+        path (str, optional): path to the snapshot, defaults to [g.CACHE_SNAPSHOT_FILE].
+    """
+    path = path or g.CACHE_SNAPSHOT_FILE
+    tmp_path = f"{path}.tmp"
+    started = perf_counter()
+
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    connection = sqlite3.connect(tmp_path)
+    try:
+        with connection:
+            connection.execute(
+                "CREATE TABLE entries (cache TEXT, key BLOB, value BLOB, expires REAL)"
+            )
+            connection.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?, ?)",
+                (
+                    (name, pickle.dumps(key), pickle.dumps(value), expires)
+                    for name, items in entries.items()
+                    for key, value, expires in items
+                ),
+            )
+    finally:
+        connection.close()
+
+    os.replace(tmp_path, path)
+
+    logger.info(
+        f"Saved [{sum(map(len, entries.values()))}] cache entries to the snapshot "
+        f"in [{perf_counter() - started:.3f}] seconds."
+    )
+
+
+def load_snapshot(path: str = None):
+    """Restores the persistent caches from the snapshot, the expired entries are discarded.
+
+    Args:
+        path (str, optional): path to the snapshot, defaults to [g.CACHE_SNAPSHOT_FILE].
+    """
+    path = path or g.CACHE_SNAPSHOT_FILE
+
+    if not os.path.exists(path):
+        logger.debug(
+            f"Cache snapshot [{path}] doesn't exist, starting with empty caches."
+        )
+        return
+
+    by_name: dict[str, Cache] = {c.name: c for c in caches if c.persistent}
+
+    connection = sqlite3.connect(path)
+    try:
+        # The expired entries are skipped in the query, so they are never unpickled.
+        rows = connection.execute(
+            "SELECT cache, key, value, expires FROM entries "
+            "WHERE expires > ? ORDER BY rowid",
+            (time(),),
+        ).fetchall()
+    except sqlite3.DatabaseError as error:
+        logger.error(f"Failed to read cache snapshot [{path}]: [{error}].")
+        return
+    finally:
+        connection.close()
+
+    entries = {}
+    for name, key, value, expires in rows:
+        if name in by_name:
+            entries.setdefault(name, []).append(
+                (pickle.loads(key), pickle.loads(value), expires)
+            )
+
+    for name, items in entries.items():
+        restored = by_name[name].restore(items)
+        logger.debug(f"Restored [{restored}] entries of cache [{name}].")
+
+    logger.info(f"Restored caches from the snapshot [{path}].")
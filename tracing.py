@@ -0,0 +1,229 @@
+"""Tracing of the updates and notification jobs. Each update or job gets a trace ID, which is
+attached to every log line, and the sampled traces are written as nested timed spans to the
+JSONL file. The slowest traces can be summarized offline:
+
+    python -m tracing --top 10
+"""
+
+import argparse
+import asyncio
+import atexit
+import json
+import random
+import threading
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from queue import SimpleQueue
+from secrets import token_hex
+from time import perf_counter, time
+from typing import Callable
+
+import globals as g
+
+current_span = ContextVar("current_span", default=None)
+
+
+class Exporter:
+    """Writes the finished spans to the JSONL file in a separate thread, so the event loop
+    is never blocked by the file writes.
+
+    Args:
+        path (str): path to the JSONL file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.queue = SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def export(self, span: dict):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, daemon=True)
+                    self.thread.start()
+                    atexit.register(self.stop)
+
+        self.queue.put(span)
+
+    def run(self):
+        with open(self.path, "a", encoding="utf-8") as file:
+            while (span := self.queue.get()) is not None:
+                file.write(json.dumps(span) + "\n")
+
+                if self.queue.empty():
+                    file.flush()
+
+    def stop(self):
+        """Writes the remaining spans and stops the thread."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+exporter = Exporter(g.TRACE_FILE)
+
+
+class Span:
+    """Timed operation in the trace. Spans of the sampled traces are exported when finished.
+
+    Args:
+        name (str): name of the operation.
+        parent (Span, optional): parent span, the new trace is started if not set.
+        attributes (dict, optional): attributes of the span.
+    """
+
+    def __init__(self, name: str, parent: "Span" = None, attributes: dict = None):
+        self.name = name
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else token_hex(8)
+        self.sampled = (
+            parent.sampled if parent else random.random() < g.TRACE_SAMPLE_RATE
+        )
+        self.span_id = token_hex(4)
+        self.attributes = attributes or {}
+
+        self.start = time()
+        self.started = perf_counter()
+        self.token = None
+
+    def finish(self, error: Exception = None):
+        if error is not None:
+            self.attributes["error"] = repr(error)
+
+        if self.sampled:
+            exporter.export(
+                {
+                    "trace_id": self.trace_id,
+                    "span_id": self.span_id,
+                    "parent_id": self.parent_id,
+                    "name": self.name,
+                    "start": self.start,
+                    "duration": perf_counter() - self.started,
+                    "attributes": self.attributes,
+                }
+            )
+
+    def __enter__(self) -> "Span":
+        self.token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        current_span.reset(self.token)
+        self.finish(exc)
+
+
+def trace(name: str, **attributes) -> Span:
+    """Starts the new trace, which is used as the context manager.
+
+    Args:
+        name (str): name of the root span, e.g. "update" or "notification".
+    """
+    return Span(name, attributes=attributes)
+
+
+def span(name: str, **attributes) -> Span:
+    """Starts the child span of the current span, which is used as the context manager. The
+    span outside of the trace is timed, but not exported.
+
+    Args:
+        name (str): name of the operation.
+    """
+    parent = current_span.get()
+
+    child = Span(name, parent, attributes)
+    if parent is None:
+        child.sampled = False
+
+    return child
+
+
+@contextmanager
+def activate(span: Span | None):
+    """Makes the span current in the block, e.g. in the worker, which processes the job
+    created in another task."""
+    token = current_span.set(span)
+    try:
+        yield span
+    finally:
+        current_span.reset(token)
+
+
+def traced(name: str) -> Callable:
+    """Decorator, which wraps the sync or async function in the span."""
+
+    def decorator(function: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(function):
+
+            @wraps(function)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+
+        else:
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_id() -> str:
+    """Returns the ID of the current trace or "-" if there is no trace."""
+    span = current_span.get()
+    return span.trace_id if span else "-"
+
+
+def summarize(path: str, top: int):
+    """Prints the slowest traces from the JSONL file with the tree of their spans."""
+    traces = {}
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            span = json.loads(line)
+            traces.setdefault(span["trace_id"], []).append(span)
+
+    roots = [
+        span for spans in traces.values() for span in spans if span["parent_id"] is None
+    ]
+    roots.sort(key=lambda span: span["duration"], reverse=True)
+
+    print(f"Traces: [{len(roots)}], spans: [{sum(map(len, traces.values()))}].")
+
+    for root in roots[:top]:
+        children = {}
+        for span in traces[root["trace_id"]]:
+            children.setdefault(span["parent_id"], []).append(span)
+
+        print()
+        print(f"trace [{root['trace_id']}] {root['duration'] * 1000:.1f} ms")
+
+        def show(span: dict, depth: int):
+            offset = (span["start"] - root["start"]) * 1000
+            attributes = " ".join(f"{k}={v}" for k, v in span["attributes"].items())
+            print(
+                f"{'  ' * depth}{span['name']} +{offset:.1f} ms "
+                f"{span['duration'] * 1000:.1f} ms {attributes}".rstrip()
+            )
+            for child in sorted(
+                children.get(span["span_id"], []), key=lambda s: s["start"]
+            ):
+                show(child, depth + 1)
+
+        show(root, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", nargs="?", default=g.TRACE_FILE)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    summarize(args.path, args.top)
@@ -0,0 +1,161 @@
+import asyncio
+
+from typing import Awaitable, Callable
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from aiogram.types import InputFile
+
+import globals as g
+
+import metrics
+
+from logger import Logger
+
+logger = Logger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookHandler:
+    """Receives updates from Telegram and answers immediately, while the updates are processed
+    by the dispatcher in background tasks. The number of updates processed at the same time is
+    limited, when the limit is reached the request waits for a free slot, so Telegram slows down
+    instead of the bot accumulating unbounded work.
+
+    Args:
+        dispatcher (Dispatcher): dispatcher to process updates with.
+        max_in_flight (int): maximum number of updates processed at the same time.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, max_in_flight: int):
+        self.dispatcher = dispatcher
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.tasks = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if g.WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != g.WEBHOOK_SECRET:
+            logger.warning(
+                f"Received webhook request with wrong secret token from [{request.remote}]."
+            )
+            return web.Response(status=403)
+
+        update = types.Update(**await request.json())
+
+        await self.semaphore.acquire()
+
+        Bot.set_current(self.dispatcher.bot)
+        Dispatcher.set_current(self.dispatcher)
+
+        task = asyncio.create_task(self.process(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        return web.Response(text="ok")
+
+    async def process(self, update: types.Update):
+        try:
+            await self.dispatcher.updates_handler.notify(update)
+        except Exception as error:
+            logger.error(
+                f"Error while processing update [{update.update_id}]: [{error}]."
+            )
+        finally:
+            self.semaphore.release()
+
+    async def wait_closed(self, timeout: float):
+        """Waits until the updates in progress are processed.
+
+        Args:
+            timeout (float): maximum time to wait in seconds.
+        """
+        if self.tasks:
+            logger.info(f"Waiting for [{len(self.tasks)}] updates in progress.")
+            await asyncio.wait(self.tasks, timeout=timeout)
+
+
+def create_app(dispatcher: Dispatcher) -> web.Application:
+    """Creates aiohttp application, which receives updates on [g.WEBHOOK_PATH].
+
+    Args:
+        dispatcher (Dispatcher): dispatcher to process updates with.
+
+    Returns:
+        web.Application: application with the webhook route.
+    """
+    handler = WebhookHandler(dispatcher, g.WEBHOOK_MAX_IN_FLIGHT)
+
+    app = web.Application()
+    app["webhook_handler"] = handler
+    app.router.add_post(g.WEBHOOK_PATH, handler.handle)
+    metrics.add_routes(app)
+
+    return app
+
+
+def start_webhook(
+    dispatcher: Dispatcher,
+    on_startup: Callable[[Dispatcher], Awaitable] = None,
+    on_shutdown: Callable[[Dispatcher], Awaitable] = None,
+):
+    """Registers the webhook in Telegram and starts the aiohttp server. The server listens on
+    plain HTTP, TLS is expected to be terminated by the proxy in front of it. The self-signed
+    certificate of the proxy can be uploaded to Telegram with [g.WEBHOOK_CERTIFICATE].
+
+    Args:
+        dispatcher (Dispatcher): dispatcher to process updates with.
+        on_startup (Callable, optional): coroutine function called with the dispatcher on startup.
+        on_shutdown (Callable, optional): coroutine function called with the dispatcher, when the
+            updates in progress are processed.
+    """
+    app = create_app(dispatcher)
+
+    async def on_app_startup(app: web.Application):
+        if on_startup:
+            await on_startup(dispatcher)
+
+        certificate = (
+            InputFile(g.WEBHOOK_CERTIFICATE) if g.WEBHOOK_CERTIFICATE else None
+        )
+
+        await dispatcher.bot.set_webhook(
+            g.WEBHOOK_URL,
+            certificate=certificate,
+            max_connections=g.WEBHOOK_MAX_CONNECTIONS,
+            secret_token=g.WEBHOOK_SECRET or None,
+        )
+
+        logger.info(f"Webhook is set to [{g.WEBHOOK_URL}].")
+
+    async def on_app_shutdown(app: web.Application):
+        # The webhook is not deleted, so other replicas keep receiving updates.
+        await app["webhook_handler"].wait_closed(g.WEBHOOK_SHUTDOWN_TIMEOUT)
+
+        if on_shutdown:
+            await on_shutdown(dispatcher)
+
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+
+        session = await dispatcher.bot.get_session()
+        await session.close()
+
+        logger.info("Webhook server stopped.")
+
+    app.on_startup.append(on_app_startup)
+    app.on_shutdown.append(on_app_shutdown)
+
+    logger.info(
+        f"Starting webhook server on [{g.WEBHOOK_HOST}:{g.WEBHOOK_PORT}{g.WEBHOOK_PATH}]."
+    )
+
+    # The scheduled jobs are bound to the current event loop on import, while run_app creates
+    # a new one if the loop is not passed.
+    web.run_app(
+        app,
+        host=g.WEBHOOK_HOST,
+        port=g.WEBHOOK_PORT,
+        print=None,
+        access_log=None,
+        loop=asyncio.get_event_loop(),
+    )